@@ -0,0 +1,141 @@
+"""Port Python (NumPy) của recordTrafficLights.m
+
+Tạo cột đèn Green/Yellow/Red lặp theo số dòng (nGreen, nYellow, nRed) với
+dt = median(diff(time_s)), rồi áp dụng ưu tiên xe cứu thương (AMBULANCE >= 1 -> Green).
+Đọc/ghi theo từng chunk nên chạy được với file lớn hơn bộ nhớ.
+
+Usage: python record_traffic_lights.py vehicle_counts.csv light_recorder.csv 7 3 8
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from traffic_control import detect_csv_columns
+
+DEFAULT_CHUNKSIZE = 1_000_000
+# light_recorder.csv ghi số thực với tối đa 9 chữ số thập phân, bỏ số 0 thừa
+FLOAT_DECIMALS = 9
+
+
+def matlab_mod(x, y):
+    """mod(x, y) giống MATLAB: bù sai số làm tròn khi x/y gần một số nguyên"""
+    q = x / y
+    n = np.floor(q)
+    q_round = np.round(q)
+    near_int = np.abs(q - q_round) <= np.finfo(float).eps * np.maximum(np.abs(q), 1.0)
+    n = np.where(near_int, q_round, n)
+    return x - n * y
+
+
+def light_schedule(t, t0, dt, n_green, n_yellow, n_red, preempt=None):
+    """Tính cột đèn cho mảng thời gian t (vector hóa)
+
+    preempt: mảng giá trị AMBULANCE, dòng nào >= 1 thì đèn thành Green.
+    """
+    t = np.asarray(t, dtype=float)
+    t_green = n_green * dt
+    t_yellow = n_yellow * dt
+    t_red = n_red * dt
+    cycle = t_green + t_yellow + t_red
+    tmod = matlab_mod(t - t0, cycle)
+
+    light = np.full(len(t), 'Red', dtype=object)
+    light[tmod < t_green] = 'Green'
+    light[(tmod >= t_green) & (tmod < t_green + t_yellow)] = 'Yellow'
+    if preempt is not None:
+        light[np.asarray(preempt, dtype=float) >= 1] = 'Green'
+    return light
+
+
+def format_float_column(values):
+    """Định dạng số thực như light_recorder.csv (0.066666667, 0.1, 1)"""
+    values = np.round(np.asarray(values, dtype=float), FLOAT_DECIMALS) + 0.0  # bỏ -0
+    text = np.char.mod(f'%.{FLOAT_DECIMALS}f', values)
+    text = np.char.rstrip(np.char.rstrip(text, '0'), '.')
+    return np.where(np.isnan(values), '', text)
+
+
+def _resolve_preempt_col(in_csv, preempt_col):
+    """Cột ưu tiên: AMBULANCE như bản MATLAB, nếu không có thì dùng cột emergency"""
+    header = pd.read_csv(in_csv, nrows=0)
+    columns = list(header.columns)
+    if 'time_s' not in columns:
+        raise ValueError("Input CSV must contain 'time_s'.")
+    if preempt_col is not None:
+        if preempt_col not in columns:
+            raise ValueError(f"Input CSV must contain '{preempt_col}' (case-sensitive).")
+        return preempt_col, columns
+    if 'AMBULANCE' in columns:
+        return 'AMBULANCE', columns
+    _, emergency_col, _ = detect_csv_columns(header)
+    if emergency_col is None:
+        raise ValueError("Input CSV must contain 'AMBULANCE' (case-sensitive).")
+    return emergency_col, columns
+
+
+def scan_timing(in_csv, chunksize=DEFAULT_CHUNKSIZE):
+    """Lượt 1: chỉ đọc cột time_s, trả về (t0, dt, số dòng)"""
+    t0 = None
+    last = None
+    diffs = []
+    n_rows = 0
+    for chunk in pd.read_csv(in_csv, usecols=['time_s'], chunksize=chunksize):
+        t = chunk['time_s'].to_numpy(dtype=float)
+        if not len(t):
+            continue
+        if t0 is None:
+            t0 = t[0]
+        if last is not None:
+            diffs.append(np.array([t[0] - last]))
+        diffs.append(np.diff(t))
+        last = t[-1]
+        n_rows += len(t)
+    if n_rows < 2:
+        raise ValueError("Need at least two timestamps.")
+    dt = float(np.median(np.concatenate(diffs)))
+    return t0, dt, n_rows
+
+
+def record_traffic_lights(in_csv, out_csv, n_green, n_yellow, n_red,
+                          preempt_col=None, chunksize=DEFAULT_CHUNKSIZE, dt=None):
+    """Ghi toàn bộ cột gốc + cột 'light' ra out_csv (giống recordTrafficLights.m)"""
+    preempt_col, columns = _resolve_preempt_col(in_csv, preempt_col)
+    t0, median_dt, n_rows = scan_timing(in_csv, chunksize)
+    if dt is None:
+        dt = median_dt
+    cycle = (n_green + n_yellow + n_red) * dt
+
+    out_columns = columns if 'light' in columns else columns + ['light']
+    with open(out_csv, 'w', newline='') as f:
+        f.write(','.join(out_columns) + '\n')
+        for chunk in pd.read_csv(in_csv, chunksize=chunksize):
+            chunk['light'] = light_schedule(chunk['time_s'].to_numpy(dtype=float), t0, dt,
+                                            n_green, n_yellow, n_red,
+                                            preempt=chunk[preempt_col].to_numpy())
+            chunk = chunk[out_columns]
+            for c in out_columns:
+                if pd.api.types.is_float_dtype(chunk[c]):
+                    chunk[c] = format_float_column(chunk[c].to_numpy())
+            chunk.to_csv(f, header=False, index=False, lineterminator='\n')
+
+    print(f"Recorded {n_rows} rows into {out_csv} (dt≈{dt:.6f}s, cycle≈{cycle:.6f}s)")
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record fixed-cycle traffic lights with ambulance preemption')
+    parser.add_argument('in_csv')
+    parser.add_argument('out_csv')
+    parser.add_argument('n_green', type=int)
+    parser.add_argument('n_yellow', type=int)
+    parser.add_argument('n_red', type=int)
+    parser.add_argument('--preempt-col', default=None, help="default: AMBULANCE, else detected emergency column")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args()
+    record_traffic_lights(args.in_csv, args.out_csv, args.n_green, args.n_yellow, args.n_red,
+                          preempt_col=args.preempt_col, chunksize=args.chunksize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""BatchRunner phải cho cùng chuỗi pha với TrafficController chạy từng tick (SimulatedClock)"""
+from datetime import datetime
+
+import numpy as np
+
+from traffic_batch import BatchRunner, emergency_commands
+from traffic_clock import SimulatedClock
+from traffic_control import EmergencyCommand, TrafficController
+from traffic_forecast import HoltForecaster
+
+START = datetime(2025, 9, 15, 8, 50)  # qua ranh giới giờ cao điểm 9:00
+DT = 0.1
+
+
+def _trace(n=20_000, seed=1):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) * DT
+    counts = np.clip(np.round(11 + 7 * np.sin(t / 40.0) + rng.normal(0, 2, n)), 0, None).astype(np.int64)
+    emergency = np.zeros(n, dtype=np.int64)
+    emergency[5000:5100] = 1
+    emergency[14000:14050] = 1
+    return counts, emergency
+
+
+def _controller(forecaster=None):
+    c = TrafficController(clock=SimulatedClock(start=START))
+    c.forecaster = forecaster
+    return c
+
+
+def _controller_states(controller, counts, emergency):
+    cmds = emergency_commands(emergency)
+    states = []
+    for count, cmd in zip(counts.tolist(), cmds.tolist()):
+        controller.update_state(count, EmergencyCommand(cmd))
+        states.append(controller._phase)
+        controller.clock.advance(DT)
+    return np.array(states)
+
+
+def _batch_states(controller, counts, emergency):
+    return BatchRunner(controller=controller, dt=DT, start=START).run(counts, emergency).state
+
+
+def test_batch_matches_controller():
+    counts, emergency = _trace()
+    expected = _controller_states(_controller(), counts, emergency)
+    np.testing.assert_array_equal(_batch_states(_controller(), counts, emergency), expected)
+
+
+def test_batch_matches_controller_with_forecaster():
+    counts, emergency = _trace()
+    expected = _controller_states(_controller(HoltForecaster()), counts, emergency)
+    batch = _batch_states(_controller(HoltForecaster()), counts, emergency)
+    np.testing.assert_array_equal(batch, expected)
+    # Dự báo phải thực sự đổi thời gian xanh so với dense/thin
+    assert not np.array_equal(batch, _batch_states(_controller(), counts, emergency))
+
+
+def test_batch_chunks_match_single_run():
+    counts, emergency = _trace()
+    expected = _batch_states(_controller(HoltForecaster()), counts, emergency)
+    runner = BatchRunner(controller=_controller(HoltForecaster()), dt=DT, start=START)
+    chunks = [runner.run(counts[i:i + 3000], emergency[i:i + 3000]).state for i in range(0, len(counts), 3000)]
+    np.testing.assert_array_equal(np.concatenate(chunks), expected)
+
+
+def _learned_controller():
+    from traffic_density_model import DensityModel, LearnedDensityClassifier
+    model = DensityModel(['count', 'trend'], [2.0, 1.5], 0.0, [11.0, 0.0], [4.0, 1.0], short=5, long=30)
+    c = _controller()
+    c.hysteresis = LearnedDensityClassifier(model)
+    return c
+
+
+def test_learned_classifier_chunks_match_single_run():
+    counts, emergency = _trace()
+    single = BatchRunner(controller=_learned_controller(), dt=DT, start=START).run(counts, emergency)
+    expected = _controller_states(_learned_controller(), counts, emergency)
+    np.testing.assert_array_equal(single.state, expected)
+
+    controller = _learned_controller()
+    runner = BatchRunner(controller=controller, dt=DT, start=START)
+    chunks = [runner.run(counts[i:i + 77], emergency[i:i + 77]) for i in range(0, len(counts), 77)]
+    np.testing.assert_array_equal(np.concatenate([r.ml_state for r in chunks]), single.ml_state)
+    np.testing.assert_array_equal(np.concatenate([r.state for r in chunks]), single.state)
+    runner.sync_controller()
+    assert controller.hysteresis.history() == counts[-30:].astype(float).tolist()
@@ -0,0 +1,26 @@
+"""CsvFollower phải đọc đúng các dòng mới, kể cả dòng đang ghi dở lúc bắt đầu theo dõi"""
+from traffic_follow import CsvFollower
+
+HEADER = b'timestamp,vehicle_count,emergency\n'
+
+
+def test_skip_old_rows_keeps_partial_line(tmp_path):
+    path = tmp_path / 'vehicle_counts.csv'
+    path.write_bytes(HEADER + b'2025-09-15 08:00:00,5,0\n2025-09-15 08:00:01,1')
+    follower = CsvFollower(str(path), from_start=False)
+    assert follower.poll() is None
+    with open(path, 'ab') as f:
+        f.write(b'7,0\n2025-09-15 08:00:02,9,1\n')
+    data = follower.poll()
+    assert data.counts.tolist() == [17, 9]
+    assert data.emergency.tolist() == [0, 1]
+    assert follower.rows_read == 2
+
+
+def test_skip_old_rows_without_newline_after_header(tmp_path):
+    path = tmp_path / 'vehicle_counts.csv'
+    path.write_bytes(HEADER + b'2025-09-15 08:00:00,4')
+    follower = CsvFollower(str(path), from_start=False)
+    with open(path, 'ab') as f:
+        f.write(b'2,0\n')
+    assert follower.poll().counts.tolist() == [42]
@@ -0,0 +1,79 @@
+"""Message lỗi từ detector phải bị bỏ cả, không làm dừng service"""
+import asyncio
+import json
+
+import pytest
+
+from traffic_control import EmergencyCommand
+from traffic_service import ControllerService, detector_message
+
+BAD_MESSAGES = [
+    b'{"source": "cam1", "count": 3, "sent": "abc"}',
+    b'{"source": "cam1", "count": 3, "sent": NaN}',
+    b'{"source": "cam1", "count": 1e400}',
+    b'{"source": "cam1", "count": NaN}',
+    b'{"source": "cam1", "count": "many"}',
+    b'{"source": "cam1", "count": 3, "emergency": "BOGUS"}',
+    b'{"source": "cam1", "count": 3, "emergency": 7}',
+    b'{"source": ["cam1"], "count": 3}',
+    b'not json',
+    b'[1, 2]',
+]
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.mark.parametrize('line', BAD_MESSAGES)
+def test_bad_message_is_rejected_whole(line):
+    async def scenario():
+        service = ControllerService(report_interval=0)
+        service.handle_line(detector_message(5, source='cam1'))
+        before = (dict(service.sources), service.pending_emergency, len(service._pending), service.messages)
+        reply = service.handle_line(line)
+        assert 'error' in reply
+        assert service.bad_messages == 1
+        assert (dict(service.sources), service.pending_emergency, len(service._pending),
+                service.messages) == before
+    _run(scenario())
+
+
+def test_bad_messages_do_not_stop_the_daemon():
+    async def scenario():
+        service = ControllerService(dt=0.01, report_interval=0)
+        serving = asyncio.create_task(service.serve(0.3))
+        await asyncio.sleep(0.02)
+        for line in BAD_MESSAGES:
+            service.handle_line(line)
+        service.handle_line(json.dumps({'source': 'cam1', 'count': 20, 'emergency': 'NS_PRIORITY'}).encode())
+        await serving  # không ném lỗi
+        assert service.ticks > 10
+        assert service.bad_messages == len(BAD_MESSAGES)
+        assert service.vehicle_count == 20
+        assert service.controller.emergency_active
+        assert service.end_to_end.summary()['count'] == 0
+        assert service.controller.emergency_command == EmergencyCommand.NS_PRIORITY
+    _run(scenario())
+
+
+def test_stale_sources_count_as_zero():
+    async def scenario():
+        service = ControllerService(stale_after=0.05, report_interval=0)
+        service.handle_line(detector_message(12, source='cam1'))
+        loop = asyncio.get_running_loop()
+        assert service._aggregate_count(loop.time()) == 12
+        assert service._aggregate_count(loop.time() + 1.0) == 0
+    _run(scenario())
+
+
+def test_tick_errors_surface_from_serve():
+    async def scenario():
+        service = ControllerService(dt=0.01, report_interval=0)
+
+        def broken_tick(now):
+            raise RuntimeError('tick failed')
+        service.tick = broken_tick
+        with pytest.raises(RuntimeError, match='tick failed'):
+            await asyncio.wait_for(service.serve(), 2.0)
+    _run(scenario())
@@ -0,0 +1,134 @@
+"""Replay tiếp từ checkpoint bất kỳ phải trùng khớp với replay liền một mạch"""
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from traffic_batch import BatchRunner, emergency_commands
+from traffic_clock import SimulatedClock
+from traffic_control import EmergencyCommand, TrafficController
+from traffic_forecast import HoltForecaster
+from traffic_snapshot import Snapshotter, find_checkpoint, load_snapshot, restore_bytes, resume_batch, snapshot_bytes
+
+START = datetime(2025, 9, 15, 8, 55)
+DT = 0.1
+
+
+def _trace(n=6000, seed=2):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) * DT
+    counts = np.clip(np.round(11 + 7 * np.sin(t / 30.0) + rng.normal(0, 2, n)), 0, None).astype(np.int64)
+    emergency = np.zeros(n, dtype=np.int64)
+    emergency[1500:1600] = 1
+    emergency[4200:4230] = 1
+    return counts, emergency
+
+
+def _controller(forecaster):
+    c = TrafficController(clock=SimulatedClock(start=START))
+    c.forecaster = HoltForecaster() if forecaster else None
+    return c
+
+
+def _record_checkpoints(pattern, counts, emergency, forecaster):
+    """Chạy controller từng tick như TrafficSimulator, ghi checkpoint mỗi 5 giây"""
+    controller = _controller(forecaster)
+    snap = Snapshotter(pattern, interval=5.0)
+    cmds = emergency_commands(emergency)
+    for i, (count, cmd, flag) in enumerate(zip(counts.tolist(), cmds.tolist(), emergency.tolist())):
+        controller.update_state(count, EmergencyCommand(cmd))
+        snap.maybe_save(controller, replay_row=i + 1, last_emergency_value=flag)
+        controller.clock.advance(DT)
+    return snap.seq
+
+
+@pytest.mark.parametrize('forecaster', [False, True])
+def test_resume_from_every_checkpoint_matches_full_replay(tmp_path, forecaster):
+    counts, emergency = _trace()
+    pattern = str(tmp_path / 'ckpt-{row}.snap')
+    n_checkpoints = _record_checkpoints(pattern, counts, emergency, forecaster)
+    full = BatchRunner(controller=_controller(forecaster), dt=DT, start=START).run(counts, emergency)
+
+    rows = sorted(int(p.name[5:-5]) for p in tmp_path.glob('ckpt-*.snap'))
+    assert len(rows) == n_checkpoints > 100
+    for row in rows:
+        path = find_checkpoint(pattern, row)
+        result, info = resume_batch(_controller(forecaster), path, counts, emergency, dt=DT, start=START)
+        assert info.replay_row == row
+        np.testing.assert_array_equal(result.state, full.state[row:], err_msg=f"checkpoint row {row}")
+        np.testing.assert_array_equal(result.t, full.t[row:])
+        np.testing.assert_array_equal(result.timestamps(), full.timestamps()[row:])
+
+
+def test_restore_onto_new_clock_keeps_elapsed_time():
+    controller = _controller(True)
+    for count in range(300):
+        controller.update_state(count % 20)
+        controller.clock.advance(DT)
+    data = snapshot_bytes(controller)
+    restored = TrafficController(clock=SimulatedClock(t0=1000.0))
+    restored.forecaster = HoltForecaster()
+    info = restore_bytes(restored, data)
+    assert restored._phase == controller._phase
+    assert restored.clock.time() - restored.state_start_time == pytest.approx(
+        info.clock_time - info.state_start_time)
+    assert restored.forecaster.level == controller.forecaster.level
+
+
+def test_load_snapshot_rejects_corruption(tmp_path):
+    path = tmp_path / 'c.snap'
+    path.write_bytes(snapshot_bytes(_controller(False))[:-1] + b'\0')
+    with pytest.raises(ValueError):
+        load_snapshot(_controller(False), str(path))
+
+
+def test_resume_with_learned_classifier_matches_full_replay(tmp_path):
+    from traffic_density_model import DensityModel, LearnedDensityClassifier
+    model = DensityModel(['count', 'trend'], [2.0, 1.5], 0.0, [11.0, 0.0], [4.0, 1.0], short=5, long=30)
+
+    def controller():
+        c = _controller(False)
+        c.hysteresis = LearnedDensityClassifier(model)
+        return c
+
+    counts, emergency = _trace()
+    pattern = str(tmp_path / 'ckpt-{row}.snap')
+    snap = Snapshotter(pattern, interval=20.0)
+    live = controller()
+    cmds = emergency_commands(emergency)
+    for i, (count, cmd, flag) in enumerate(zip(counts.tolist(), cmds.tolist(), emergency.tolist())):
+        live.update_state(count, EmergencyCommand(cmd))
+        snap.maybe_save(live, replay_row=i + 1, last_emergency_value=flag)
+        live.clock.advance(DT)
+    full = BatchRunner(controller=controller(), dt=DT, start=START).run(counts, emergency)
+    for path in sorted(tmp_path.glob('ckpt-*.snap')):
+        result, info = resume_batch(controller(), str(path), counts, emergency, dt=DT, start=START)
+        np.testing.assert_array_equal(result.ml_state, full.ml_state[info.replay_row:])
+        np.testing.assert_array_equal(result.state, full.state[info.replay_row:])
+
+
+@pytest.mark.parametrize('forecaster', [False, True])
+def test_restore_keeps_per_approach_state(forecaster):
+    counts, emergency = _trace(n=3000)
+    rng = np.random.default_rng(5)
+    approach = np.stack([counts, np.clip(counts + rng.integers(-8, 9, len(counts)), 0, None)], axis=1)
+    cmds = emergency_commands(emergency)
+
+    def step(c, i):
+        c.update_state(int(counts[i]), EmergencyCommand(int(cmds[i])), approach_counts=approach[i].tolist())
+        c.clock.advance(DT)
+        return c._phase
+
+    live = _controller(forecaster)
+    for i in range(1000):
+        step(live, i)
+    restored = _controller(forecaster)
+    restored.clock.set(live.clock.time())
+    restore_bytes(restored, snapshot_bytes(live), keep_time=True)
+    states = [h.current_state for h in live.approach_hysteresis]
+    assert [h.current_state for h in restored.approach_hysteresis] == states
+    if forecaster:
+        assert [f.level for f in restored.approach_forecasters] == [f.level for f in live.approach_forecasters]
+    else:
+        assert restored.approach_forecasters is None
+    assert [step(restored, i) for i in range(1000, len(counts))] == [step(live, i) for i in range(1000, len(counts))]
@@ -0,0 +1,37 @@
+"""DetectorHub: trộn luồng theo thời gian và xếp hàng lệnh emergency"""
+import pytest
+
+from traffic_control import EmergencyCommand
+from traffic_phases import GREEN_RULE, Phase, PhaseTable
+from traffic_streams import DetectorHub
+
+# Hướng 'Ped' không có pha ưu tiên emergency
+PHASES = PhaseTable(
+    [
+        Phase('NS_Green', 'EW_Green', GREEN_RULE, ('Green', 'Red', 'Red')),
+        Phase('EW_Green', 'Ped_Walk', GREEN_RULE, ('Red', 'Green', 'Red')),
+        Phase('Ped_Walk', 'NS_Green', 10, ('Red', 'Red', 'Green')),
+    ],
+    approaches=('NS', 'EW', 'Ped'),
+    emergency={1: 'NS_Green', 2: 'EW_Green'},
+)
+
+
+def test_simultaneous_edges_are_queued():
+    hub = DetectorHub(PHASES, {'NS': [(0.0, 3, 1)], 'EW': [(0.0, 4, 1)]})
+    assert hub.advance(0.0) == EmergencyCommand.NS_PRIORITY
+    assert hub.advance(0.1) == EmergencyCommand.EW_PRIORITY
+    assert hub.advance(0.2) == EmergencyCommand.NONE
+
+
+def test_edge_without_priority_phase_is_ignored():
+    hub = DetectorHub(PHASES, {'Ped': [(0.0, 2, 1)], 'EW': [(0.0, 4, 1)]})
+    assert hub.advance(0.0) == EmergencyCommand.EW_PRIORITY
+    assert not hub._queued
+    assert hub.advance(0.1) == EmergencyCommand.NONE
+
+
+def test_stream_going_backwards_is_rejected():
+    hub = DetectorHub(PHASES, {'NS': [(0.0, 1, 0), (1.0, 2, 0), (0.5, 3, 0)]})
+    with pytest.raises(ValueError, match='backwards'):
+        hub.advance(2.0)
@@ -0,0 +1,34 @@
+"""TimingPlan.ingest_log phải bỏ qua dòng hỏng và vẫn đọc tiếp phần mới của log"""
+from datetime import datetime
+
+import numpy as np
+
+from traffic_timing import TimingPlan
+
+
+def test_ingest_log_skips_bad_rows(tmp_path):
+    path = tmp_path / 'traffic_log.csv'
+    path.write_text('timestamp,vehicle_count\n'
+                    '2025-09-15 08:00:00,10\n'
+                    ',12\n'
+                    'not a time,14\n'
+                    '2025-09-15 08:01:00,\n'
+                    '2025-09-15 08:02:00,20\n')
+    plan = TimingPlan()
+    assert plan.ingest_log(str(path)) == 5
+    slot = TimingPlan.slot(datetime(2025, 9, 15, 8, 0))
+    assert plan.samples.sum() == plan.samples.reshape(-1)[slot] == 2
+    assert plan.sums.reshape(-1)[slot] == 30
+
+    with open(path, 'a') as f:
+        f.write('2025-09-15 09:00:00,5\n')
+    assert plan.ingest_log(str(path)) == 1
+    assert plan.samples.sum() == 3
+
+
+def test_update_ignores_nat_and_nan():
+    plan = TimingPlan()
+    plan.update(np.array(['2025-09-15T08:00', 'NaT', '2025-09-15T08:00'], dtype='datetime64[us]'),
+                [4.0, 8.0, np.nan])
+    assert plan.samples.sum() == 1
+    assert plan.sums.sum() == 4.0
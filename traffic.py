@@ -1,11 +1,14 @@
+# Lõi controller chỉ cần NumPy; pandas (đọc/ghi CSV) và matplotlib (TrafficSimulator)
+# được import trong hàm dùng tới để process nhúng controller / worker không phải trả giá
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
 import time
 from datetime import datetime, timedelta
 from enum import Enum
 import json
+from collections import namedtuple
+from traffic_clock import WallClock, SimulatedClock
+from traffic_log import LogBuffer, TIMESTAMP_FORMAT
+from traffic_phases import default_phase_table, legacy_phase_table, GREEN_RULE, YELLOW_RULE, ALL_RED_RULE, RULE_CODES
 
 class TrafficState(Enum):
     NS_GREEN = "NS_Green"
@@ -13,6 +16,12 @@ class TrafficState(Enum):
     EW_GREEN = "EW_Green"
     EW_YELLOW = "EW_Yellow"
     ALL_RED = "All_Red"
+    ALL_RED_2 = "All_Red_2"
+
+# Bảng pha mặc định (NS/EW luân phiên) đã biên dịch; LEGACY_PHASES: chu kỳ 5 pha cũ
+DEFAULT_PHASES = default_phase_table(TrafficState)
+LEGACY_PHASES = legacy_phase_table(TrafficState)
+_GREEN, _YELLOW, _ALL_RED = RULE_CODES[GREEN_RULE], RULE_CODES[YELLOW_RULE], RULE_CODES[ALL_RED_RULE]
 
 class EmergencyCommand(Enum):
     NONE = 0
@@ -34,11 +43,38 @@ class DenseThinHysteresis:
         # Hysteresis: giữ nguyên state nếu ở giữa 2 ngưỡng
         return self.current_state
 
+    def classify_array(self, counts, initial_state=None):
+        """Phân loại cả mảng số xe một lần (vector hóa), cùng ngữ nghĩa với classify()
+
+        Trả về (states, final_state). Nếu không truyền initial_state thì bắt đầu từ
+        current_state và cập nhật current_state như khi gọi classify() lần lượt;
+        nếu truyền initial_state thì không thay đổi đối tượng (dùng cho xử lý theo chunk).
+        """
+        counts = np.asarray(counts)
+        start_state = self.current_state if initial_state is None else int(initial_state)
+        # 1: dense, 0: thin, -1: ở giữa 2 ngưỡng -> giữ state trước đó
+        decided = np.where(counts >= self.dense_thresh, 1,
+                           np.where(counts <= self.thin_thresh, 0, -1)).astype(np.int8)
+        # Forward-fill: lấy giá trị của vị trí quyết định gần nhất
+        idx = np.where(decided >= 0, np.arange(len(decided)), -1)
+        np.maximum.accumulate(idx, out=idx)
+        states = np.where(idx >= 0, decided[np.maximum(idx, 0)], start_state).astype(np.int8)
+        final_state = int(states[-1]) if len(states) else start_state
+        if initial_state is None:
+            self.current_state = final_state
+        return states, final_state
+
 class TrafficController:
-    def __init__(self):
-        # States
-        self.current_state = TrafficState.NS_GREEN
-        self.state_start_time = time.time()
+    def __init__(self, clock=None, log=None, phases=None):
+        # Clock (WallClock mặc định; SimulatedClock để chạy nhanh hơn thời gian thực)
+        self.clock = clock if clock is not None else WallClock()
+
+        # Bảng pha (traffic_phases.PhaseTable), mặc định 5 pha NS/EW
+        self.phases = phases if phases is not None else DEFAULT_PHASES
+
+        # States (chỉ số pha trong bảng; current_state là key của pha)
+        self._phase = 0
+        self.state_start_time = self.clock.time()
         
         # Timing parameters
         self.base_green_time = 30  # seconds
@@ -50,44 +86,92 @@ class TrafficController:
         self.hysteresis = DenseThinHysteresis()
         self.ml_enabled = True
         self.ml_adjustment_factor = 0.5  # Điều chỉnh dựa trên ML
+        # traffic_forecast.HoltForecaster: nếu có thì thời gian xanh tính theo số xe dự báo
+        # cho pha kế tiếp; tăng dần từ 0 tới ml_adjustment_factor trong khoảng số xe này
+        self.forecaster = None
+        self.forecast_demand_range = (8, 15)
+        # Số xe mới nhất của từng hướng (traffic_streams.DetectorHub): nếu có thì pha xanh
+        # được tính theo nhu cầu của chính các hướng nó phục vụ, mỗi hướng một hysteresis
+        self.approach_counts = None
+        self.approach_ml = None
+        self.approach_hysteresis = None
+        self.approach_forecasters = None  # forecaster.clone() cho từng hướng (nếu có forecaster)
         
         # Emergency handling
         self.emergency_active = False
         self.emergency_command = EmergencyCommand.NONE
         self.emergency_start_time = 0
-        self.pre_emergency_state = TrafficState.NS_GREEN
+        self.pre_emergency_state = self.phases.keys[0]
         
         # Schedule-based timing (giờ cao điểm vs bình thường)
         self.rush_hours = [(7, 9), (17, 19)]  # 7-9AM, 5-7PM
         self.rush_hour_multiplier = 1.3
-        
-        # Data logging
-        self.log_data = {
-            'timestamp': [],
-            'state': [],
-            'ns_light': [],
-            'ew_light': [],
-            'vehicle_count': [],
-            'ml_state': [],
-            'emergency': [],
-            'duration': []
-        }
+        # traffic_timing.TimingPlan: nếu có thì thay cho rush_hours (hệ số theo ô 15 phút)
+        self.timing_plan = None
+        
+        # Data logging (ring buffer dạng cột, có giới hạn dung lượng)
+        self.log = log if log is not None else LogBuffer(state_names=self.phases.names)
+        if self.log.state_names is None:
+            self.log.state_names = self.phases.names
+        # traffic_shm.StatePublisher: nếu có thì mỗi tick ghi trạng thái vào shared memory
+        self.publisher = None
+        # traffic_metrics.ControllerMetrics: đo độ trễ tick, chuyển pha, emergency (None = tắt)
+        self.metrics = None
+
+    @property
+    def current_state(self):
+        return self.phases.keys[self._phase]
+
+    @current_state.setter
+    def current_state(self, state):
+        self._phase = self.phases.index[state]
+
+    @property
+    def log_data(self):
+        """Log dạng dict-of-lists (giữ tương thích, tạo mới mỗi lần gọi)"""
+        df = self.log.to_frame()
+        data = {col: df[col].tolist() for col in df.columns}
+        data['timestamp'] = [ts.to_pydatetime() for ts in df['timestamp']]
+        return data
 
     def is_rush_hour(self):
         """Kiểm tra có phải giờ cao điểm không"""
-        current_hour = datetime.now().hour
+        if self.timing_plan is not None:
+            return self.timing_plan.multiplier_at(self.clock.now()) > 1.0
+        current_hour = self.clock.now().hour
         return any(start <= current_hour < end for start, end in self.rush_hours)
 
-    def calculate_green_duration(self, ml_state, vehicle_count):
-        """Tính thời gian đèn xanh dựa trên ML và lịch"""
+    def timing_multiplier(self):
+        """Hệ số nhân thời gian xanh theo lịch (timing plan, hoặc rush_hours nếu không có)"""
+        if self.timing_plan is not None:
+            return self.timing_plan.multiplier_at(self.clock.now())
+        return self.rush_hour_multiplier if self.is_rush_hour() else 1.0
+
+    def calculate_green_duration(self, ml_state, vehicle_count, served=None):
+        """Tính thời gian đèn xanh dựa trên ML và lịch
+
+        served: chỉ số các hướng được xanh; nếu có forecaster theo hướng thì dự báo lấy
+        theo hướng có nhu cầu lớn nhất trong số đó thay vì tổng số xe.
+        """
         base_time = self.base_green_time
         
-        # Điều chỉnh theo giờ cao điểm
-        if self.is_rush_hour():
+        # Điều chỉnh theo giờ cao điểm / timing plan
+        if self.timing_plan is not None:
+            base_time *= self.timing_plan.multiplier_at(self.clock.now())
+        elif self.is_rush_hour():
             base_time *= self.rush_hour_multiplier
         
+        # Điều chỉnh theo dự báo nhu cầu trong pha kế tiếp (nếu có forecaster)
+        if self.ml_enabled and self.forecaster is not None:
+            low, high = self.forecast_demand_range
+            if served and self.approach_forecasters is not None:
+                predicted = max(self.approach_forecasters[a].predict(base_time) for a in served)
+            else:
+                predicted = self.forecaster.predict(base_time)
+            fraction = min(1.0, max(0.0, (predicted - low) / (high - low)))
+            base_time += base_time * self.ml_adjustment_factor * fraction
         # Điều chỉnh theo ML (dense/thin)
-        if self.ml_enabled and ml_state == 1:  # dense
+        elif self.ml_enabled and ml_state == 1:  # dense
             adjustment = base_time * self.ml_adjustment_factor
             base_time += adjustment
         
@@ -99,16 +183,21 @@ class TrafficController:
         if emergency_cmd != EmergencyCommand.NONE and not self.emergency_active:
             self.emergency_active = True
             self.emergency_command = emergency_cmd
-            self.emergency_start_time = time.time()
+            self.emergency_start_time = self.clock.time()
             self.pre_emergency_state = self.current_state
             
-            # Chuyển về All Red trước
-            self.current_state = TrafficState.ALL_RED
-            self.state_start_time = time.time()
+            # Chuyển về pha dọn giao lộ (All Red) trước
+            self._phase = self.phases.clearance
+            self.state_start_time = self.clock.time()
 
-    def update_state(self, vehicle_count=10, emergency_cmd=EmergencyCommand.NONE):
-        """Cập nhật trạng thái hệ thống"""
-        current_time = time.time()
+    def update_state(self, vehicle_count=10, emergency_cmd=EmergencyCommand.NONE, approach_counts=None):
+        """Cập nhật trạng thái hệ thống (approach_counts: số xe theo phases.approaches, nếu có)"""
+        metrics = self.metrics
+        if metrics is not None:
+            tick_start = time.perf_counter()
+            prev_phase = self._phase
+            prev_emergency = self.emergency_active
+        current_time = self.clock.time()
         elapsed = current_time - self.state_start_time
         
         # Xử lý emergency
@@ -117,6 +206,13 @@ class TrafficController:
         
         # ML classification
         ml_state = self.hysteresis.classify(vehicle_count)
+        if self.forecaster is not None:
+            self.forecaster.update(vehicle_count, current_time)
+        if approach_counts is not None:
+            self._classify_approaches(approach_counts, current_time)
+        else:
+            # Không có số xe theo hướng ở tick này: không dùng lại dữ liệu cũ
+            self.approach_counts = self.approach_ml = None
         
         # State machine logic
         if self.emergency_active:
@@ -126,99 +222,91 @@ class TrafficController:
         
         # Log data
         self._log_current_state(vehicle_count, ml_state, emergency_cmd)
+        if self.publisher is not None:
+            self.publisher.publish(self, vehicle_count, ml_state)
+        if metrics is not None:
+            metrics.observe_tick(self, time.perf_counter() - tick_start, prev_phase, prev_emergency)
         
         return self.get_light_states()
 
     def _handle_emergency_states(self, elapsed):
         """Xử lý các trạng thái trong tình huống khẩn cấp"""
-        if self.current_state == TrafficState.ALL_RED:
-            if elapsed >= self.all_red_time:
+        phases = self.phases
+        if self._phase == phases.clearance:
+            if elapsed >= self._phase_duration(self._phase, 0, 0):
                 # Chuyển sang đèn xanh ưu tiên
-                if self.emergency_command == EmergencyCommand.NS_PRIORITY:
-                    self.current_state = TrafficState.NS_GREEN
-                else:  # EW_PRIORITY
-                    self.current_state = TrafficState.EW_GREEN
-                self.state_start_time = time.time()
+                self._phase = phases.emergency[self.emergency_command.value]
+                self.state_start_time = self.clock.time()
         
-        elif self.current_state in [TrafficState.NS_GREEN, TrafficState.EW_GREEN]:
+        elif phases.is_green[self._phase]:
             if elapsed >= self.emergency_green_time:
                 # Kết thúc emergency, về vàng rồi quay lại chu kỳ
-                if self.current_state == TrafficState.NS_GREEN:
-                    self.current_state = TrafficState.NS_YELLOW
-                else:
-                    self.current_state = TrafficState.EW_YELLOW
-                self.state_start_time = time.time()
+                self._phase = phases.next[self._phase]
+                self.state_start_time = self.clock.time()
                 self.emergency_active = False
 
+    def _classify_approaches(self, approach_counts, current_time):
+        """Lưu số xe theo hướng, phân loại dense/thin và cập nhật forecaster riêng cho từng hướng"""
+        if self.approach_hysteresis is None:
+            h = self.hysteresis
+            dense = getattr(h, 'dense_thresh', 15)
+            thin = getattr(h, 'thin_thresh', 8)
+            self.approach_hysteresis = [DenseThinHysteresis(dense, thin) for _ in self.phases.approaches]
+        self.approach_counts = approach_counts
+        self.approach_ml = [h.classify(count) for h, count in zip(self.approach_hysteresis, approach_counts)]
+        if self.forecaster is not None:
+            if self.approach_forecasters is None:
+                self.approach_forecasters = [self.forecaster.clone() for _ in self.phases.approaches]
+            for f, count in zip(self.approach_forecasters, approach_counts):
+                f.update(count, current_time)
+
+    def _phase_duration(self, phase, ml_state, vehicle_count):
+        """Thời gian của một pha theo luật trong bảng pha"""
+        rule = self.phases.rule[phase]
+        if rule == _GREEN:
+            served = self.phases.green_approaches[phase]
+            if self.approach_counts is not None and served:
+                # Theo hướng có nhu cầu lớn nhất trong các hướng được xanh
+                ml_state = max(self.approach_ml[a] for a in served)
+                vehicle_count = max(self.approach_counts[a] for a in served)
+                return self.calculate_green_duration(ml_state, vehicle_count, served)
+            return self.calculate_green_duration(ml_state, vehicle_count)
+        if rule == _YELLOW:
+            return self.yellow_time
+        if rule == _ALL_RED:
+            return self.all_red_time
+        return self.phases.fixed[phase]
+
     def _handle_normal_states(self, elapsed, ml_state, vehicle_count):
-        """Xử lý chu kỳ bình thường"""
-        if self.current_state == TrafficState.NS_GREEN:
-            green_duration = self.calculate_green_duration(ml_state, vehicle_count)
-            if elapsed >= green_duration:
-                self.current_state = TrafficState.NS_YELLOW
-                self.state_start_time = time.time()
-        
-        elif self.current_state == TrafficState.NS_YELLOW:
-            if elapsed >= self.yellow_time:
-                self.current_state = TrafficState.ALL_RED
-                self.state_start_time = time.time()
-        
-        elif self.current_state == TrafficState.EW_GREEN:
-            green_duration = self.calculate_green_duration(ml_state, vehicle_count)
-            if elapsed >= green_duration:
-                self.current_state = TrafficState.EW_YELLOW
-                self.state_start_time = time.time()
-        
-        elif self.current_state == TrafficState.EW_YELLOW:
-            if elapsed >= self.yellow_time:
-                self.current_state = TrafficState.ALL_RED
-                self.state_start_time = time.time()
-        
-        elif self.current_state == TrafficState.ALL_RED:
-            if elapsed >= self.all_red_time:
-                # Chuyển sang pha tiếp theo trong chu kỳ
-                if self.pre_emergency_state == TrafficState.NS_YELLOW or \
-                   self.current_state == TrafficState.ALL_RED:
-                    self.current_state = TrafficState.EW_GREEN
-                else:
-                    self.current_state = TrafficState.NS_GREEN
-                self.state_start_time = time.time()
+        """Xử lý chu kỳ bình thường: hết thời gian pha thì chuyển sang pha kế tiếp"""
+        if elapsed >= self._phase_duration(self._phase, ml_state, vehicle_count):
+            self._phase = self.phases.next[self._phase]
+            self.state_start_time = self.clock.time()
 
     def get_light_states(self):
-        """Trả về trạng thái đèn hiện tại"""
-        ns_lights = {'red': False, 'yellow': False, 'green': False}
-        ew_lights = {'red': False, 'yellow': False, 'green': False}
-        
-        if self.current_state == TrafficState.NS_GREEN:
-            ns_lights['green'] = True
-            ew_lights['red'] = True
-        elif self.current_state == TrafficState.NS_YELLOW:
-            ns_lights['yellow'] = True
-            ew_lights['red'] = True
-        elif self.current_state == TrafficState.EW_GREEN:
-            ns_lights['red'] = True
-            ew_lights['green'] = True
-        elif self.current_state == TrafficState.EW_YELLOW:
-            ns_lights['red'] = True
-            ew_lights['yellow'] = True
-        elif self.current_state == TrafficState.ALL_RED:
-            ns_lights['red'] = True
-            ew_lights['red'] = True
-        
-        return ns_lights, ew_lights
+        """Trả về trạng thái đèn hiện tại (mỗi hướng một mapping chỉ đọc, tạo sẵn)"""
+        return self.phases.light_maps[self._phase]
+
+    def get_light_outputs(self):
+        """Trạng thái đèn dạng chuỗi cho từng hướng, vd. ('Green', 'Red')"""
+        return self.phases.lights[self._phase]
 
     def _log_current_state(self, vehicle_count, ml_state, emergency_cmd):
         """Ghi log dữ liệu"""
-        ns_lights, ew_lights = self.get_light_states()
-        
-        self.log_data['timestamp'].append(datetime.now())
-        self.log_data['state'].append(self.current_state.value)
-        self.log_data['ns_light'].append(self._lights_to_string(ns_lights))
-        self.log_data['ew_light'].append(self._lights_to_string(ew_lights))
-        self.log_data['vehicle_count'].append(vehicle_count)
-        self.log_data['ml_state'].append(ml_state)
-        self.log_data['emergency'].append(emergency_cmd.value)
-        self.log_data['duration'].append(time.time() - self.state_start_time)
+        now = self.clock.time()
+        timestamp_us = round(now * 1e6)
+        if self.log.origin is None:
+            self.log.set_origin(self.clock.now(), timestamp_us)
+        
+        ns_code, ew_code = self.phases.log_light_codes[self._phase]
+        self.log.append(timestamp_us,
+                        self._phase,
+                        ns_code,
+                        ew_code,
+                        vehicle_count,
+                        ml_state,
+                        emergency_cmd.value,
+                        now - self.state_start_time)
 
     def _lights_to_string(self, lights):
         """Chuyển trạng thái đèn thành chuỗi"""
@@ -230,17 +318,206 @@ class TrafficController:
             return 'Green'
         return 'Off'
 
+    def close_log(self):
+        """Gửi nốt log còn lại cho sink (nếu có) và đóng sink"""
+        if self.log.sink is not None:
+            self.log.drain()
+            self.log.sink.close()
+            sink = self.log.sink
+            print(f"Log streamed to {len(sink.files)} file(s) ({sink.rows_written} rows, "
+                  f"last: {sink.files[-1] if sink.files else '-'})")
+
     def save_log(self, filename='traffic_log.csv'):
         """Lưu log ra file CSV"""
-        df = pd.DataFrame(self.log_data)
-        df.to_csv(filename, index=False)
+        df = self.log.to_frame()
+        df.to_csv(filename, index=False, date_format=TIMESTAMP_FORMAT)
         print(f"Log saved to {filename}")
 
+def detect_csv_columns(df):
+    """Dò cột số xe, cột emergency và các cột thành phần trong DataFrame
+
+    Trả về (vehicle_col, emergency_col, components).
+    """
+    import pandas as pd
+    vehicle_col = None
+    emergency_col = None
+    components = []
+    # Detect vehicle count column (prefer 'total', then 'vehicle_count', 'count', 'counts_ts')
+    candidate_vehicle_cols = ['total', 'vehicle_count', 'count', 'counts_ts', 'vehicles']
+    for c in df.columns:
+        if c.lower() in [cv.lower() for cv in candidate_vehicle_cols]:
+            vehicle_col = c
+            break
+    # Detect emergency column
+    candidate_emg_cols = ['EMERGENCY', 'emergency', 'is_emergency', 'priority']
+    for c in df.columns:
+        if c in candidate_emg_cols or c.lower() in [ce.lower() for ce in candidate_emg_cols]:
+            emergency_col = c
+            break
+    # If no single vehicle count column, try to derive by summing components
+    if vehicle_col is None:
+        # candidate component columns commonly found
+        component_candidates = ['car', 'truck', 'bus', 'motorbike', 'bike', 'van', 'suv', 'police_car']
+        lower_cols = {c.lower(): c for c in df.columns}
+        for cand in component_candidates:
+            if cand in lower_cols:
+                components.append(lower_cols[cand])
+        # As a fallback, include all numeric columns except time-like and emergency columns
+        if not components:
+            exclude_like = ['time', 'timestamp', 'date', 'datetime']
+            for c in df.columns:
+                if c == emergency_col:
+                    continue
+                lc = c.lower()
+                if any(x in lc for x in exclude_like):
+                    continue
+                if pd.api.types.is_numeric_dtype(df[c]):
+                    components.append(c)
+    return vehicle_col, emergency_col, components
+
+
+EMERGENCY_TRUE_STRINGS = ['1', 'true', 'yes', 'y']
+
+VehicleArrays = namedtuple('VehicleArrays', ['counts', 'emergency', 'emergency_edges', 'time_s',
+                                             'vehicle_col', 'emergency_col', 'components'])
+VehicleArrays.__doc__ = """Dữ liệu CSV số xe đã biên dịch thành mảng NumPy liên tục"""
+
+
+def parse_emergency_flags(values):
+    """Chuyển cột emergency (số hoặc chuỗi) thành mảng cờ: 0, 1 hoặc 2 (giá trị khác)
+
+    Số được cắt phần thập phân như int(float(x)); chuỗi không phải số thì so với
+    EMERGENCY_TRUE_STRINGS. Chỉ phân biệt 0 / 1 / khác nên dùng int8.
+    """
+    import pandas as pd
+    values = pd.Series(values)
+    numeric = pd.to_numeric(values, errors='coerce')
+    text = values.astype(str).str.lower().isin(EMERGENCY_TRUE_STRINGS)
+    flags = np.where(numeric.notna(), np.trunc(numeric.fillna(0).to_numpy(dtype=float)), text.to_numpy(dtype=float))
+    return np.where((flags == 0) | (flags == 1), flags, 2).astype(np.int8)
+
+
+def emergency_rising_edges(flags, last_value=0):
+    """Chỉ số các dòng mà cờ emergency đổi từ 0 lên 1 (last_value: cờ trước dòng đầu)"""
+    flags = np.asarray(flags)
+    rising = flags == 1
+    if len(flags):
+        rising[0] &= last_value == 0
+        rising[1:] &= flags[:-1] == 0
+    return np.flatnonzero(rising)
+
+
+def compile_vehicle_frame(df, vehicle_col, emergency_col, components):
+    """Mảng (counts, emergency, time_s) cho một khối DataFrame"""
+    import pandas as pd
+    if vehicle_col is not None:
+        total = pd.to_numeric(df[vehicle_col], errors='coerce').fillna(0).to_numpy(dtype=float)
+    else:
+        total = df[components].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=float).sum(axis=1)
+    counts = np.maximum(total, 0).astype(np.int64)
+    if emergency_col is not None:
+        emergency = parse_emergency_flags(df[emergency_col].to_numpy())
+    else:
+        emergency = np.zeros(len(df), dtype=np.int8)
+    time_s = df['time_s'].to_numpy(dtype=float) if 'time_s' in df.columns else None
+    return counts, emergency, time_s
+
+
+def load_vehicle_arrays(csv_path, chunksize=None, sample_rows=1000, cache=False):
+    """Đọc CSV số xe một lần và biên dịch các cột đã dò thành mảng NumPy
+
+    chunksize: nếu có, cột được dò trên `sample_rows` dòng đầu rồi file được đọc theo
+    khối (chỉ các cột cần dùng) để không giữ cả DataFrame trong bộ nhớ.
+    cache: dùng trace nhị phân `<csv>.trace` (traffic_trace) mở bằng memmap, chỉ parse
+    lại khi CSV mới hơn cache.
+    Trả về VehicleArrays; counts là None nếu không tìm thấy cột số xe.
+    """
+    if cache:
+        from traffic_trace import DEFAULT_CHUNKSIZE, open_trace
+        try:
+            return open_trace(csv_path, chunksize=chunksize or DEFAULT_CHUNKSIZE).vehicle_arrays()
+        except ValueError:
+            pass  # không có cột số xe: để đường đọc CSV bên dưới báo như cũ
+    import pandas as pd
+    if chunksize is None:
+        df = pd.read_csv(csv_path)
+        vehicle_col, emergency_col, components = detect_csv_columns(df)
+        chunks = [df]
+    else:
+        sample = pd.read_csv(csv_path, nrows=sample_rows)
+        vehicle_col, emergency_col, components = detect_csv_columns(sample)
+        has_time = 'time_s' in sample.columns
+        usecols = [vehicle_col] if vehicle_col is not None else list(components)
+        usecols += [c for c in (emergency_col, 'time_s' if has_time else None) if c is not None]
+        chunks = pd.read_csv(csv_path, usecols=usecols, chunksize=chunksize) if usecols else []
+    if vehicle_col is None and not components:
+        return VehicleArrays(None, None, None, None, vehicle_col, emergency_col, components)
+
+    parts = [compile_vehicle_frame(chunk, vehicle_col, emergency_col, components) for chunk in chunks]
+    counts = np.concatenate([p[0] for p in parts]) if parts else np.zeros(0, dtype=np.int64)
+    emergency = np.concatenate([p[1] for p in parts]) if parts else np.zeros(0, dtype=np.int8)
+    time_s = np.concatenate([p[2] for p in parts]) if parts and parts[0][2] is not None else None
+    return VehicleArrays(counts, emergency, emergency_rising_edges(emergency), time_s,
+                         vehicle_col, emergency_col, components)
+
+class RingSeries:
+    """Lịch sử cố định `capacity` điểm cho nhiều cột
+
+    Mỗi giá trị được ghi hai lần (i và i + capacity) nên append là O(1) và view()
+    trả về đoạn liên tục theo thứ tự thời gian mà không cần copy.
+    """
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self._data = {c: np.zeros(2 * capacity) for c in columns}
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, **values):
+        i = self._next
+        for column, value in values.items():
+            data = self._data[column]
+            data[i] = value
+            data[i + self.capacity] = value
+        self._next = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def view(self, column):
+        end = self._next + self.capacity
+        return self._data[column][end - self._size:end]
+
+    def last(self, column):
+        return self._data[column][self._next + self.capacity - 1] if self._size else None
+
+
+RENDER_MODES = ('legacy', 'blit')
+
+
 class TrafficSimulator:
     """Mô phỏng hệ thống điều khiển đèn giao thông"""
-    def __init__(self):
-        self.controller = TrafficController()
+    def __init__(self, log_sink=None, csv_chunksize=None, follow_csv=None, follow_max_rows=100,
+                 render='legacy', history=200, render_interval_ms=100, control_interval_ms=100,
+                 snapshot_path=None, snapshot_interval=10.0, trace_cache=False, start_time=None):
+        # log_sink: traffic_log_sink.LogSink để ghi log dần ra đĩa thay vì lưu khi thoát
+        # csv_chunksize: đọc CSV theo khối (file xuất từ detector cỡ GB)
+        # follow_csv: theo dõi file CSV đang được detector ghi thêm thay vì lặp lại file tĩnh
+        # render: 'legacy' (mỗi frame một tick, vẽ lại cả figure) hoặc 'blit' (tick điều khiển
+        #   chạy bằng timer riêng, frame chỉ vẽ lại các artist thay đổi)
+        # snapshot_path: ghi snapshot trạng thái định kỳ (traffic_snapshot); nếu file đã có
+        #   thì khôi phục controller và replay CSV tiếp từ dòng đã lưu
+        # trace_cache: đọc CSV qua trace nhị phân memmap (traffic_trace); start_time: bắt đầu
+        #   replay từ dòng đầu tiên có time_s >= start_time thay vì dòng 0
+        import matplotlib.pyplot as plt
+        if render not in RENDER_MODES:
+            raise ValueError(f"render must be one of {RENDER_MODES}")
+        log = LogBuffer(sink=log_sink) if log_sink is not None else None
+        self.controller = TrafficController(log=log)
         self.running = False
+        self.render = render
+        self.render_interval_ms = render_interval_ms
+        self.control_interval_ms = control_interval_ms
         
         # Visualization
         self.fig, (self.ax1, self.ax2) = plt.subplots(2, 1, figsize=(12, 8))
@@ -248,24 +525,64 @@ class TrafficSimulator:
         
         # Simulation parameters
         self.simulation_speed = 1.0  # 1.0 = real time
-        self.vehicle_counts = []
-        self.timestamps = []
+        # Lịch sử cố định cho đồ thị: thời gian, số xe và trạng thái ML ghi lại ở mỗi tick
+        self.history = RingSeries(history, ('t', 'count', 'ml'))
+        self.last_vehicle_count = 0
+        self._control_timer = None
+        self._t_start = None
 
         # CSV-driven simulation data (Track A integration)
-        self.csv_df = None
+        # Các cột đã biên dịch thành mảng khi tải CSV (xem load_vehicle_arrays)
+        self.csv_counts = None
+        self.csv_emergency = None
+        self.csv_time = None
         self.csv_idx = 0
         self.csv_enabled = False
         self.csv_vehicle_col = None
         self.csv_emergency_col = None
         self.csv_vehicle_components = []
         self.last_emergency_value = 0  # Track previous emergency state
-        # Prefer calibrated dataset if present
-        self._try_load_csv('vehicle_counts_calibrated.csv')
-        if not self.csv_enabled:
-            self._try_load_csv('vehicle_counts.csv')
+        self.follower = None
+        self.follow_max_rows = follow_max_rows
+        self.follow_vehicle_count = 0
+        if follow_csv is not None:
+            from traffic_follow import CsvFollower
+            self.follower = CsvFollower(follow_csv)
+            print(f"Following CSV '{follow_csv}'")
+        else:
+            # Prefer calibrated dataset if present
+            self._try_load_csv('vehicle_counts_calibrated.csv', csv_chunksize, trace_cache)
+            if not self.csv_enabled:
+                self._try_load_csv('vehicle_counts.csv', csv_chunksize, trace_cache)
+            if start_time is not None and self.csv_enabled and self.csv_time is not None:
+                from traffic_trace import time_index
+                self.csv_idx = time_index(self.csv_time, start_time)
+
+        self.snapshotter = None
+        if snapshot_path is not None:
+            self._restore_snapshot(snapshot_path, snapshot_interval)
+
+    def _restore_snapshot(self, path, interval):
+        """Khôi phục từ snapshot (nếu có) và bắt đầu ghi snapshot định kỳ"""
+        import os
+        from traffic_snapshot import Snapshotter, SnapshotError, load_snapshot
+        self.snapshotter = Snapshotter(path, interval)
+        if not os.path.exists(path):
+            return
+        try:
+            info = load_snapshot(self.controller, path)
+        except SnapshotError as e:
+            print(f"Ignoring snapshot '{path}': {e}")
+            return
+        if info.replay_row is not None and self.csv_enabled:
+            self.csv_idx = info.replay_row
+            self.last_emergency_value = info.last_emergency_value
+        print(f"Restored controller state from '{path}' "
+              f"({self.controller.phases.names[self.controller._phase]}, row {info.replay_row})")
 
     def setup_visualization(self):
         """Thiết lập giao diện hiển thị"""
+        import matplotlib.pyplot as plt
         # Traffic lights visualization - Single column
         self.ax1.set_xlim(-1, 1)
         self.ax1.set_ylim(-1, 3)
@@ -289,48 +606,47 @@ class TrafficSimulator:
         
         # Vehicle count plot
         self.ax2.set_title('Vehicle Count & ML State')
-        self.ax2.set_xlabel('Time (s)')
+        self.ax2.set_xlabel('Time (s, relative to now)' if self.render == 'blit' else 'Time (s)')
         self.ax2.set_ylabel('Count / State')
         self.line1, = self.ax2.plot([], [], 'b-', label='Vehicle Count')
         self.line2, = self.ax2.plot([], [], 'r-', label='ML State (Dense/Thin)', linewidth=2)
         self.ax2.legend()
         self.ax2.grid(True)
+        if self.render == 'blit':
+            # Trục cố định (giây trước hiện tại) để không phải vẽ lại nền mỗi frame
+            self.ax2.set_xlim(-20, 1)
+            self.ax2.set_ylim(0, 35)
+            for artist in self._dynamic_artists():
+                artist.set_animated(True)
 
-    def update_visualization(self, frame):
-        """Cập nhật hiển thị"""
-        current_time = frame * 0.1
-        
+    def _dynamic_artists(self):
+        return [self.red_light, self.yellow_light, self.green_light, self.status_text, self.line1, self.line2]
+
+    @property
+    def timestamps(self):
+        return self.history.view('t')
+
+    @property
+    def vehicle_counts(self):
+        return self.history.view('count')
+
+    def control_step(self, current_time):
+        """Một tick điều khiển: lấy input (CSV / follow / mô phỏng), cập nhật controller, ghi lịch sử"""
         # Prefer CSV-driven values if available
-        if self.csv_enabled and self.csv_df is not None and not self.csv_df.empty:
-            if self.csv_idx >= len(self.csv_df):
+        if self.follower is not None:
+            vehicle_count, emergency_cmd = self._follow_step()
+        elif self.csv_enabled and self.csv_counts is not None and len(self.csv_counts):
+            if self.csv_idx >= len(self.csv_counts):
                 self.csv_idx = 0  # loop
-            row = self.csv_df.iloc[self.csv_idx]
-            # Vehicle count
-            if self.csv_vehicle_col and self.csv_vehicle_col in row.index:
-                vehicle_count = int(max(0, float(row[self.csv_vehicle_col])))
-            elif self.csv_vehicle_components:
-                total_val = 0.0
-                for c in self.csv_vehicle_components:
-                    try:
-                        total_val += float(row.get(c, 0) or 0)
-                    except Exception:
-                        continue
-                vehicle_count = int(max(0, total_val))
-            else:
-                vehicle_count = 0
+            idx = self.csv_idx
+            vehicle_count = int(self.csv_counts[idx])
             # Emergency - only trigger when CSV changes from 0 to 1
             emergency_cmd = EmergencyCommand.NONE
-            if self.csv_emergency_col and self.csv_emergency_col in row.index:
-                try:
-                    current_emg = int(float(row[self.csv_emergency_col]))
-                except Exception:
-                    current_emg = 1 if str(row[self.csv_emergency_col]).lower() in ['1', 'true', 'yes', 'y'] else 0
-                
-                # Only trigger emergency when CSV changes from 0 to 1
+            if self.csv_emergency_col is not None:
+                current_emg = int(self.csv_emergency[idx])
                 if current_emg == 1 and self.last_emergency_value == 0:
-                    csv_time = float(row['time_s']) if 'time_s' in row.index else current_time
-                    print(f"🚨 EMERGENCY TRIGGERED! Time: {csv_time:.1f}s, Row: {self.csv_idx}")
-                
+                    csv_time = self.csv_time[idx] if self.csv_time is not None else current_time
+                    print(f"🚨 EMERGENCY TRIGGERED! Time: {csv_time:.1f}s, Row: {idx}")
                 self.last_emergency_value = current_emg
             self.csv_idx += 1
         else:
@@ -344,8 +660,17 @@ class TrafficSimulator:
                 emergency_cmd = EmergencyCommand(np.random.randint(1, 3))
         
         # Update controller
-        ns_lights, ew_lights = self.controller.update_state(vehicle_count, emergency_cmd)
-        
+        lights = self.controller.update_state(vehicle_count, emergency_cmd)
+        self.last_vehicle_count = vehicle_count
+        if self.snapshotter is not None:
+            self.snapshotter.maybe_save(self.controller, self.csv_idx if self.csv_enabled else None,
+                                        self.last_emergency_value)
+        self.history.append(t=current_time, count=vehicle_count, ml=self.controller.hysteresis.current_state)
+        return lights
+
+    def _update_light_artists(self):
+        """Cập nhật màu đèn và dòng trạng thái theo trạng thái hiện tại của controller"""
+        ns_lights, ew_lights = self.controller.get_light_states()[:2]
         # Update light colors - Single column shows current active direction
         if self.controller.current_state in [TrafficState.NS_GREEN, TrafficState.NS_YELLOW]:
             active_lights = ns_lights
@@ -361,82 +686,88 @@ class TrafficSimulator:
         emergency_status = "EMERGENCY!" if self.controller.emergency_active else "Normal"
         rush_status = "Rush Hour" if self.controller.is_rush_hour() else "Regular"
         
-        status = f"State: {self.controller.current_state.value}\n"
-        status += f"Vehicles: {vehicle_count} | ML: {ml_state}\n"
+        status = f"State: {self.controller.phases.names[self.controller._phase]}\n"
+        status += f"Vehicles: {self.last_vehicle_count} | ML: {ml_state}\n"
         status += f"{rush_status} | {emergency_status}"
         self.status_text.set_text(status)
+
+    def update_visualization(self, frame):
+        """Cập nhật hiển thị (chế độ legacy: mỗi frame một tick điều khiển)"""
+        current_time = frame * 0.1
+        self.control_step(current_time)
+        self._update_light_artists()
         
         # Update plots
-        self.timestamps.append(current_time)
-        self.vehicle_counts.append(vehicle_count)
-        
-        if len(self.timestamps) > 200:  # Keep last 200 points
-            self.timestamps = self.timestamps[-200:]
-            self.vehicle_counts = self.vehicle_counts[-200:]
-        
-        self.line1.set_data(self.timestamps, self.vehicle_counts)
-        ml_states = [self.controller.hysteresis.classify(count) * 20 
-                    for count in self.vehicle_counts]  # Scale for visibility
-        self.line2.set_data(self.timestamps, ml_states)
-        
-        if self.timestamps:
-            self.ax2.set_xlim(max(0, self.timestamps[-1] - 20), self.timestamps[-1] + 1)
-            self.ax2.set_ylim(0, max(35, max(self.vehicle_counts[-50:]) + 5))
+        t = self.history.view('t')
+        counts = self.history.view('count')
+        self.line1.set_data(t, counts)
+        self.line2.set_data(t, self.history.view('ml') * 20)  # Scale for visibility
+        
+        if len(t):
+            self.ax2.set_xlim(max(0, t[-1] - 20), t[-1] + 1)
+            self.ax2.set_ylim(0, max(35, counts[-50:].max() + 5))
+
+    def _control_tick(self):
+        """Callback của timer điều khiển (chế độ blit)"""
+        self.control_step(self.controller.clock.time() - self._t_start)
 
-    def _try_load_csv(self, csv_path):
-        """Thử tải dữ liệu từ vehicle_counts.csv và cấu hình cột cần dùng"""
+    def render_frame(self, frame=None):
+        """Vẽ một frame (chế độ blit): chỉ cập nhật các artist động từ lịch sử đã ghi"""
+        self._update_light_artists()
+        t = self.history.view('t')
+        if len(t):
+            t = t - t[-1]  # giây trước tick mới nhất
+            counts = self.history.view('count')
+            self.line1.set_data(t, counts)
+            self.line2.set_data(t, self.history.view('ml') * 20)
+            top = counts[-50:].max() + 5
+            if top > self.ax2.get_ylim()[1]:
+                # Hiếm khi xảy ra: nới trục y và vẽ lại nền một lần
+                self.ax2.set_ylim(0, top * 1.5)
+                self.fig.canvas.draw_idle()
+        return self._dynamic_artists()
+
+    def _follow_step(self):
+        """Đưa các dòng mới của file đang theo dõi vào controller, trả về dòng cuối cho frame này"""
+        from traffic_follow import emergency_command_rows
+        emergency_cmd = EmergencyCommand.NONE
+        data = self.follower.poll()
+        if data is not None:
+            counts, cmds = emergency_command_rows(data, self.follow_max_rows)
+            # Các dòng trước dòng cuối được đưa thẳng vào controller
+            for count, cmd in zip(counts[:-1].tolist(), cmds[:-1].tolist()):
+                self.controller.update_state(count, EmergencyCommand(cmd))
+            self.follow_vehicle_count = int(counts[-1])
+            emergency_cmd = EmergencyCommand(int(cmds[-1]))
+            if (cmds != EmergencyCommand.NONE.value).any():
+                print(f"🚨 EMERGENCY TRIGGERED! Row: {self.follower.rows_read - 1}")
+        return self.follow_vehicle_count, emergency_cmd
+
+    def _try_load_csv(self, csv_path, chunksize=None, cache=False):
+        """Thử tải dữ liệu từ vehicle_counts.csv và biên dịch các cột cần dùng thành mảng"""
         try:
-            df = pd.read_csv(csv_path)
-            # Detect vehicle count column (prefer 'total', then 'vehicle_count', 'count', 'counts_ts')
-            candidate_vehicle_cols = ['total', 'vehicle_count', 'count', 'counts_ts', 'vehicles']
-            for c in df.columns:
-                if c.lower() in [cv.lower() for cv in candidate_vehicle_cols]:
-                    self.csv_vehicle_col = c
-                    break
-            # Detect emergency column
-            candidate_emg_cols = ['EMERGENCY', 'emergency', 'is_emergency', 'priority']
-            for c in df.columns:
-                if c in candidate_emg_cols or c.lower() in [ce.lower() for ce in candidate_emg_cols]:
-                    self.csv_emergency_col = c
-                    break
-            # If no single vehicle count column, try to derive by summing components
-            if self.csv_vehicle_col is None:
-                # candidate component columns commonly found
-                component_candidates = ['car', 'truck', 'bus', 'motorbike', 'bike', 'van', 'suv', 'police_car']
-                detected = []
-                lower_cols = {c.lower(): c for c in df.columns}
-                for cand in component_candidates:
-                    if cand in lower_cols:
-                        detected.append(lower_cols[cand])
-                # As a fallback, include all numeric columns except time-like and emergency columns
-                if not detected:
-                    exclude_like = ['time', 'timestamp', 'date', 'datetime']
-                    for c in df.columns:
-                        if c == self.csv_emergency_col:
-                            continue
-                        lc = c.lower()
-                        if any(x in lc for x in exclude_like):
-                            continue
-                        if pd.api.types.is_numeric_dtype(df[c]):
-                            detected.append(c)
-                # keep at least one
-                if detected:
-                    self.csv_vehicle_components = detected
-            if self.csv_vehicle_col is not None:
-                self.csv_df = df
-                self.csv_enabled = True
-                print(f"Loaded CSV '{csv_path}' with vehicle column '{self.csv_vehicle_col}'" +
-                      (f" and emergency column '{self.csv_emergency_col}'" if self.csv_emergency_col else ""))
-            elif self.csv_vehicle_components:
-                self.csv_df = df
-                self.csv_enabled = True
-                comps = ','.join(self.csv_vehicle_components)
-                print(f"Loaded CSV '{csv_path}' using component columns [{comps}]" +
-                      (f" and emergency column '{self.csv_emergency_col}'" if self.csv_emergency_col else ""))
-            else:
-                print(f"CSV '{csv_path}' found but no vehicle count column detected; using simulation")
+            data = load_vehicle_arrays(csv_path, chunksize=chunksize, cache=cache)
         except FileNotFoundError:
             print(f"CSV '{csv_path}' not found; using simulation data")
+            return
+        self.csv_vehicle_col = data.vehicle_col
+        self.csv_emergency_col = data.emergency_col
+        if data.vehicle_col is None and data.components:
+            self.csv_vehicle_components = data.components
+        if data.counts is None:
+            print(f"CSV '{csv_path}' found but no vehicle count column detected; using simulation")
+            return
+        self.csv_counts = data.counts
+        self.csv_emergency = data.emergency
+        self.csv_time = data.time_s
+        self.csv_idx = 0
+        self.csv_enabled = True
+        emergency_note = f" and emergency column '{self.csv_emergency_col}'" if self.csv_emergency_col else ""
+        if self.csv_vehicle_col is not None:
+            print(f"Loaded CSV '{csv_path}' with vehicle column '{self.csv_vehicle_col}'" + emergency_note)
+        else:
+            comps = ','.join(self.csv_vehicle_components)
+            print(f"Loaded CSV '{csv_path}' using component columns [{comps}]" + emergency_note)
 
     def run_simulation(self, duration=300):
         """Chạy mô phỏng"""
@@ -447,24 +778,38 @@ class TrafficSimulator:
         print("- Emergency vehicle priority")
         print("- Real-time visualization")
         print("\nPress Ctrl+C to stop simulation")
+        import matplotlib.pyplot as plt
+        from matplotlib.animation import FuncAnimation
         
         try:
             # Animation
-            ani = FuncAnimation(self.fig, self.update_visualization, 
-                              frames=int(duration * 10), 
-                              interval=100, blit=False, repeat=True)
+            if self.render == 'blit':
+                self._t_start = self.controller.clock.time()
+                self._control_timer = self.fig.canvas.new_timer(interval=self.control_interval_ms)
+                self._control_timer.add_callback(self._control_tick)
+                self._control_timer.start()
+                ani = FuncAnimation(self.fig, self.render_frame, interval=self.render_interval_ms,
+                                    blit=True, cache_frame_data=False)
+            else:
+                ani = FuncAnimation(self.fig, self.update_visualization, 
+                                  frames=int(duration * 10), 
+                                  interval=100, blit=False, repeat=True)
             plt.tight_layout()
             plt.show()
             
         except KeyboardInterrupt:
             print("\nSimulation stopped by user")
         finally:
-            # Save log
-            self.controller.save_log('smart_traffic_log.csv')
+            # Save log (đã ghi dần nếu có sink, chỉ cần ghi nốt phần còn lại)
+            if self.controller.log.sink is not None:
+                self.controller.close_log()
+            else:
+                self.controller.save_log('smart_traffic_log.csv')
             print("Simulation data saved!")
 
     def load_vehicle_data(self, csv_file):
         """Tải dữ liệu xe từ Track A (nếu có)"""
+        import pandas as pd
         try:
             df = pd.read_csv(csv_file)
             if 'vehicle_count' in df.columns:
@@ -479,7 +824,8 @@ class TrafficSimulator:
 def demo_controller():
     """Demo cơ bản controller"""
     print("=== Traffic Controller Demo ===")
-    controller = TrafficController()
+    clock = SimulatedClock()
+    controller = TrafficController(clock=clock)
     
     for i in range(20):
         # Simulate varying vehicle counts
@@ -497,7 +843,7 @@ def demo_controller():
               f"EW={controller._lights_to_string(ew_lights)}, "
               f"State={controller.current_state.value}")
         
-        time.sleep(0.5)
+        clock.advance(0.5)
     
     # Save log
     controller.save_log('demo_log.csv')
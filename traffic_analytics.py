@@ -0,0 +1,314 @@
+"""KPI từ log của controller (smart_traffic_log.csv, demo_log.csv, file xoay vòng của LogSink)
+
+Log được đọc theo khối (CSV hoặc Parquet, chỉ các cột cần dùng) và gộp vào các bộ
+cộng dồn có kích thước cố định, nên bộ nhớ không tăng theo số tháng log:
+  - thời lượng pha: run-length encoding trên cột state, histogram theo từng pha
+  - độ dài chu kỳ: khoảng cách giữa các lần bắt đầu pha `cycle_state` (mặc định NS_Green)
+  - green split NS / EW, thời gian dense / thin: tổng thời gian có trọng số theo timestamp
+  - độ trễ emergency: từ dòng kích hoạt tới dòng đầu tiên hướng ưu tiên được xanh
+  - tần suất đổi pha: tổng và theo giờ trong ngày
+Khoảng trống giữa hai dòng lớn hơn `max_gap` giây (hoặc timestamp lùi lại, vd. sang
+file của lần chạy khác) được coi là đứt đoạn: không tính thời gian, và pha đang dở bị bỏ.
+
+Usage:
+  python traffic_analytics.py smart_traffic_log.csv 'logs/traffic_log_*.csv' --out kpis.json
+"""
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from traffic_log import LIGHT_CODES, LIGHT_NAMES
+
+ANALYTICS_COLUMNS = ['timestamp', 'state', 'ns_light', 'ew_light', 'ml_state', 'emergency']
+GREEN = LIGHT_CODES['Green']
+
+
+class DurationHistogram:
+    """Histogram thời lượng (bin cố định) + tổng / min / max, để tính quantile với bộ nhớ cố định"""
+    def __init__(self, bin_seconds=0.1, max_seconds=600.0):
+        self.bin_seconds = bin_seconds
+        self.counts = np.zeros(int(round(max_seconds / bin_seconds)) + 1, dtype=np.int64)
+        self.count = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.min = np.inf
+        self.max = 0.0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return
+        bins = np.minimum((values / self.bin_seconds).round().astype(np.int64), len(self.counts) - 1)
+        self.counts += np.bincount(np.maximum(bins, 0), minlength=len(self.counts))
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.sumsq += float((values * values).sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def quantile(self, q):
+        if not self.count:
+            return np.nan
+        idx = int(np.searchsorted(np.cumsum(self.counts), q * self.count))
+        return min(idx * self.bin_seconds, self.max)
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        mean = self.sum / self.count
+        return {'count': self.count, 'total_s': self.sum, 'mean_s': mean,
+                'std_s': float(np.sqrt(max(self.sumsq / self.count - mean * mean, 0.0))),
+                'min_s': self.min, 'p50_s': self.quantile(0.5), 'p95_s': self.quantile(0.95), 'max_s': self.max}
+
+
+def _codes(values, table):
+    """Mã số cho mảng chuỗi theo bảng {chuỗi: mã} (factorize rồi tra bảng các giá trị khác nhau)"""
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    lookup = np.array([table(u) if callable(table) else table.get(u, -1) for u in uniques], dtype=np.int64)
+    return lookup[codes] if len(lookup) else np.zeros(len(codes), dtype=np.int64)
+
+
+class LogAnalytics:
+    """Bộ cộng dồn KPI; gọi update() với từng khối DataFrame log theo thứ tự thời gian"""
+    def __init__(self, max_gap=5.0, cycle_state='NS_Green', bin_seconds=0.1, max_seconds=600.0):
+        self.max_gap = max_gap
+        self.cycle_state = cycle_state
+        self._hist_args = (bin_seconds, max_seconds)
+        self.state_names = []
+        self._state_index = {}
+        self.phase_durations = {}  # tên pha -> DurationHistogram
+        self.cycle_lengths = DurationHistogram(*self._hist_args)
+        self.emergency_latency = DurationHistogram(*self._hist_args)
+
+        self.rows = 0
+        self.gaps = 0
+        self.total_s = 0.0
+        self.ns_light_s = np.zeros(len(LIGHT_NAMES))
+        self.ew_light_s = np.zeros(len(LIGHT_NAMES))
+        self.ml_s = np.zeros(2)
+        self.phase_changes = 0
+        self.changes_by_hour = np.zeros(24, dtype=np.int64)
+        self.seconds_by_hour = np.zeros(24)
+        self.emergency_triggers = 0
+
+        # Phần chuyển tiếp giữa các khối
+        self._last = None  # dòng cuối của khối trước: (ts, state, ns, ew, ml, emergency)
+        self._run_start = None  # (ts bắt đầu pha đang dở, có bị đứt đoạn không)
+        self._cycle_start = None  # ts bắt đầu chu kỳ gần nhất (None sau khi đứt đoạn)
+        self._pending = []  # emergency chưa thấy xanh: (ts, lệnh)
+
+    def _state_code(self, name):
+        if name not in self._state_index:
+            self._state_index[name] = len(self.state_names)
+            self.state_names.append(name)
+            self.phase_durations[name] = DurationHistogram(*self._hist_args)
+        return self._state_index[name]
+
+    def update(self, df):
+        """Cộng dồn một khối log (các cột của LOG_COLUMNS, timestamp dạng chuỗi hoặc datetime)"""
+        if df.empty:
+            return
+        ts = pd.to_datetime(df['timestamp'], format='ISO8601').to_numpy(dtype='datetime64[us]')
+        ts = ts.astype(np.int64) / 1e6
+        state = _codes(df['state'].astype(str).to_numpy(), self._state_code)
+        ns = _codes(df['ns_light'].to_numpy(), LIGHT_CODES)
+        ew = _codes(df['ew_light'].to_numpy(), LIGHT_CODES)
+        ml = pd.to_numeric(df['ml_state'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+        emergency = pd.to_numeric(df['emergency'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+        self.rows += len(ts)
+
+        # Nối dòng cuối của khối trước vào đầu để xử lý ranh giới giữa hai khối
+        first = self._last is None
+        if not first:
+            ts, state, ns, ew, ml, emergency = (np.concatenate([[prev], cur]) for prev, cur in
+                                                zip(self._last, (ts, state, ns, ew, ml, emergency)))
+        dt = np.diff(ts)
+        gap = (dt > self.max_gap) | (dt < 0)
+        dt[gap] = 0.0
+        self.gaps += int(gap.sum())
+
+        # Thời gian có trọng số: dòng i giữ trạng thái cho tới dòng i + 1
+        self.total_s += float(dt.sum())
+        self.ns_light_s += np.bincount(np.maximum(ns[:-1], 0), weights=dt, minlength=len(LIGHT_NAMES))[:len(LIGHT_NAMES)]
+        self.ew_light_s += np.bincount(np.maximum(ew[:-1], 0), weights=dt, minlength=len(LIGHT_NAMES))[:len(LIGHT_NAMES)]
+        self.ml_s += np.bincount(np.clip(ml[:-1], 0, 1), weights=dt, minlength=2)
+        hour = (ts // 3600 % 24).astype(np.int64)
+        self.seconds_by_hour += np.bincount(hour[:-1], weights=dt, minlength=24)
+
+        # Run-length encoding trên state: ranh giới khi đổi pha hoặc đứt đoạn
+        gap_before = np.concatenate([[first], gap])  # dòng i đứng sau một khoảng đứt
+        changed = np.concatenate([[False], state[1:] != state[:-1]])
+        real_change = changed & ~gap_before
+        self.phase_changes += int(real_change.sum())
+        self.changes_by_hour += np.bincount(hour[real_change], minlength=24)
+        bounds = np.flatnonzero(changed | gap_before)
+        if first:
+            bounds = bounds[1:]  # dòng đầu tiên chỉ mở pha, không kết thúc pha nào
+            self._run_start = (ts[0], False)
+        if len(bounds):
+            start_ts = np.concatenate([[self._run_start[0]], ts[bounds[:-1]]])
+            start_broken = np.concatenate([[self._run_start[1]], gap_before[bounds[:-1]]])
+            valid = ~start_broken & ~gap_before[bounds]
+            ended_state = state[bounds - 1]
+            durations = ts[bounds] - start_ts
+            for code in np.unique(ended_state[valid]):
+                sel = valid & (ended_state == code)
+                self.phase_durations[self.state_names[code]].add(durations[sel])
+            self._run_start = (ts[bounds[-1]], bool(gap_before[bounds[-1]]))
+        self._update_cycles(ts, state, real_change, gap_before)
+        self._update_emergency(ts, ns, ew, emergency, gap_before, first)
+        self._last = (ts[-1], state[-1], ns[-1], ew[-1], ml[-1], emergency[-1])
+
+    def _update_cycles(self, ts, state, real_change, gap_before):
+        anchor = self._state_index.get(self.cycle_state)
+        if anchor is None:
+            return
+        starts = np.flatnonzero(real_change & (state == anchor))
+        # Đoạn liên tục (không đứt) mà mỗi dòng thuộc về; dòng 0 là dòng nối từ khối trước
+        segment = np.cumsum(gap_before)
+        if len(starts) == 0:
+            if segment[-1] != segment[0]:
+                self._cycle_start = None
+            return
+        starts_ts = ts[starts]
+        # Chu kỳ hợp lệ khi không có khoảng đứt nào giữa hai lần bắt đầu liên tiếp
+        same_segment = segment[starts[1:]] == segment[starts[:-1]]
+        self.cycle_lengths.add(np.diff(starts_ts)[same_segment])
+        if self._cycle_start is not None and segment[starts[0]] == segment[0]:
+            self.cycle_lengths.add([starts_ts[0] - self._cycle_start])
+        self._cycle_start = starts_ts[-1] if segment[-1] == segment[starts[-1]] else None
+
+    def _update_emergency(self, ts, ns, ew, emergency, gap_before, first):
+        # Kích hoạt: emergency khác 0 ở dòng mà dòng trước là 0 (dòng đầu của khối đã nối thì bỏ qua)
+        prev = np.concatenate([[0], emergency[:-1]])
+        trig = np.flatnonzero((emergency != 0) & (prev == 0))
+        if not first:
+            trig = trig[trig > 0]
+        self.emergency_triggers += len(trig)
+        green_idx = {1: np.flatnonzero(ns == GREEN), 2: np.flatnonzero(ew == GREEN)}
+        segment = np.cumsum(gap_before)
+        still_pending = []
+        # Emergency từ các khối trước: xanh đầu tiên của hướng ưu tiên trong khối này
+        for t_trig, cmd in self._pending:
+            idx = green_idx.get(cmd, np.empty(0, dtype=np.int64))
+            if len(idx):
+                if segment[idx[0]] == segment[0]:
+                    self.emergency_latency.add([ts[idx[0]] - t_trig])
+            elif segment[-1] == segment[0]:
+                still_pending.append((t_trig, cmd))
+        for cmd in np.unique(emergency[trig]):
+            sel = trig[emergency[trig] == cmd]
+            idx = green_idx.get(int(cmd), np.empty(0, dtype=np.int64))
+            pos = np.searchsorted(idx, sel)
+            found = pos < len(idx)
+            j = idx[np.minimum(pos, len(idx) - 1)] if len(idx) else sel
+            ok = found & (segment[j] == segment[sel])
+            self.emergency_latency.add(ts[j[ok]] - ts[sel[ok]])
+            unresolved = sel[~found & (segment[-1] == segment[sel])]
+            still_pending.extend((ts[i], int(cmd)) for i in unresolved)
+        self._pending = still_pending
+
+    def report(self):
+        """Tất cả KPI dạng dict (phase_durations là dict theo tên pha)"""
+        hours = self.total_s / 3600
+        ns_green, ew_green = self.ns_light_s[GREEN], self.ew_light_s[GREEN]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            per_hour = np.where(self.seconds_by_hour > 0, self.changes_by_hour / (self.seconds_by_hour / 3600), np.nan)
+        return {
+            'rows': self.rows,
+            'observed_s': self.total_s,
+            'gaps': self.gaps,
+            'phase_durations': {name: self.phase_durations[name].summary() for name in self.state_names},
+            'cycle_length': self.cycle_lengths.summary(),
+            'green_split': {
+                'ns_green_s': float(ns_green), 'ew_green_s': float(ew_green),
+                'ns_share': float(ns_green / (ns_green + ew_green)) if ns_green + ew_green else np.nan,
+                'ns_green_frac': float(ns_green / self.total_s) if self.total_s else np.nan,
+                'ew_green_frac': float(ew_green / self.total_s) if self.total_s else np.nan,
+            },
+            'density': {
+                'thin_s': float(self.ml_s[0]), 'dense_s': float(self.ml_s[1]),
+                'dense_frac': float(self.ml_s[1] / self.total_s) if self.total_s else np.nan,
+            },
+            'emergency': {'triggers': self.emergency_triggers, 'pending': len(self._pending),
+                          'latency': self.emergency_latency.summary()},
+            'phase_changes': {'total': self.phase_changes,
+                              'per_hour': self.phase_changes / hours if hours else np.nan,
+                              'per_hour_by_hour_of_day': [None if np.isnan(v) else float(v) for v in per_hour]},
+        }
+
+    def phase_duration_frame(self):
+        """Thời lượng pha dạng DataFrame (một dòng mỗi pha)"""
+        return pd.DataFrame.from_dict({name: self.phase_durations[name].summary() for name in self.state_names},
+                                      orient='index')
+
+
+def expand_paths(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        paths.extend(matches if matches else [pattern])
+    return paths
+
+
+def iter_log_chunks(paths, chunksize=500_000):
+    """Các khối DataFrame (chỉ cột cần dùng) của các file log CSV / Parquet, theo thứ tự"""
+    for path in paths:
+        if os.path.splitext(path)[1] == '.parquet':
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=ANALYTICS_COLUMNS):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(path, usecols=ANALYTICS_COLUMNS, chunksize=chunksize)
+
+
+def analyze_logs(patterns, chunksize=500_000, **kwargs):
+    """Chạy LogAnalytics trên các file (glob) theo thứ tự tên"""
+    analytics = LogAnalytics(**kwargs)
+    for chunk in iter_log_chunks(expand_paths(patterns), chunksize):
+        analytics.update(chunk)
+    return analytics
+
+
+def _json_default(value):
+    if isinstance(value, (np.integer, np.floating)):
+        return value.item()
+    raise TypeError(type(value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KPIs from traffic controller logs')
+    parser.add_argument('logs', nargs='*', default=['smart_traffic_log.csv'], help='log files or glob patterns')
+    parser.add_argument('--chunksize', type=int, default=500_000)
+    parser.add_argument('--max-gap', type=float, default=5.0, help='seconds between rows treated as a break')
+    parser.add_argument('--cycle-state', default='NS_Green', help='phase whose start marks a new cycle')
+    parser.add_argument('--out', default=None, help='write the KPI report as JSON')
+    args = parser.parse_args()
+
+    analytics = analyze_logs(args.logs, chunksize=args.chunksize, max_gap=args.max_gap,
+                             cycle_state=args.cycle_state)
+    report = analytics.report()
+    print(f"Rows: {report['rows']:,}  observed: {report['observed_s'] / 3600:.2f} h  gaps: {report['gaps']}")
+    print(analytics.phase_duration_frame().to_string(float_format=lambda v: f"{v:.2f}"))
+    cycle, split, density = report['cycle_length'], report['green_split'], report['density']
+    if cycle['count']:
+        print(f"Cycles: {cycle['count']}  mean {cycle['mean_s']:.1f}s  p95 {cycle['p95_s']:.1f}s")
+    print(f"Green split NS/EW: {split['ns_share']:.1%} / {1 - split['ns_share']:.1%}  "
+          f"dense: {density['dense_frac']:.1%}")
+    em = report['emergency']
+    if em['latency']['count']:
+        print(f"Emergencies: {em['triggers']}  latency mean {em['latency']['mean_s']:.2f}s  "
+              f"max {em['latency']['max_s']:.2f}s")
+    print(f"Phase changes: {report['phase_changes']['total']} ({report['phase_changes']['per_hour']:.1f}/h)")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, default=_json_default)
+        print(f"Report saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
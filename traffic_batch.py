@@ -0,0 +1,314 @@
+"""Mô phỏng batch không giao diện (headless) cho TrafficController
+
+Chạy máy trạng thái của controller trên cả chuỗi số xe (vd. vehicle_counts_calibrated.csv)
+nhanh nhất CPU cho phép, không cần matplotlib / FuncAnimation.
+
+Usage: python traffic_batch.py vehicle_counts_calibrated.csv --dt 0.1 --log batch_log.csv
+"""
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from traffic_control import EmergencyCommand, TrafficController, load_vehicle_arrays
+from traffic_log import LOG_COLUMNS, LIGHT_NAMES, TIMESTAMP_FORMAT
+
+
+def phase_name_arrays(phases):
+    """(tên pha, đèn ns, đèn ew) dạng mảng object để tra theo mã pha"""
+    light_names = np.array(LIGHT_NAMES, dtype=object)
+    codes = np.array(phases.log_light_codes, dtype=np.int64).reshape(-1, 2)
+    return np.array(phases.names, dtype=object), light_names[codes[:, 0]], light_names[codes[:, 1]]
+
+
+def load_vehicle_series(csv_path, chunksize=None, cache=False):
+    """Đọc CSV số xe, trả về (counts, emergency_flags, time_s hoặc None)"""
+    data = load_vehicle_arrays(csv_path, chunksize=chunksize, cache=cache)
+    if data.counts is None:
+        raise ValueError(f"CSV '{csv_path}' has no vehicle count column")
+    return data.counts, data.emergency, data.time_s
+
+
+def emergency_commands(flags, last_value=0):
+    """Chỉ kích hoạt emergency (NS_PRIORITY) khi cờ đổi từ 0 lên 1"""
+    flags = np.asarray(flags, dtype=np.int64)
+    prev = np.empty_like(flags)
+    if len(flags):
+        prev[0] = last_value
+        prev[1:] = flags[:-1]
+    rising = (flags == 1) & (prev == 0)
+    return np.where(rising, EmergencyCommand.NS_PRIORITY.value, EmergencyCommand.NONE.value)
+
+
+def rush_hour_flags(start, t, rush_hours, t0=0.0):
+    """Cờ giờ cao điểm cho từng thời điểm t của đồng hồ mô phỏng bắt đầu từ `start`"""
+    t = np.asarray(t, dtype=float)
+    day_start = datetime(start.year, start.month, start.day)
+    sec_of_day = (start - day_start).total_seconds() + (t - t0)
+    hours = (np.floor(sec_of_day / 3600.0) % 24).astype(np.int64)
+    rush = np.zeros(len(t), dtype=bool)
+    for start_h, end_h in rush_hours:
+        rush |= (hours >= start_h) & (hours < end_h)
+    return rush
+
+
+class BatchResult:
+    """Kết quả một lần chạy batch, lưu dạng cột NumPy"""
+    def __init__(self, t, state, vehicle_count, ml_state, emergency, duration, start, t0, phases):
+        self.t = t
+        self.state = state
+        self.vehicle_count = vehicle_count
+        self.ml_state = ml_state
+        self.emergency = emergency
+        self.duration = duration
+        self.start = start
+        self.t0 = t0
+        self.phases = phases
+
+    def __len__(self):
+        return len(self.state)
+
+    def timestamps(self):
+        offsets = np.round((self.t - self.t0) * 1e6).astype('timedelta64[us]')
+        return np.datetime64(self.start, 'us') + offsets
+
+    def to_log_frame(self):
+        """DataFrame cùng cột với TrafficController.save_log"""
+        state_names, ns_names, ew_names = phase_name_arrays(self.phases)
+        return pd.DataFrame({
+            'timestamp': self.timestamps(),
+            'state': state_names[self.state],
+            'ns_light': ns_names[self.state],
+            'ew_light': ew_names[self.state],
+            'vehicle_count': self.vehicle_count,
+            'ml_state': self.ml_state,
+            'emergency': self.emergency,
+            'duration': self.duration,
+        }, columns=LOG_COLUMNS)
+
+    def to_summary_frame(self):
+        """DataFrame dạng batch_results.csv"""
+        return pd.DataFrame({
+            'timestamp': self.timestamps(),
+            'vehicle_count': self.vehicle_count,
+            'ml_state': self.ml_state,
+            'current_state': np.array(self.phases.names, dtype=object)[self.state],
+        })
+
+    def save_log(self, filename='batch_log.csv'):
+        self.to_log_frame().to_csv(filename, index=False, date_format=TIMESTAMP_FORMAT)
+        print(f"Log saved to {filename}")
+
+    def save_summary(self, filename='batch_results.csv'):
+        self.to_summary_frame().to_csv(filename, index=False, date_format=TIMESTAMP_FORMAT)
+        print(f"Summary saved to {filename}")
+
+
+class BatchRunner:
+    """Chạy máy trạng thái của TrafficController trên chuỗi số xe, không cần đồ họa
+
+    Dùng cùng tham số và cùng luật chuyển trạng thái với controller, nhưng gom vào
+    một vòng lặp chặt với biến cục bộ; log được dựng lại theo cột sau khi chạy.
+    Có thể gọi run() nhiều lần để xử lý dữ liệu theo từng đoạn (chunk).
+    """
+    def __init__(self, controller=None, dt=0.1, start=None):
+        self.controller = controller if controller is not None else TrafficController()
+        self.dt = float(dt)
+        self.start = start if start is not None else datetime.now()
+        self.t0 = 0.0
+
+        c = self.controller
+        self.t = self.t0
+        self.state = c._phase
+        self.state_start = self.t0
+        self.ml = c.hysteresis.current_state
+        # Cửa sổ số xe của bộ phân loại học được (traffic_density_model), mang qua các chunk
+        self.ml_history = c.hysteresis.history() if hasattr(c.hysteresis, 'history') else None
+        self.emergency_active = c.emergency_active
+        self.emergency_command = c.emergency_command.value
+        self.last_emergency_value = 0
+
+    def _green_durations(self, t):
+        """Thời gian xanh từng tick cho ml_state = 0 và 1 (vector hóa calculate_green_duration)
+
+        Trả về (xanh khi thin, xanh khi dense, base_time đã nhân hệ số lịch).
+        """
+        c = self.controller
+        if c.timing_plan is not None:
+            multiplier = c.timing_plan.multipliers(self.start, t, self.t0)
+        else:
+            rush = rush_hour_flags(self.start, t, c.rush_hours, self.t0)
+            multiplier = np.where(rush, c.rush_hour_multiplier, 1.0)
+        base_time = c.base_green_time * multiplier
+        green = []
+        for ml in (0, 1):
+            bt = base_time + base_time * c.ml_adjustment_factor if (c.ml_enabled and ml == 1) else base_time
+            green.append(np.clip(np.trunc(bt), 15, 60).tolist())
+        return green[0], green[1], base_time.tolist()
+
+    def run(self, counts, emergency=None):
+        """Chạy batch trên mảng số xe (và cờ emergency 0/1 nếu có)"""
+        counts = np.asarray(counts, dtype=np.int64)
+        n = len(counts)
+        if emergency is None:
+            cmds = np.zeros(n, dtype=np.int64)
+        else:
+            flags = np.asarray(emergency, dtype=np.int64)
+            cmds = emergency_commands(flags, self.last_emergency_value)
+            if n:
+                self.last_emergency_value = int(flags[-1])
+
+        # Thời điểm từng tick: cộng dồn dt giống SimulatedClock.advance()
+        steps = np.full(n, self.dt)
+        if n:
+            steps[0] = self.t
+        t = np.cumsum(steps)
+        green_thin, green_dense, base_times = self._green_durations(t)
+        # Hysteresis không phụ thuộc máy trạng thái -> phân loại cả mảng trước
+        hysteresis = self.controller.hysteresis
+        if self.ml_history is None:
+            ml_states, final_ml = hysteresis.classify_array(counts, initial_state=self.ml)
+        else:
+            ml_states, final_ml = hysteresis.classify_array(counts, initial_state=self.ml, history=self.ml_history)
+            self.ml_history = hysteresis.window_after(self.ml_history, counts)
+
+        c = self.controller
+        phases = c.phases
+        next_phase = phases.next
+        is_green = phases.is_green
+        fixed_duration = phases.durations(c.yellow_time, c.all_red_time)
+        clearance = phases.clearance
+        priority = phases.emergency
+        emergency_green_time = c.emergency_green_time
+        predict = None
+        # Forecaster phụ thuộc chuỗi thời gian nên cập nhật trong vòng lặp như update_state;
+        # thời gian xanh tính theo dự báo (giống calculate_green_duration) khi ml_enabled
+        forecaster = c.forecaster
+        if forecaster is not None:
+            update_forecast = forecaster.update
+            predict = forecaster.predict if c.ml_enabled else None
+            low, high = c.forecast_demand_range
+            factor = c.ml_adjustment_factor
+
+        state = self.state
+        state_start = self.state_start
+        em_active = self.emergency_active
+        em_cmd = self.emergency_command
+
+        out_state = bytearray(n)
+        out_start = [0.0] * n
+        t_list = t.tolist()
+        for i, (now, count, ml, cmd, g_thin, g_dense, base) in enumerate(
+                zip(t_list, counts.tolist(), ml_states.tolist(), cmds.tolist(), green_thin, green_dense,
+                    base_times)):
+            elapsed = now - state_start
+            if cmd and not em_active:
+                em_active = True
+                em_cmd = cmd
+                state = clearance
+                state_start = now
+            if forecaster is not None:
+                update_forecast(count, now)
+
+            if em_active:
+                if state == clearance:
+                    if elapsed >= fixed_duration[state]:
+                        state = priority[em_cmd]
+                        state_start = now
+                elif is_green[state]:
+                    if elapsed >= emergency_green_time:
+                        state = next_phase[state]
+                        state_start = now
+                        em_active = False
+            elif is_green[state]:
+                if predict is not None:
+                    fraction = min(1.0, max(0.0, (predict(base) - low) / (high - low)))
+                    green = max(15, min(60, int(base + base * factor * fraction)))
+                else:
+                    green = g_dense if ml else g_thin
+                if elapsed >= green:
+                    state = next_phase[state]
+                    state_start = now
+            elif elapsed >= fixed_duration[state]:
+                state = next_phase[state]
+                state_start = now
+
+            out_state[i] = state
+            out_start[i] = state_start
+
+        self.state = state
+        self.state_start = state_start
+        self.ml = final_ml
+        self.emergency_active = em_active
+        self.emergency_command = em_cmd
+        if n:
+            self.t = t_list[-1] + self.dt
+
+        duration = t - np.array(out_start)
+        return BatchResult(
+            t=t,
+            state=np.frombuffer(bytes(out_state), dtype=np.uint8),
+            vehicle_count=counts,
+            ml_state=ml_states.astype(np.int64),
+            emergency=cmds,
+            duration=duration,
+            start=self.start,
+            t0=self.t0,
+            phases=phases,
+        )
+
+    def sync_controller(self):
+        """Ghi trạng thái cuối của batch ngược lại vào controller"""
+        c = self.controller
+        c.current_state = c.phases.keys[self.state]
+        c.hysteresis.current_state = self.ml
+        if self.ml_history is not None:
+            c.hysteresis.set_history(self.ml_history)
+        c.emergency_active = self.emergency_active
+        c.emergency_command = EmergencyCommand(self.emergency_command)
+        return c
+
+
+def run_batch_csv(csv_path, dt=None, controller=None, start=None, chunksize=None, cache=False, from_time=None):
+    """Chạy batch trên một file CSV; dt mặc định lấy từ median(diff(time_s))
+
+    cache: dùng trace nhị phân (traffic_trace); from_time: bỏ qua các dòng có time_s < from_time.
+    """
+    counts, emergency, time_s = load_vehicle_series(csv_path, chunksize=chunksize, cache=cache)
+    if from_time is not None and time_s is not None:
+        from traffic_trace import time_index
+        row = time_index(time_s, from_time)
+        counts, emergency, time_s = counts[row:], emergency[row:], time_s[row:]
+    if dt is None:
+        dt = float(np.median(np.diff(time_s))) if time_s is not None and len(time_s) > 1 else 0.1
+    runner = BatchRunner(controller=controller, dt=dt, start=start)
+    return runner.run(counts, emergency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless batch traffic simulation')
+    parser.add_argument('csv', nargs='?', default='vehicle_counts_calibrated.csv')
+    parser.add_argument('--dt', type=float, default=None, help='seconds per row (default: median diff of time_s)')
+    parser.add_argument('--start', default=None, help='simulated start time, e.g. "2025-09-13 07:30:00"')
+    parser.add_argument('--log', default='batch_log.csv')
+    parser.add_argument('--summary', default='batch_results.csv')
+    parser.add_argument('--chunksize', type=int, default=None, help='read the CSV in chunks of this many rows')
+    parser.add_argument('--cache', action='store_true', help='use the memory-mapped <csv>.trace cache')
+    parser.add_argument('--from-time', type=float, default=None, help='start the replay at this time_s')
+    args = parser.parse_args()
+
+    start = datetime.fromisoformat(args.start) if args.start else None
+    t_begin = time.perf_counter()
+    result = run_batch_csv(args.csv, dt=args.dt, start=start, chunksize=args.chunksize, cache=args.cache,
+                           from_time=args.from_time)
+    elapsed = time.perf_counter() - t_begin
+    print(f"Simulated {len(result)} ticks in {elapsed:.3f}s "
+          f"({len(result) / max(elapsed, 1e-9):,.0f} ticks/s)")
+    result.save_log(args.log)
+    result.save_summary(args.summary)
+
+
+if __name__ == "__main__":
+    main()
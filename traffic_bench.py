@@ -0,0 +1,389 @@
+"""Benchmark cho các đường nóng của controller, có baseline JSON và chế độ so sánh
+
+Mỗi benchmark đo thời gian (min / median của `repeat` lần chạy, time.perf_counter) và
+bộ nhớ đỉnh (tracemalloc, chạy riêng một lần để không ảnh hưởng thời gian).
+Fixture: các CSV có sẵn trong repo và trace tổng hợp (CSV có sẵn lặp lại tới N dòng)
+được tạo trong thư mục tạm.
+
+Usage:
+  python traffic_bench.py run --out bench_base.json
+  python traffic_bench.py run --out bench_new.json --compare bench_base.json
+  python traffic_bench.py compare bench_base.json bench_new.json --threshold 0.10
+  python traffic_bench.py run --quick --filter save_log
+  python traffic_bench.py imports --max-ms 500 --max-rss-mb 60   # ngân sách import lõi controller
+"""
+import argparse
+import fnmatch
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import matplotlib
+matplotlib.use('Agg')  # update_visualization chạy headless
+
+import numpy as np
+import pandas as pd
+
+from traffic_clock import SimulatedClock
+from traffic_control import DenseThinHysteresis, EmergencyCommand, TrafficController, TrafficSimulator
+from traffic_log import LogBuffer
+
+BUNDLED_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vehicle_counts_calibrated.csv')
+SAVE_LOG_ROWS = (10_000, 1_000_000, 10_000_000)
+QUICK_SAVE_LOG_ROWS = (10_000, 100_000)
+SYNTHETIC_ROWS = 1_000_000
+QUICK_SYNTHETIC_ROWS = 100_000
+DEFAULT_THRESHOLD = 0.10
+
+# Lõi controller phải import được mà không kéo theo các module nặng này
+CORE_MODULES = ('traffic_control', 'traffic')
+HEAVY_MODULES = ('pandas', 'matplotlib')
+IMPORT_BUDGET_MS = 500
+IMPORT_BUDGET_RSS_MB = 60
+# Chạy trong process mới: thời gian import, RSS đỉnh và các module nặng bị kéo theo.
+# RSS đỉnh lấy từ VmHWM (ru_maxrss trên Linux giữ giá trị của process cha qua fork/exec)
+_IMPORT_PROBE = '''
+import json, resource, sys, time
+t0 = time.perf_counter()
+import {module}
+ms = (time.perf_counter() - t0) * 1e3
+try:
+    with open('/proc/self/status') as f:
+        rss_mb = next(int(line.split()[1]) for line in f if line.startswith('VmHWM')) / 1024
+except OSError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / 2 ** 20 if sys.platform == 'darwin' else rss / 1024
+print(json.dumps({{'import_ms': ms, 'rss_mb': rss_mb, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+class Fixtures:
+    """Dữ liệu dùng chung giữa các benchmark, tạo một lần trong thư mục tạm"""
+    def __init__(self, workdir, quick=False):
+        self.workdir = workdir
+        self.quick = quick
+        self._paths = {}
+        self._simulator = None
+
+    def synthetic_csv(self, rows):
+        """CSV có sẵn được lặp lại tới `rows` dòng (time_s tăng liên tục)"""
+        if rows not in self._paths:
+            base = pd.read_csv(BUNDLED_CSV)
+            reps = -(-rows // len(base))
+            df = pd.concat([base] * reps, ignore_index=True).iloc[:rows]
+            if 'time_s' in df.columns:
+                step = float(np.median(np.diff(base['time_s']))) if len(base) > 1 else 0.1
+                df['time_s'] = np.arange(rows) * step
+            path = os.path.join(self.workdir, f'synthetic_{rows}.csv')
+            df.to_csv(path, index=False)
+            self._paths[rows] = path
+        return self._paths[rows]
+
+    def simulator(self):
+        if self._simulator is None:
+            self._simulator = _quiet(TrafficSimulator)
+        return self._simulator
+
+
+def synthetic_log(rows):
+    """LogBuffer đầy `rows` dòng giả lập (điền trực tiếp các cột, không qua append)"""
+    log = LogBuffer(capacity=rows, state_names=TrafficController().phases.names)
+    rng = np.random.default_rng(0)
+    c = log.columns
+    c['timestamp'][:] = np.arange(rows, dtype=np.int64) * 100_000
+    c['state'][:] = (np.arange(rows) // 300) % 5
+    c['ns_light'][:] = rng.integers(0, 3, rows)
+    c['ew_light'][:] = rng.integers(0, 3, rows)
+    c['vehicle_count'][:] = rng.integers(0, 40, rows)
+    c['ml_state'][:] = c['vehicle_count'] >= 15
+    c['emergency'][:] = 0
+    c['duration'][:] = (np.arange(rows) % 300) * 0.1
+    log._size = rows
+    log._pos = 0
+    log.total_rows = rows
+    log.set_origin(datetime(2025, 9, 13, 7, 30), 0)
+    return log
+
+
+# --- Benchmark ---------------------------------------------------------------
+# Mỗi hàm nhận Fixtures, trả về (hàm chạy một lần, số phép tính mỗi lần chạy)
+
+def bench_update_state(fx):
+    n = 100_000
+    counts = (10 + 8 * np.sin(np.arange(n) * 0.01)).astype(int).tolist()
+
+    def run():
+        clock = SimulatedClock()
+        controller = TrafficController(clock=clock, log=LogBuffer(capacity=n))
+        none = EmergencyCommand.NONE
+        for count in counts:
+            controller.update_state(count, none)
+            clock.advance(0.1)
+    return run, n
+
+
+def bench_calculate_green_duration(fx):
+    n = 100_000
+    controller = TrafficController(clock=SimulatedClock())
+
+    def run():
+        for i in range(n):
+            controller.calculate_green_duration(i & 1, 20)
+    return run, n
+
+
+def bench_classify(fx):
+    n = 100_000
+    counts = (15 + 10 * np.sin(np.arange(n) * 0.01)).astype(int).tolist()
+
+    def run():
+        hysteresis = DenseThinHysteresis()
+        for count in counts:
+            hysteresis.classify(count)
+    return run, n
+
+
+def bench_try_load_csv_bundled(fx):
+    sim = fx.simulator()
+    return (lambda: sim._try_load_csv(BUNDLED_CSV)), 1
+
+
+def bench_try_load_csv_synthetic(fx):
+    sim = fx.simulator()
+    rows = QUICK_SYNTHETIC_ROWS if fx.quick else SYNTHETIC_ROWS
+    path = fx.synthetic_csv(rows)
+    return (lambda: sim._try_load_csv(path)), rows
+
+
+def bench_update_visualization(fx):
+    n = 5_000
+    sim = fx.simulator()
+
+    def run():
+        for frame in range(n):
+            sim.update_visualization(frame)
+    return run, n
+
+
+def measure_import(module, runs=5):
+    """Thời gian import (median của `runs` process mới), RSS đỉnh và các module nặng bị kéo theo"""
+    code = _IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=cwd, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {'module': module, 'runs': runs,
+            'import_ms': float(np.median([r['import_ms'] for r in samples])),
+            'rss_mb': max(r['rss_mb'] for r in samples),
+            'heavy': samples[-1]['heavy']}
+
+
+def check_imports(modules=CORE_MODULES, max_ms=IMPORT_BUDGET_MS, max_rss_mb=IMPORT_BUDGET_RSS_MB, runs=5):
+    """Kiểm tra ngân sách import; trả về danh sách vi phạm (rỗng nếu đạt)"""
+    failures = []
+    for module in modules:
+        res = measure_import(module, runs)
+        problems = []
+        if res['heavy']:
+            problems.append(f"imports {', '.join(res['heavy'])}")
+        if res['import_ms'] > max_ms:
+            problems.append(f"import {res['import_ms']:.0f}ms > {max_ms:g}ms")
+        if res['rss_mb'] > max_rss_mb:
+            problems.append(f"RSS {res['rss_mb']:.1f}MB > {max_rss_mb:g}MB")
+        print(f"{module:20s} import={res['import_ms']:7.1f}ms  rss={res['rss_mb']:6.1f}MB  "
+              f"{'FAIL: ' + '; '.join(problems) if problems else 'ok'}")
+        failures.extend(f"{module}: {p}" for p in problems)
+    return failures
+
+
+def bench_import_core(fx):
+    # Process mới mỗi lần: gồm cả thời gian khởi động interpreter
+    code = 'import traffic_control'
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    return (lambda: subprocess.run([sys.executable, '-c', code], cwd=cwd, check=True)), 1
+
+
+def _bench_save_log(rows):
+    def bench(fx):
+        log = synthetic_log(rows)
+        controller = TrafficController(clock=SimulatedClock(), log=log)
+        path = os.path.join(fx.workdir, f'save_log_{rows}.csv')
+        return (lambda: controller.save_log(path)), rows
+    return bench
+
+
+BENCHMARKS = {
+    'update_state': bench_update_state,
+    'calculate_green_duration': bench_calculate_green_duration,
+    'classify': bench_classify,
+    'try_load_csv[bundled]': bench_try_load_csv_bundled,
+    'try_load_csv[synthetic]': bench_try_load_csv_synthetic,
+    'update_visualization': bench_update_visualization,
+    'import[traffic_control]': bench_import_core,
+}
+
+
+def benchmark_names(quick=False):
+    """Tên các benchmark, save_log theo số dòng (ít hơn khi quick)"""
+    sizes = QUICK_SAVE_LOG_ROWS if quick else SAVE_LOG_ROWS
+    return list(BENCHMARKS) + [f'save_log[{rows}]' for rows in sizes]
+
+
+def get_benchmark(name):
+    if name.startswith('save_log['):
+        return _bench_save_log(int(name[len('save_log['):-1]))
+    return BENCHMARKS[name]
+
+
+def _quiet(fn):
+    """Chạy fn mà không in ra stdout (save_log / _try_load_csv có print)"""
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return fn()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def measure(fn, ops, repeat=5, warmup=1, memory=True):
+    """Thời gian min / median (giây) và bộ nhớ đỉnh (MB) của fn"""
+    for _ in range(warmup):
+        _quiet(fn)
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        _quiet(fn)
+        times.append(time.perf_counter() - t0)
+    result = {'ops': ops, 'repeat': repeat, 'min_s': min(times), 'median_s': float(np.median(times)),
+              'ops_per_s': ops / float(np.median(times))}
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        _quiet(fn)
+        result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(patterns=None, quick=False, repeat=5, memory=True):
+    selected = [name for name in benchmark_names(quick)
+                if not patterns or any(fnmatch.fnmatch(name, p) or p in name for p in patterns)]
+    report = {'meta': {'commit': _git_commit(), 'created': datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(), 'numpy': np.__version__,
+                       'pandas': pd.__version__, 'platform': platform.platform(), 'quick': quick},
+              'results': {}}
+    with tempfile.TemporaryDirectory(prefix='traffic_bench_') as workdir:
+        fx = Fixtures(workdir, quick=quick)
+        for name in selected:
+            fn, ops = get_benchmark(name)(fx)
+            # save_log lớn rất chậm: chạy ít lần hơn
+            n_repeat = 1 if ops >= 1_000_000 and name.startswith('save_log') else repeat
+            res = measure(fn, ops, repeat=n_repeat, memory=memory)
+            report['results'][name] = res
+            mem = f" peak={res['peak_mb']:.1f}MB" if 'peak_mb' in res else ''
+            print(f"{name:28s} median={res['median_s'] * 1e3:10.2f}ms  "
+                  f"{res['ops_per_s']:14,.0f} ops/s{mem}")
+    return report
+
+
+def compare(base, new, threshold=DEFAULT_THRESHOLD):
+    """So sánh hai báo cáo; trả về danh sách benchmark bị chậm đi / tốn bộ nhớ hơn quá threshold"""
+    regressions = []
+    print(f"base: {base['meta'].get('commit')}  new: {new['meta'].get('commit')}  threshold: {threshold:.0%}")
+    for name, res in new['results'].items():
+        old = base['results'].get(name)
+        if old is None:
+            print(f"{name:28s} (new)")
+            continue
+        time_ratio = res['median_s'] / old['median_s'] if old['median_s'] else float('inf')
+        flags = []
+        if time_ratio > 1 + threshold:
+            flags.append('SLOWER')
+        if 'peak_mb' in res and 'peak_mb' in old and old['peak_mb'] > 0 \
+                and res['peak_mb'] / old['peak_mb'] > 1 + threshold and res['peak_mb'] - old['peak_mb'] > 1:
+            flags.append('MORE MEMORY')
+        mem = ''
+        if 'peak_mb' in res and 'peak_mb' in old:
+            mem = f"  mem {old['peak_mb']:.1f} -> {res['peak_mb']:.1f}MB"
+        print(f"{name:28s} {old['median_s'] * 1e3:10.2f} -> {res['median_s'] * 1e3:10.2f}ms "
+              f"({time_ratio - 1:+.1%}){mem}  {' '.join(flags)}")
+        if flags:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Traffic controller benchmarks')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_run = sub.add_parser('run', help='run benchmarks and write a JSON report')
+    p_run.add_argument('--out', default=None, help='write the report to this JSON file')
+    p_run.add_argument('--filter', nargs='*', default=None, help='benchmark name patterns')
+    p_run.add_argument('--quick', action='store_true', help='smaller fixtures (no 1M/10M save_log)')
+    p_run.add_argument('--repeat', type=int, default=5)
+    p_run.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    p_run.add_argument('--compare', default=None, help='baseline JSON to compare against')
+    p_run.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    p_cmp = sub.add_parser('compare', help='compare two JSON reports')
+    p_cmp.add_argument('base')
+    p_cmp.add_argument('new')
+    p_cmp.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    p_imp = sub.add_parser('imports', help='check import time / RSS of the controller core')
+    p_imp.add_argument('--module', nargs='*', default=list(CORE_MODULES))
+    p_imp.add_argument('--max-ms', type=float, default=IMPORT_BUDGET_MS)
+    p_imp.add_argument('--max-rss-mb', type=float, default=IMPORT_BUDGET_RSS_MB)
+    p_imp.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.cmd == 'imports':
+        failures = check_imports(args.module, args.max_ms, args.max_rss_mb, args.runs)
+        if failures:
+            print(f"{len(failures)} import budget violation(s)")
+            return 1
+        print("Import budget ok")
+        return 0
+
+    if args.cmd == 'run':
+        report = run_benchmarks(args.filter, quick=args.quick, repeat=args.repeat, memory=not args.no_memory)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Report saved to {args.out}")
+        if args.compare is None:
+            return 0
+        with open(args.compare) as f:
+            base = json.load(f)
+        new = report
+    else:
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+import time
+from datetime import datetime, timedelta
+
+
+class WallClock:
+    """Đồng hồ thực (time.time / datetime.now) - mặc định của controller"""
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.now()
+
+
+class MonotonicClock:
+    """Đồng hồ đơn điệu: không bị ảnh hưởng khi chỉnh giờ hệ thống"""
+    def __init__(self):
+        self._t0 = time.monotonic()
+        self._dt0 = datetime.now()
+
+    def time(self):
+        return time.monotonic()
+
+    def now(self):
+        # Suy ra datetime từ mốc ban đầu + thời gian đơn điệu đã trôi qua
+        return self._dt0 + timedelta(seconds=time.monotonic() - self._t0)
+
+
+class SimulatedClock:
+    """Đồng hồ mô phỏng, chỉ tiến khi gọi advance() / set()
+
+    Truyền `start` cố định để kết quả mô phỏng lặp lại được (deterministic).
+    """
+    def __init__(self, start=None, t0=0.0):
+        self.start = start if start is not None else datetime.now()
+        self.t0 = float(t0)
+        self._t = float(t0)
+
+    def time(self):
+        return self._t
+
+    def now(self):
+        return self.start + timedelta(seconds=self._t - self.t0)
+
+    def advance(self, seconds):
+        """Tiến đồng hồ thêm `seconds` giây"""
+        if seconds < 0:
+            raise ValueError("SimulatedClock cannot go backwards")
+        self._t += seconds
+        return self._t
+
+    def set(self, t):
+        """Đặt thời điểm tuyệt đối (giây, cùng gốc với t0)"""
+        if t < self._t:
+            raise ValueError("SimulatedClock cannot go backwards")
+        self._t = float(t)
+        return self._t
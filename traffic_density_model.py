@@ -0,0 +1,339 @@
+"""Bộ phân loại mật độ học từ dữ liệu, thay cho ngưỡng cố định 15/8 của DenseThinHysteresis
+
+Mô hình: hồi quy logistic (NumPy, Newton/IRLS với L2) trên các đặc trưng
+  count   - tổng số xe
+  trend   - trung bình `short` tick gần nhất trừ trung bình `long` tick gần nhất
+  car, truck, bus, police_car - số xe theo loại (nếu dữ liệu huấn luyện có các cột này)
+Nhãn mặc định là nhu cầu sắp tới: trung bình số xe của `horizon` dòng kế tiếp >= threshold,
+hoặc một cột có sẵn trong log (vd. --label-column ml_state).
+
+Khi chạy, LearnedDensityClassifier thay cho controller.hysteresis: trọng số đã được gộp
+chuẩn hóa và so sánh trực tiếp với logit của ngưỡng xác suất (không cần exp), cửa sổ
+trượt giữ tổng chạy, nên mỗi tick chỉ vài phép tính float. Giữa hai ngưỡng xác suất
+thì giữ nguyên trạng thái (hysteresis như trước). classify_array() cho replay offline.
+
+Usage:
+  python traffic_density_model.py train vehicle_counts.csv vehicle_counts_calibrated.csv --out density_model.npz
+  controller.hysteresis = LearnedDensityClassifier.load('density_model.npz')
+"""
+import argparse
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+from traffic_control import DenseThinHysteresis, load_vehicle_arrays
+
+CLASS_COLUMNS = ['car', 'truck', 'bus', 'police_car']
+
+
+def window_features(counts, short=5, long=30, history=None):
+    """(count, trend) cho từng tick; cửa sổ lúc khởi động dùng các giá trị đã có
+
+    history: các số xe trước counts[0] (tối đa `long` giá trị) để nối liền giữa các khối.
+    """
+    counts = np.asarray(counts, dtype=float)
+    prefix = np.asarray(history if history is not None else [], dtype=float)[-long:]
+    full = np.concatenate([prefix, counts])
+    csum = np.concatenate([[0.0], np.cumsum(full)])
+    end = np.arange(len(prefix), len(full)) + 1
+
+    def window_mean(w):
+        start = np.maximum(end - w, 0)
+        return (csum[end] - csum[start]) / (end - start)
+    return counts, window_mean(short) - window_mean(long)
+
+
+def fit_logistic(X, y, l2=1e-2, iters=50, tol=1e-8):
+    """Hồi quy logistic bằng Newton/IRLS; X đã chuẩn hóa, trả về (weights, bias)"""
+    n, d = X.shape
+    A = np.hstack([X, np.ones((n, 1))])
+    w = np.zeros(d + 1)
+    reg = np.full(d + 1, l2)
+    reg[-1] = 0.0  # không phạt bias
+    for _ in range(iters):
+        p = 1.0 / (1.0 + np.exp(-A @ w))
+        grad = A.T @ (p - y) / n + reg * w
+        H = (A * (p * (1 - p))[:, None]).T @ A / n + np.diag(reg)
+        step = np.linalg.solve(H, grad)
+        w -= step
+        if np.abs(step).max() < tol:
+            break
+    return w[:-1], float(w[-1])
+
+
+class DensityModel:
+    """Tham số mô hình đã huấn luyện (lưu / nạp bằng npz)"""
+    def __init__(self, feature_names, weights, bias, mean, std, short=5, long=30,
+                 p_dense=0.6, p_thin=0.4, class_shares=None, info=None):
+        self.feature_names = list(feature_names)
+        self.weights = np.asarray(weights, dtype=float)
+        self.bias = float(bias)
+        self.mean = np.asarray(mean, dtype=float)
+        self.std = np.asarray(std, dtype=float)
+        self.short = int(short)
+        self.long = int(long)
+        self.p_dense = p_dense
+        self.p_thin = p_thin
+        # Tỉ lệ trung bình của từng loại xe, dùng khi lúc chạy chỉ có tổng số xe
+        self.class_shares = dict(class_shares or {})
+        self.info = dict(info or {})
+
+    def raw_coefficients(self):
+        """Trọng số trên đặc trưng chưa chuẩn hóa: z = bias + w · x"""
+        w = self.weights / self.std
+        return w, self.bias - float(w @ self.mean)
+
+    def feature_matrix(self, counts, class_counts=None, history=None):
+        count, trend = window_features(counts, self.short, self.long, history)
+        cols = {'count': count, 'trend': trend}
+        for name in self.feature_names:
+            if name in cols:
+                continue
+            if class_counts is not None and name in class_counts:
+                cols[name] = np.asarray(class_counts[name], dtype=float)
+            else:
+                cols[name] = count * self.class_shares.get(name, 0.0)
+        return np.column_stack([cols[name] for name in self.feature_names])
+
+    def predict_proba(self, counts, class_counts=None, history=None):
+        w, b = self.raw_coefficients()
+        z = self.feature_matrix(counts, class_counts, history) @ w + b
+        return 1.0 / (1.0 + np.exp(-z))
+
+    def save(self, path):
+        meta = {'feature_names': self.feature_names, 'short': self.short, 'long': self.long,
+                'p_dense': self.p_dense, 'p_thin': self.p_thin, 'bias': self.bias,
+                'class_shares': self.class_shares, 'info': self.info}
+        np.savez(path, weights=self.weights, mean=self.mean, std=self.std, meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        meta = json.loads(str(data['meta']))
+        return cls(meta['feature_names'], data['weights'], meta['bias'], data['mean'], data['std'],
+                   short=meta['short'], long=meta['long'], p_dense=meta['p_dense'], p_thin=meta['p_thin'],
+                   class_shares=meta['class_shares'], info=meta['info'])
+
+
+def _logit(p):
+    return math.log(p / (1 - p))
+
+
+class LearnedDensityClassifier:
+    """Thay thế DenseThinHysteresis: classify(count) / classify_array(counts) / current_state"""
+    def __init__(self, model):
+        self.model = model
+        self.current_state = 0
+        w, b = model.raw_coefficients()
+        names = model.feature_names
+        # Hệ số đã gộp cho đường chạy từng tick: khi chỉ có tổng số xe, số xe theo loại
+        # được ước lượng bằng count * class_shares nên gộp luôn vào hệ số của count
+        coef = dict(zip(names, w.tolist()))
+        self._w_total = coef.get('count', 0.0)
+        self._w_count = self._w_total + sum(coef[n] * model.class_shares.get(n, 0.0)
+                                            for n in names if n in CLASS_COLUMNS)
+        self._w_trend = float(w[names.index('trend')]) if 'trend' in names else 0.0
+        self._w_class = {n: float(w[i]) for i, n in enumerate(names) if n in CLASS_COLUMNS}
+        self._bias = b
+        self._z_dense = _logit(model.p_dense)
+        self._z_thin = _logit(model.p_thin)
+        # Cửa sổ trượt: vòng `long` giá trị với tổng chạy của cửa sổ ngắn và dài
+        self._window = [0.0] * model.long
+        self._n = 0
+        self._sum_short = 0.0
+        self._sum_long = 0.0
+
+    @classmethod
+    def load(cls, path):
+        return cls(DensityModel.load(path))
+
+    def _push(self, count):
+        m = self.model
+        n = self._n
+        window = self._window
+        if n >= m.long:
+            self._sum_long -= window[n % m.long]
+        if n >= m.short:
+            self._sum_short -= window[(n - m.short) % m.long]
+        window[n % m.long] = count
+        self._sum_short += count
+        self._sum_long += count
+        self._n = n + 1
+        return (self._sum_short / min(self._n, m.short)) - (self._sum_long / min(self._n, m.long))
+
+    def history(self):
+        """Các số xe trong cửa sổ theo thứ tự thời gian"""
+        m = self.model
+        k = min(self._n, m.long)
+        return [self._window[i % m.long] for i in range(self._n - k, self._n)]
+
+    def set_history(self, values):
+        """Đặt lại cửa sổ từ các số xe theo thứ tự thời gian (vd. từ BatchRunner / snapshot)"""
+        self._window = [0.0] * self.model.long
+        self._n = 0
+        self._sum_short = self._sum_long = 0.0
+        for count in list(values)[-self.model.long:]:
+            self._push(float(count))
+
+    def window_after(self, history, counts):
+        """Cửa sổ sau khi thêm counts vào history (để mang cửa sổ qua các khối như final_state)"""
+        tail = np.asarray(counts, dtype=float)[-self.model.long:].tolist()
+        return (list(history) + tail)[-self.model.long:]
+
+    def classify(self, count, class_counts=None):
+        count = float(count)
+        trend = self._push(count)
+        if class_counts is None:
+            z = self._bias + self._w_count * count + self._w_trend * trend
+        else:
+            z = self._bias + self._w_total * count + self._w_trend * trend
+            for name, w in self._w_class.items():
+                z += w * class_counts.get(name, 0.0)
+        if z >= self._z_dense:
+            self.current_state = 1
+        elif z <= self._z_thin:
+            self.current_state = 0
+        return self.current_state
+
+    def classify_array(self, counts, initial_state=None, class_counts=None, history=None):
+        """Phân loại cả mảng (cùng ngữ nghĩa với classify() lần lượt), trả về (states, final_state)
+
+        Nếu initial_state là None thì bắt đầu từ trạng thái hiện tại và cập nhật đối tượng;
+        nếu có initial_state thì không thay đổi đối tượng. history: cửa sổ trước counts[0]
+        (mặc định cửa sổ hiện tại); khi xử lý theo khối, mang cửa sổ qua các khối bằng
+        window_after() giống như final_state.
+        """
+        counts = np.asarray(counts, dtype=float)
+        start_state = self.current_state if initial_state is None else int(initial_state)
+        history = self.history() if history is None else history
+        p = self.model.predict_proba(counts, class_counts, history=history)
+        decided = np.where(p >= self.model.p_dense, 1, np.where(p <= self.model.p_thin, 0, -1)).astype(np.int8)
+        idx = np.where(decided >= 0, np.arange(len(decided)), -1)
+        np.maximum.accumulate(idx, out=idx)
+        states = np.where(idx >= 0, decided[np.maximum(idx, 0)], start_state).astype(np.int8)
+        final_state = int(states[-1]) if len(states) else start_state
+        if initial_state is None:
+            self.set_history(self.window_after(history, counts))
+            self.current_state = final_state
+        return states, final_state
+
+
+# --- Huấn luyện ------------------------------------------------------------------
+
+def future_labels(counts, horizon=20, threshold=15):
+    """1 nếu trung bình số xe của `horizon` dòng tính từ dòng hiện tại >= threshold"""
+    counts = np.asarray(counts, dtype=float)
+    csum = np.concatenate([[0.0], np.cumsum(counts)])
+    start = np.arange(len(counts))
+    end = np.minimum(start + horizon, len(counts))
+    return ((csum[end] - csum[start]) / (end - start) >= threshold).astype(float)
+
+
+def load_training_file(path, label_column=None, horizon=20, threshold=15):
+    """(counts, class_counts hoặc None, labels) từ một CSV số xe hoặc log của controller"""
+    data = load_vehicle_arrays(path)
+    if data.counts is None:
+        raise ValueError(f"CSV '{path}' has no vehicle count column")
+    header = pd.read_csv(path, nrows=0).columns
+    lower = {c.lower(): c for c in header}
+    classes = [c for c in CLASS_COLUMNS if c in lower]
+    class_counts = None
+    if classes:
+        df = pd.read_csv(path, usecols=[lower[c] for c in classes])
+        class_counts = {c: pd.to_numeric(df[lower[c]], errors='coerce').fillna(0).to_numpy(dtype=float)
+                        for c in classes}
+    if label_column is not None:
+        labels = pd.read_csv(path, usecols=[label_column])[label_column].to_numpy(dtype=float)
+    else:
+        labels = future_labels(data.counts, horizon, threshold)
+    return data.counts, class_counts, labels
+
+
+def train(paths, label_column=None, horizon=20, threshold=15, short=5, long=30, l2=1e-2,
+          p_dense=0.6, p_thin=0.4, holdout=0.2):
+    """Huấn luyện DensityModel trên các file; trả về (model, metrics trên phần holdout cuối mỗi file)"""
+    files = [load_training_file(p, label_column, horizon, threshold) for p in paths]
+    use_classes = all(cc is not None for _, cc, _ in files)
+    feature_names = ['count', 'trend'] + ([c for c in CLASS_COLUMNS if all(c in cc for _, cc, _ in files)]
+                                          if use_classes else [])
+    tmp = DensityModel(feature_names, np.zeros(len(feature_names)), 0.0, np.zeros(len(feature_names)),
+                       np.ones(len(feature_names)), short=short, long=long)
+    X_parts, y_parts, split = [], [], []
+    total = np.zeros(len(CLASS_COLUMNS))
+    for counts, class_counts, labels in files:
+        X_parts.append(tmp.feature_matrix(counts, class_counts))
+        y_parts.append(labels)
+        n_train = int(len(labels) * (1 - holdout))
+        split.append(np.arange(len(labels)) < n_train)
+        if class_counts is not None:
+            total += [class_counts.get(c, np.zeros(1)).sum() for c in CLASS_COLUMNS]
+    X, y, train_mask = np.vstack(X_parts), np.concatenate(y_parts), np.concatenate(split)
+    mean = X[train_mask].mean(axis=0)
+    std = X[train_mask].std(axis=0)
+    std[std == 0] = 1.0
+    weights, bias = fit_logistic((X[train_mask] - mean) / std, y[train_mask], l2=l2)
+    shares = dict(zip(CLASS_COLUMNS, (total / total.sum()).tolist())) if total.sum() else {}
+    model = DensityModel(feature_names, weights, bias, mean, std, short=short, long=long,
+                         p_dense=p_dense, p_thin=p_thin, class_shares=shares,
+                         info={'files': list(paths), 'label': label_column or f'future_mean>={threshold}@{horizon}',
+                               'rows': int(len(y))})
+    metrics = evaluate(model, files, ~train_mask, threshold_model=DenseThinHysteresis())
+    model.info['holdout'] = metrics
+    return model, metrics
+
+
+def evaluate(model, files, mask, threshold_model=None):
+    """Độ chính xác của mô hình (và của bộ ngưỡng cũ, nếu có) trên các dòng được chọn"""
+    offset = 0
+    correct = baseline = rows = 0
+    for counts, class_counts, labels in files:
+        sel = mask[offset:offset + len(labels)]
+        offset += len(labels)
+        clf = LearnedDensityClassifier(model)
+        states, _ = clf.classify_array(counts, class_counts=class_counts)
+        correct += int((states[sel] == labels[sel]).sum())
+        if threshold_model is not None:
+            base, _ = threshold_model.classify_array(counts, initial_state=0)
+            baseline += int((base[sel] == labels[sel]).sum())
+        rows += int(sel.sum())
+    out = {'rows': rows, 'accuracy': correct / rows if rows else None}
+    if threshold_model is not None:
+        out['threshold_accuracy'] = baseline / rows if rows else None
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train / inspect the learned density classifier')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_train = sub.add_parser('train')
+    p_train.add_argument('csv', nargs='+')
+    p_train.add_argument('--out', default='density_model.npz')
+    p_train.add_argument('--label-column', default=None, help='use this column as the label instead of future demand')
+    p_train.add_argument('--horizon', type=int, default=20, help='rows ahead averaged for the future-demand label')
+    p_train.add_argument('--threshold', type=float, default=15, help='dense if future mean count >= threshold')
+    p_train.add_argument('--short', type=int, default=5)
+    p_train.add_argument('--long', type=int, default=30)
+    p_train.add_argument('--l2', type=float, default=1e-2)
+    p_show = sub.add_parser('show')
+    p_show.add_argument('model')
+    args = parser.parse_args()
+
+    if args.cmd == 'train':
+        model, metrics = train(args.csv, label_column=args.label_column, horizon=args.horizon,
+                               threshold=args.threshold, short=args.short, long=args.long, l2=args.l2)
+        model.save(args.out)
+        print(f"Features: {', '.join(model.feature_names)}")
+        print(f"Holdout accuracy: {metrics['accuracy']:.3f} (fixed thresholds: {metrics['threshold_accuracy']:.3f}, "
+              f"{metrics['rows']} rows)")
+        print(f"Model saved to {args.out}")
+    else:
+        model = DensityModel.load(args.model)
+        w, b = model.raw_coefficients()
+        print(json.dumps({'features': dict(zip(model.feature_names, w.tolist())), 'bias': b,
+                          'p_dense': model.p_dense, 'p_thin': model.p_thin, 'info': model.info}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
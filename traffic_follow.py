@@ -0,0 +1,177 @@
+"""Theo dõi (tail -f) file vehicle_counts.csv trong lúc detector đang ghi thêm
+
+Mỗi lần poll() chỉ đọc phần byte mới kể từ lần trước, tới dòng hoàn chỉnh cuối cùng
+(dòng đang ghi dở được để lại cho lần sau). Nếu file bị thay (inode khác) hoặc nhỏ đi
+(rotate / ghi lại từ đầu) thì đọc lại từ header và dò lại cột. Mỗi lần đọc tối đa
+`max_bytes` để độ trễ của một lần poll có giới hạn (trừ khi một dòng dài hơn thế: khi đó
+đọc tiếp tới hết dòng).
+
+Usage:
+  python traffic_follow.py vehicle_counts.csv --interval 0.1
+"""
+import argparse
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from traffic_control import (EmergencyCommand, TrafficController, VehicleArrays, compile_vehicle_frame,
+                             detect_csv_columns, emergency_rising_edges)
+from traffic_timing import last_line_end
+
+
+class CsvFollower:
+    """Đọc tăng dần một file CSV số xe, trả về các dòng mới dạng VehicleArrays"""
+    def __init__(self, path, from_start=True, max_bytes=1 << 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.header = None
+        self.columns = None  # (vehicle_col, emergency_col, components) sau khi dò
+        self.offset = 0
+        self.last_emergency_value = 0
+        self.rows_read = 0
+        self.rotations = 0
+        self._inode = None
+        if not from_start and os.path.exists(path):
+            # Bỏ qua dữ liệu cũ: chỉ đọc header rồi nhảy tới sau dòng hoàn chỉnh cuối cùng
+            # (dòng đang ghi dở sẽ được đọc trọn khi detector ghi xong)
+            if self._read_header():
+                with open(path, 'rb') as f:
+                    self.offset = last_line_end(f, self.offset, os.fstat(f.fileno()).st_size)
+
+    def _reset(self):
+        self.header = None
+        self.columns = None  # file mới có thể có header khác
+        self.offset = 0
+        self.rotations += 1
+
+    def _read_header(self):
+        with open(self.path, 'rb') as f:
+            line = f.readline()
+            self._inode = os.fstat(f.fileno()).st_ino
+        if not line.endswith(b'\n'):
+            return False  # header chưa ghi xong
+        self.header = line.decode().strip().split(',')
+        self.offset = len(line)
+        return True
+
+    def _read_long_line(self, f, data):
+        """Dòng dài hơn max_bytes: đọc tiếp tới newline đầu tiên (hoặc hết file)"""
+        buf = bytearray(data)
+        while True:
+            more = f.read(self.max_bytes)
+            if not more:
+                return bytes(buf)
+            nl = more.find(b'\n')
+            if nl >= 0:
+                buf += more[:nl + 1]
+                return bytes(buf)
+            buf += more
+
+    def poll(self):
+        """Đọc các dòng mới; trả về VehicleArrays hoặc None nếu chưa có dòng hoàn chỉnh nào"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        if self.header is not None and (st.st_ino != self._inode or st.st_size < self.offset):
+            self._reset()
+        if self.header is None and not self._read_header():
+            return None
+        if st.st_size <= self.offset:
+            return None
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(self.max_bytes)
+            if b'\n' not in data and len(data) == self.max_bytes:
+                data = self._read_long_line(f, data)
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return None
+        df = pd.read_csv(io.BytesIO(data[:end]), names=self.header, header=None)
+        self.offset += end
+        if df.empty:
+            return None
+        if self.columns is None:
+            self.columns = detect_csv_columns(df)
+        vehicle_col, emergency_col, components = self.columns
+        if vehicle_col is None and not components:
+            raise ValueError(f"CSV '{self.path}' has no vehicle count column")
+
+        counts, emergency, time_s = compile_vehicle_frame(df, vehicle_col, emergency_col, components)
+        edges = emergency_rising_edges(emergency, self.last_emergency_value)
+        self.last_emergency_value = int(emergency[-1])
+        self.rows_read += len(counts)
+        return VehicleArrays(counts, emergency, edges, time_s, vehicle_col, emergency_col, components)
+
+
+def emergency_command_rows(data, max_rows=None):
+    """(counts, emergency_cmds) cho các dòng cần đưa vào controller
+
+    Nếu có nhiều hơn max_rows dòng thì chỉ giữ max_rows dòng mới nhất (giới hạn độ trễ);
+    cạnh lên emergency nằm trong phần bị bỏ được dời sang dòng đầu tiên được giữ.
+    """
+    counts = data.counts
+    cmds = np.full(len(counts), EmergencyCommand.NONE.value, dtype=np.int8)
+    if data.emergency_col is not None:
+        cmds[data.emergency_edges] = EmergencyCommand.NS_PRIORITY.value
+    if max_rows is not None and len(counts) > max_rows:
+        skipped = len(counts) - max_rows
+        dropped_edge = (cmds[:skipped] != EmergencyCommand.NONE.value).any()
+        counts, cmds = counts[skipped:], cmds[skipped:]
+        if dropped_edge:
+            cmds[0] = EmergencyCommand.NS_PRIORITY.value
+    return counts, cmds
+
+
+def feed_rows(controller, data, max_rows=None):
+    """Đưa từng dòng mới vào controller.update_state; trả về (vehicle_count, lights) của dòng cuối"""
+    counts, cmds = emergency_command_rows(data, max_rows)
+    lights = None
+    for count, cmd in zip(counts.tolist(), cmds.tolist()):
+        lights = controller.update_state(count, EmergencyCommand(cmd))
+    return (int(counts[-1]) if len(counts) else None), lights
+
+
+def follow(path, controller=None, interval=0.1, max_rows=100, duration=None, from_start=True):
+    """Vòng lặp theo dõi file: poll mỗi `interval` giây và cập nhật controller"""
+    controller = controller if controller is not None else TrafficController()
+    follower = CsvFollower(path, from_start=from_start)
+    deadline = time.monotonic() + duration if duration is not None else None
+    last_state = None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            data = follower.poll()
+            if data is not None:
+                count, _ = feed_rows(controller, data, max_rows)
+                if controller.current_state != last_state:
+                    last_state = controller.current_state
+                    print(f"rows={follower.rows_read} vehicles={count} state={last_state.value}")
+            else:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return controller, follower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Follow a growing vehicle counts CSV and drive the controller')
+    parser.add_argument('csv', nargs='?', default='vehicle_counts.csv')
+    parser.add_argument('--interval', type=float, default=0.1, help='poll interval in seconds')
+    parser.add_argument('--max-rows', type=int, default=100, help='max rows fed per poll (older rows are skipped)')
+    parser.add_argument('--duration', type=float, default=None, help='stop after this many seconds')
+    parser.add_argument('--from-end', action='store_true', help='skip rows already in the file')
+    parser.add_argument('--log', default='smart_traffic_log.csv')
+    args = parser.parse_args()
+
+    controller, follower = follow(args.csv, interval=args.interval, max_rows=args.max_rows,
+                                  duration=args.duration, from_start=not args.from_end)
+    print(f"Read {follower.rows_read} rows ({follower.rotations} rotations)")
+    controller.save_log(args.log)
+
+
+if __name__ == "__main__":
+    main()
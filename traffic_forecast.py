@@ -0,0 +1,173 @@
+"""Dự báo nhu cầu ngắn hạn (Holt / Holt-Winters cộng tính) cập nhật O(1) mỗi tick
+
+calculate_green_duration chỉ phản ứng theo số xe hiện tại nên luôn trễ so với nhu cầu.
+Forecaster giữ mức (level), xu hướng (trend, xe/giây) và tùy chọn thành phần mùa theo
+ô thời gian (vd. 96 ô 15 phút trong ngày); mỗi tick cập nhật vài phép tính float.
+Hệ số làm trơn tính theo hằng số thời gian (giây) nên không phụ thuộc chu kỳ tick:
+alpha = 1 - exp(-dt / tau).
+
+predict(horizon) là số xe trung bình dự báo trong `horizon` giây tới (level + trend * h/2
++ mùa tại giữa khoảng). Gắn vào controller bằng `controller.forecaster = HoltForecaster()`
+thì thời gian xanh được tính theo dự báo cho pha kế tiếp thay vì trạng thái dense/thin;
+khi controller nhận approach_counts, mỗi hướng có một bản clone() và pha xanh theo dự báo
+lớn nhất của các hướng nó phục vụ.
+
+ForecasterArray: cùng công thức cho N giao lộ dạng mảng float32 (dùng với IntersectionArray),
+mỗi giao lộ chỉ tốn 8 byte + 4 byte cho mỗi ô mùa.
+
+Usage:
+  controller.forecaster = HoltForecaster(season_slots=96)  # mùa theo ngày, ô 15 phút
+  network.forecaster = ForecasterArray(network.n)
+"""
+import math
+from array import array
+
+import numpy as np
+
+LEVEL_TAU = 30.0    # giây
+TREND_TAU = 120.0
+SLOT_SECONDS = 900  # 15 phút
+
+
+def _smoothing(dt, tau):
+    return 1.0 - math.exp(-dt / tau) if tau > 0 else 1.0
+
+
+class HoltForecaster:
+    """Forecaster cho một giao lộ: update(count, t) O(1), predict(horizon)"""
+    __slots__ = ('level_tau', 'trend_tau', 'season_tau', 'slot_seconds', 'level', 'trend',
+                 'last_t', 'seasonal', '_dt', '_alpha', '_beta', '_gamma')
+
+    def __init__(self, level_tau=LEVEL_TAU, trend_tau=TREND_TAU, season_slots=0,
+                 slot_seconds=SLOT_SECONDS, season_tau=None):
+        self.level_tau = float(level_tau)
+        self.trend_tau = float(trend_tau)
+        # Mặc định mỗi chu kỳ mùa đóng góp ~30% vào ô (3 lần độ dài ô)
+        self.season_tau = float(season_tau if season_tau is not None else 3 * slot_seconds)
+        self.slot_seconds = float(slot_seconds)
+        self.level = 0.0
+        self.trend = 0.0
+        self.last_t = None
+        self.seasonal = array('f', bytes(4 * season_slots)) if season_slots else None
+        # Hệ số làm trơn của lần cập nhật trước (tick đều thì không phải tính lại exp)
+        self._dt = None
+        self._alpha = self._beta = self._gamma = 0.0
+
+    def _slot(self, t):
+        return int(t // self.slot_seconds) % len(self.seasonal)
+
+    def update(self, count, t):
+        """Thêm quan sát `count` tại thời điểm t (giây, đồng hồ của controller)"""
+        count = float(count)
+        seasonal = self.seasonal
+        slot = self._slot(t) if seasonal is not None else 0
+        season = seasonal[slot] if seasonal is not None else 0.0
+        if self.last_t is None:
+            self.level = count - season
+            self.last_t = t
+            return self.level
+        dt = t - self.last_t
+        if dt <= 0:
+            return self.level  # cùng thời điểm: bỏ qua
+        if dt != self._dt:
+            self._dt = dt
+            self._alpha = _smoothing(dt, self.level_tau)
+            self._beta = _smoothing(dt, self.trend_tau)
+            self._gamma = _smoothing(dt, self.season_tau)
+        prev = self.level
+        level = self._alpha * (count - season) + (1 - self._alpha) * (prev + self.trend * dt)
+        self.trend += self._beta * ((level - prev) / dt - self.trend)
+        if seasonal is not None:
+            seasonal[slot] = season + self._gamma * (count - level - season)
+        self.level = level
+        self.last_t = t
+        return level
+
+    def predict(self, horizon):
+        """Số xe trung bình dự báo trong `horizon` giây tới (không âm)"""
+        if self.last_t is None:
+            return 0.0
+        mid = horizon / 2
+        value = self.level + self.trend * mid
+        if self.seasonal is not None:
+            value += self.seasonal[self._slot(self.last_t + mid)]
+        return value if value > 0 else 0.0
+
+    def clone(self):
+        """Forecaster mới (chưa có quan sát) cùng tham số, vd. một cái cho mỗi hướng"""
+        return HoltForecaster(self.level_tau, self.trend_tau, len(self.seasonal) if self.seasonal is not None else 0,
+                              self.slot_seconds, self.season_tau)
+
+    def reset(self):
+        self.level = self.trend = 0.0
+        self.last_t = None
+        if self.seasonal is not None:
+            self.seasonal = array('f', bytes(4 * len(self.seasonal)))
+
+
+class ForecasterArray:
+    """Forecaster cho N giao lộ (struct-of-arrays float32), cùng công thức với HoltForecaster"""
+    def __init__(self, n, level_tau=LEVEL_TAU, trend_tau=TREND_TAU, season_slots=0,
+                 slot_seconds=SLOT_SECONDS, season_tau=None):
+        self.n = n
+        self.level_tau = float(level_tau)
+        self.trend_tau = float(trend_tau)
+        self.season_tau = float(season_tau if season_tau is not None else 3 * slot_seconds)
+        self.slot_seconds = float(slot_seconds)
+        self.level = np.zeros(n, dtype=np.float32)
+        self.trend = np.zeros(n, dtype=np.float32)
+        self.seasonal = np.zeros((n, season_slots), dtype=np.float32) if season_slots else None
+        self.last_t = None  # các giao lộ cập nhật cùng thời điểm
+        self._rows = np.arange(n)
+
+    @property
+    def nbytes(self):
+        total = self.level.nbytes + self.trend.nbytes
+        return total + (self.seasonal.nbytes if self.seasonal is not None else 0)
+
+    def _slot(self, t):
+        return int(t // self.slot_seconds) % self.seasonal.shape[1]
+
+    def update(self, counts, t):
+        counts = np.asarray(counts, dtype=np.float32)
+        seasonal = self.seasonal
+        if seasonal is not None:
+            slot = self._slot(t)
+            season = seasonal[:, slot]
+        else:
+            season = 0.0
+        if self.last_t is None:
+            self.level[:] = counts - season
+            self.last_t = t
+            return self.level
+        dt = t - self.last_t
+        if dt <= 0:
+            return self.level
+        alpha = _smoothing(dt, self.level_tau)
+        beta = _smoothing(dt, self.trend_tau)
+        prev = self.level
+        level = alpha * (counts - season) + (1 - alpha) * (prev + self.trend * dt)
+        self.trend += beta * ((level - prev) / dt - self.trend)
+        if seasonal is not None:
+            seasonal[:, slot] = season + _smoothing(dt, self.season_tau) * (counts - level - season)
+        self.level = level.astype(np.float32, copy=False)
+        self.last_t = t
+        return self.level
+
+    def predict(self, horizon):
+        """Số xe trung bình dự báo trong `horizon` giây tới; horizon là số hoặc mảng (N,)"""
+        if self.last_t is None:
+            return np.zeros(self.n, dtype=np.float32)
+        mid = np.asarray(horizon, dtype=np.float32) / 2
+        value = self.level + self.trend * mid
+        if self.seasonal is not None:
+            slots = ((self.last_t + mid) // self.slot_seconds).astype(np.int64) % self.seasonal.shape[1]
+            value = value + self.seasonal[self._rows, slots]
+        return np.maximum(value, 0.0)
+
+    def reset(self):
+        self.level[:] = 0
+        self.trend[:] = 0
+        if self.seasonal is not None:
+            self.seasonal[:] = 0
+        self.last_t = None
@@ -0,0 +1,166 @@
+"""Bộ đệm log dạng cột, cấp phát trước, có giới hạn dung lượng
+
+Mỗi cột là một mảng NumPy cố định: timestamp là số nguyên (micro giây của đồng hồ
+controller), state/đèn/ml/emergency là mã số nhỏ, duration là float.
+Khi đầy: 'overwrite' ghi đè dòng cũ nhất (ring buffer), 'flush' gọi on_flush với
+dữ liệu hiện có rồi xóa bộ đệm. Nếu gắn sink (traffic_log_sink.LogSink), các dòng mới
+được gửi theo lô cho sink ghi ra đĩa ở thread nền.
+"""
+import numpy as np
+
+DEFAULT_LOG_CAPACITY = 1 << 20  # ~29 giờ ở 10 Hz
+# Giống định dạng khi pandas ghi datetime.now() (có micro giây)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+LIGHT_NAMES = ['Red', 'Yellow', 'Green', 'Off']
+LIGHT_CODES = {name: i for i, name in enumerate(LIGHT_NAMES)}
+
+LOG_SCHEMA = [
+    ('timestamp', np.int64),
+    ('state', np.int8),
+    ('ns_light', np.int8),
+    ('ew_light', np.int8),
+    ('vehicle_count', np.int64),
+    ('ml_state', np.int8),
+    ('emergency', np.int8),
+    ('duration', np.float64),
+]
+LOG_COLUMNS = [name for name, _ in LOG_SCHEMA]
+
+
+class LogBuffer:
+    """Ring buffer dạng cột cho log của TrafficController"""
+    def __init__(self, capacity=DEFAULT_LOG_CAPACITY, overflow='overwrite', on_flush=None,
+                 state_names=None, sink=None):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if overflow not in ('overwrite', 'flush'):
+            raise ValueError("overflow must be 'overwrite' or 'flush'")
+        if overflow == 'flush' and on_flush is None and sink is None:
+            raise ValueError("overflow='flush' needs an on_flush callback or a sink")
+        if sink is not None and sink.batch_rows > capacity:
+            raise ValueError("sink batch_rows must not exceed capacity")
+        self.capacity = capacity
+        self.overflow = overflow
+        self.on_flush = on_flush
+        self.state_names = list(state_names) if state_names is not None else None
+        self.sink = sink
+        self._unsent = 0  # số dòng chưa gửi cho sink
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in LOG_SCHEMA}
+        self._pos = 0  # vị trí ghi tiếp theo
+        self._size = 0
+        self.total_rows = 0  # tổng số dòng đã ghi (kể cả đã bị ghi đè / flush)
+        self.dropped_rows = 0
+        # Mốc (datetime, timestamp_us) để đổi timestamp số nguyên về datetime khi xuất
+        self.origin = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.columns.values())
+
+    def set_origin(self, when, timestamp_us):
+        self.origin = (when, int(timestamp_us))
+
+    def append(self, timestamp_us, state, ns_light, ew_light, vehicle_count, ml_state, emergency, duration):
+        """Ghi một dòng (đã mã hóa sẵn)"""
+        if self._size == self.capacity:
+            if self.overflow == 'flush':
+                self.flush()
+            else:
+                self.dropped_rows += 1
+        i = self._pos
+        c = self.columns
+        c['timestamp'][i] = timestamp_us
+        c['state'][i] = state
+        c['ns_light'][i] = ns_light
+        c['ew_light'][i] = ew_light
+        c['vehicle_count'][i] = vehicle_count
+        c['ml_state'][i] = ml_state
+        c['emergency'][i] = emergency
+        c['duration'][i] = duration
+        self._pos = i + 1 if i + 1 < self.capacity else 0
+        if self._size < self.capacity:
+            self._size += 1
+        self.total_rows += 1
+        if self.sink is not None:
+            self._unsent += 1
+            if self._unsent >= self.sink.batch_rows:
+                self.drain()
+
+    def segments(self):
+        """Các đoạn view (không copy) theo thứ tự thời gian: 1 đoạn, hoặc 2 nếu đã vòng"""
+        if self._size < self.capacity or self._pos == 0:
+            return [slice(0, self._size)] if self._size else []
+        return [slice(self._pos, self.capacity), slice(0, self._pos)]
+
+    def view(self):
+        """Dict cột theo thứ tự thời gian; không copy trừ khi ring buffer đã vòng"""
+        segs = self.segments()
+        if len(segs) <= 1:
+            s = segs[0] if segs else slice(0, 0)
+            return {name: arr[s] for name, arr in self.columns.items()}
+        return {name: np.concatenate([arr[s] for s in segs]) for name, arr in self.columns.items()}
+
+    def tail(self, n):
+        """Bản copy n dòng mới nhất (theo thứ tự thời gian)"""
+        n = min(n, self._size)
+        start = self._pos - n
+        if start >= 0:
+            return {name: arr[start:self._pos].copy() for name, arr in self.columns.items()}
+        return {name: np.concatenate([arr[start:], arr[:self._pos]]) for name, arr in self.columns.items()}
+
+    def drain(self):
+        """Gửi các dòng chưa gửi cho sink (không chặn: sink tự ghi ở thread nền)"""
+        if self.sink is not None and self._unsent:
+            self.sink.submit(self.tail(self._unsent), self.to_frame)
+        self._unsent = 0
+
+    def clear(self):
+        self._pos = 0
+        self._size = 0
+
+    def load(self, columns):
+        """Thay nội dung bằng các cột cho sẵn (vd. từ snapshot), giữ `capacity` dòng cuối
+
+        Các dòng này coi như đã được gửi cho sink; total_rows / dropped_rows không đổi.
+        """
+        n = min(len(columns['timestamp']), self.capacity)
+        for name, arr in self.columns.items():
+            arr[:n] = columns[name][len(columns[name]) - n:]
+        self._size = n
+        self._pos = n if n < self.capacity else 0
+        self._unsent = 0
+
+    def flush(self):
+        """Gửi dữ liệu hiện có cho sink / on_flush rồi xóa bộ đệm"""
+        self.drain()
+        if self._size and self.on_flush is not None:
+            self.on_flush(self)
+        self.clear()
+
+    def decode_timestamps(self, timestamp_us):
+        """Đổi timestamp số nguyên (micro giây) về datetime64"""
+        if self.origin is None:
+            return np.asarray(timestamp_us).astype('datetime64[us]')
+        when, origin_us = self.origin
+        return np.datetime64(when, 'us') + (np.asarray(timestamp_us) - origin_us).astype('timedelta64[us]')
+
+    def to_frame(self, columns=None):
+        """DataFrame cùng cột/giá trị với log dict-of-lists trước đây"""
+        import pandas as pd  # chỉ cần khi xuất log, không cần cho vòng điều khiển
+        columns = columns if columns is not None else self.view()
+        light_names = np.array(LIGHT_NAMES, dtype=object)
+        state = columns['state']
+        return pd.DataFrame({
+            'timestamp': self.decode_timestamps(columns['timestamp']),
+            'state': np.array(self.state_names, dtype=object)[state] if self.state_names else state,
+            'ns_light': light_names[columns['ns_light']],
+            'ew_light': light_names[columns['ew_light']],
+            'vehicle_count': columns['vehicle_count'],
+            'ml_state': columns['ml_state'],
+            'emergency': columns['emergency'],
+            'duration': columns['duration'],
+        }, columns=LOG_COLUMNS)
@@ -0,0 +1,157 @@
+"""Ghi log liên tục ra đĩa (CSV hoặc Parquet) bằng thread nền
+
+LogBuffer gửi từng lô dòng qua submit(); vòng điều khiển không bao giờ chờ I/O:
+nếu hàng đợi đầy (hoặc sink đã đóng) thì lô bị bỏ và được đếm trong dropped_batches.
+File được xoay vòng (rotate) theo dung lượng hoặc theo thời gian.
+
+Usage:
+  sink = LogSink('logs/traffic_log', fmt='csv', rotate_bytes=64 << 20)
+  controller = TrafficController(log=LogBuffer(sink=sink))
+  ...
+  controller.close_log()
+"""
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from traffic_log import TIMESTAMP_FORMAT
+
+FORMATS = ('csv', 'parquet')
+POLL_SECONDS = 0.1  # thread ghi kiểm tra cờ đóng khi hàng đợi rỗng
+
+
+class LogSink:
+    """Sink ghi log theo lô ở thread nền, xoay vòng file theo dung lượng / thời gian"""
+    def __init__(self, base_path, fmt='csv', batch_rows=1000, rotate_bytes=None,
+                 rotate_seconds=None, max_queue=256):
+        if fmt not in FORMATS:
+            raise ValueError(f"fmt must be one of {FORMATS}")
+        if fmt == 'parquet':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError as e:
+                raise ImportError("fmt='parquet' requires pyarrow (pip install pyarrow)") from e
+        self.base_path = base_path
+        self.fmt = fmt
+        self.batch_rows = batch_rows
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+
+        self.files = []  # danh sách file đã tạo
+        self.rows_written = 0
+        self.dropped_batches = 0
+        self.dropped_rows = 0
+        self.error = None
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._path = None
+        self._handle = None
+        self._writer = None  # pyarrow.parquet.ParquetWriter
+        self._opened_at = 0.0
+        self._seq = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='LogSinkWriter', daemon=True)
+        self._thread.start()
+
+    def submit(self, columns, to_frame):
+        """Đưa một lô (dict cột đã copy) vào hàng đợi; không bao giờ chặn
+
+        Sau close() thì lô bị bỏ (đếm như khi hàng đợi đầy), vòng điều khiển không bị lỗi.
+        """
+        if not self._closed:
+            try:
+                self._queue.put_nowait((columns, to_frame))
+                return
+            except queue.Full:
+                pass
+        self.dropped_batches += 1
+        self.dropped_rows += len(next(iter(columns.values()))) if columns else 0
+
+    @property
+    def pending_batches(self):
+        return self._queue.qsize()
+
+    def close(self, timeout=None):
+        """Ghi nốt các lô còn trong hàng đợi rồi đóng file (chờ tối đa timeout giây)
+
+        Không chặn khi hàng đợi đầy: thread ghi tự dừng khi thấy cờ đóng và hàng đợi rỗng.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._queue.put_nowait(None)  # đánh thức thread ghi ngay nếu còn chỗ
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    # --- Thread ghi ---------------------------------------------------------
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                if self._closed:
+                    break
+                continue
+            if item is None:
+                break
+            columns, to_frame = item
+            try:
+                self._write(to_frame(columns))
+            except Exception as e:  # không để thread chết âm thầm
+                self.error = e
+                print(f"LogSink write failed: {e}")
+        self._close_file()
+
+    def _new_path(self):
+        self._seq += 1
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return f"{self.base_path}_{stamp}_{self._seq:04d}.{self.fmt}"
+
+    def _should_rotate(self):
+        if self._path is None:
+            return True
+        if self.rotate_seconds is not None and time.monotonic() - self._opened_at >= self.rotate_seconds:
+            return True
+        if self.rotate_bytes is not None and os.path.getsize(self._path) >= self.rotate_bytes:
+            return True
+        return False
+
+    def _open_file(self):
+        self._close_file()
+        self._path = self._new_path()
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._opened_at = time.monotonic()
+        self.files.append(self._path)
+        if self.fmt == 'csv':
+            self._handle = open(self._path, 'w', newline='')
+
+    def _close_file(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def _write(self, df):
+        if self._should_rotate():
+            self._open_file()
+        if self.fmt == 'csv':
+            df.to_csv(self._handle, header=self._handle.tell() == 0, index=False,
+                      date_format=TIMESTAMP_FORMAT)
+            self._handle.flush()
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self._path, table.schema)
+            self._writer.write_table(table)
+        self.rows_written += len(df)
@@ -0,0 +1,206 @@
+"""Đo đạc vòng điều khiển: histogram độ trễ update_state, đếm chuyển pha, emergency, log
+
+Gắn vào controller bằng `controller.metrics = ControllerMetrics(controller.phases)`;
+khi metrics là None, update_state chỉ tốn thêm một phép so sánh. Số liệu lấy qua
+stats() (dict) hoặc to_prometheus() (định dạng text exposition), và có thể được ghi
+định kỳ ra file .prom cho node_exporter textfile collector bằng PrometheusTextfile.
+
+Usage:
+  controller.metrics = ControllerMetrics(controller.phases)
+  textfile = PrometheusTextfile(controller, '/var/lib/node_exporter/traffic.prom', interval=15)
+  ...
+  textfile.close()
+"""
+import bisect
+import os
+import threading
+
+from traffic_control import EmergencyCommand
+
+# Giới hạn trên của các bucket (giây)
+TICK_LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 0.1)
+EMERGENCY_BUCKETS = (1, 2, 3, 5, 10, 20, 30, 45, 60, 120)
+
+
+class Histogram:
+    """Histogram kiểu Prometheus (bucket cộng dồn khi xuất), observe O(log số bucket)"""
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # bucket cuối: +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def cumulative(self):
+        total = 0
+        out = []
+        for bound, n in zip(self.bounds + (float('inf'),), self.counts):
+            total += n
+            out.append((bound, total))
+        return out
+
+    def quantile(self, q):
+        """Ước lượng quantile bằng giới hạn trên của bucket chứa nó"""
+        if not self.count:
+            return None
+        target = q * self.count
+        for bound, total in self.cumulative():
+            if total >= target:
+                return bound if bound != float('inf') else self.max
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else None,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99), 'max': self.max}
+
+
+class ControllerMetrics:
+    """Số liệu của một TrafficController, cập nhật trong update_state"""
+    def __init__(self, phases, latency_buckets=TICK_LATENCY_BUCKETS, emergency_buckets=EMERGENCY_BUCKETS):
+        self.phases = phases
+        n = len(phases)
+        self.ticks = 0
+        self.tick_latency = Histogram(latency_buckets)
+        self.transitions = [[0] * n for _ in range(n)]  # [từ pha][sang pha]
+        self.preemptions = {}  # mã EmergencyCommand -> số lần
+        self.time_to_green = Histogram(emergency_buckets)
+        self.emergency_duration = Histogram(emergency_buckets)
+
+    def observe_tick(self, controller, latency, prev_phase, prev_emergency):
+        """Gọi cuối update_state với trạng thái trước tick"""
+        self.ticks += 1
+        self.tick_latency.observe(latency)
+        phase = controller._phase
+        phases = self.phases
+        if controller.emergency_active and not prev_emergency:
+            # Vừa preempt: prev -> clearance (và có thể clearance -> xanh ưu tiên ngay trong tick)
+            cmd = controller.emergency_command.value
+            self.preemptions[cmd] = self.preemptions.get(cmd, 0) + 1
+            clearance = phases.clearance
+            if prev_phase != clearance:
+                self.transitions[prev_phase][clearance] += 1
+            prev_phase = clearance
+        if phase != prev_phase:
+            self.transitions[prev_phase][phase] += 1
+            if controller.emergency_active and prev_phase == phases.clearance and phases.is_green[phase]:
+                self.time_to_green.observe(controller.clock.time() - controller.emergency_start_time)
+        if prev_emergency and not controller.emergency_active:
+            self.emergency_duration.observe(controller.clock.time() - controller.emergency_start_time)
+
+    def transition_counts(self):
+        names = self.phases.names
+        rows = [list(row) for row in self.transitions]  # bản copy, đọc được từ thread khác
+        return {(names[i], names[j]): n for i, row in enumerate(rows) for j, n in enumerate(row) if n}
+
+    def stats(self, controller=None):
+        """Tất cả số liệu dạng dict; nếu có controller thì kèm trạng thái log / pha hiện tại"""
+        out = {
+            'ticks': self.ticks,
+            'tick_latency': self.tick_latency.summary(),
+            'transitions': {f"{a}->{b}": n for (a, b), n in self.transition_counts().items()},
+            'preemptions': {EmergencyCommand(cmd).name: n for cmd, n in list(self.preemptions.items())},
+            'time_to_green': self.time_to_green.summary(),
+            'emergency_duration': self.emergency_duration.summary(),
+        }
+        if controller is not None:
+            log = controller.log
+            out['log'] = {'rows': len(log), 'capacity': log.capacity, 'total_rows': log.total_rows,
+                          'dropped_rows': log.dropped_rows, 'bytes': log.nbytes}
+            out['phase'] = self.phases.names[controller._phase]
+            out['emergency_active'] = controller.emergency_active
+        return out
+
+    def to_prometheus(self, controller=None, prefix='traffic'):
+        """Số liệu theo định dạng Prometheus text exposition"""
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        def histogram(name, hist, help_text):
+            metric(name, 'histogram', help_text)
+            for bound, total in hist.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'{prefix}_{name}_bucket{{le="{le}"}} {total}')
+            lines.append(f"{prefix}_{name}_sum {hist.sum!r}")
+            lines.append(f"{prefix}_{name}_count {hist.count}")
+
+        metric('ticks_total', 'counter', 'Number of update_state calls')
+        lines.append(f"{prefix}_ticks_total {self.ticks}")
+        histogram('update_state_seconds', self.tick_latency, 'Wall time spent in update_state')
+        metric('phase_transitions_total', 'counter', 'Phase changes by from/to phase')
+        for (a, b), n in self.transition_counts().items():
+            lines.append(f'{prefix}_phase_transitions_total{{from="{a}",to="{b}"}} {n}')
+        metric('emergency_preemptions_total', 'counter', 'Emergency preemptions by command')
+        # Thread đọc (HTTP / textfile) chạy song song với vòng điều khiển: duyệt trên bản copy
+        for cmd, n in list(self.preemptions.items()):
+            lines.append(f'{prefix}_emergency_preemptions_total{{command="{EmergencyCommand(cmd).name}"}} {n}')
+        histogram('emergency_time_to_green_seconds', self.time_to_green,
+                  'Controller time from emergency trigger to priority green')
+        histogram('emergency_duration_seconds', self.emergency_duration,
+                  'Controller time from emergency trigger to the end of priority green')
+        if controller is not None:
+            log = controller.log
+            for name, value, help_text in (('log_rows', len(log), 'Rows currently held in the log buffer'),
+                                           ('log_capacity_rows', log.capacity, 'Log buffer capacity'),
+                                           ('log_bytes', log.nbytes, 'Memory held by the log buffer')):
+                metric(name, 'gauge', help_text)
+                lines.append(f"{prefix}_{name} {value}")
+            metric('log_rows_total', 'counter', 'Rows ever appended to the log')
+            lines.append(f"{prefix}_log_rows_total {log.total_rows}")
+            metric('log_dropped_rows_total', 'counter', 'Rows overwritten in the log')
+            lines.append(f"{prefix}_log_dropped_rows_total {log.dropped_rows}")
+            metric('phase', 'gauge', 'Current phase (1 for the active phase)')
+            for i, name in enumerate(self.phases.names):
+                lines.append(f'{prefix}_phase{{phase="{name}"}} {int(i == controller._phase)}')
+            metric('emergency_active', 'gauge', '1 while an emergency preemption is active')
+            lines.append(f"{prefix}_emergency_active {int(controller.emergency_active)}")
+        return '\n'.join(lines) + '\n'
+
+
+class PrometheusTextfile:
+    """Thread nền ghi định kỳ controller.metrics ra file .prom (ghi file tạm rồi os.replace)"""
+    def __init__(self, controller, path, interval=15.0):
+        if controller.metrics is None:
+            controller.metrics = ControllerMetrics(controller.phases)
+        self.controller = controller
+        self.path = path
+        self.interval = interval
+        self.writes = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='PrometheusTextfile', daemon=True)
+        self._thread.start()
+
+    def write(self):
+        text = self.controller.metrics.to_prometheus(self.controller)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, self.path)  # scraper không bao giờ đọc file ghi dở
+        self.writes += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:  # không để thread chết âm thầm
+                self.error = e
+                print(f"Prometheus textfile write failed: {e}")
+
+    def close(self):
+        """Dừng thread và ghi lần cuối"""
+        self._stop.set()
+        self._thread.join()
+        self.write()
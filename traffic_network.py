@@ -0,0 +1,192 @@
+"""Mô phỏng nhiều giao lộ cùng lúc (struct-of-arrays)
+
+Trạng thái của N giao lộ (pha hiện tại, thời điểm bắt đầu pha, hysteresis, emergency,
+tham số thời gian) được giữ trong các mảng NumPy và cập nhật bằng một bước vector hóa,
+cùng luật chuyển trạng thái với TrafficController._handle_normal_states /
+_handle_emergency_states. Tất cả giao lộ dùng chung một bảng pha (PhaseTable).
+"""
+from datetime import datetime
+
+import numpy as np
+
+from traffic_control import EmergencyCommand, TrafficController
+from traffic_batch import phase_name_arrays, rush_hour_flags
+from traffic_phases import RULE_CODES, YELLOW_RULE, ALL_RED_RULE
+
+
+def _thresholds(hysteresis):
+    """(dense_thresh, thin_thresh) của bộ phân loại ngưỡng; bộ phân loại khác không hỗ trợ"""
+    try:
+        return hysteresis.dense_thresh, hysteresis.thin_thresh
+    except AttributeError:
+        raise ValueError(f"IntersectionArray needs a threshold hysteresis (dense_thresh/thin_thresh), "
+                         f"got {type(hysteresis).__name__}") from None
+
+
+class IntersectionArray:
+    """Trạng thái của N giao lộ dạng mảng, mỗi giao lộ tương đương một TrafficController"""
+    def __init__(self, n, template=None, t0=0.0):
+        template = template if template is not None else TrafficController()
+        self.n = n
+        self.rush_hours = list(template.rush_hours)
+        self.timing_plan = template.timing_plan
+
+        # Bảng pha dạng mảng để tra theo mã pha
+        phases = template.phases
+        self.phases = phases
+        self._next = np.array(phases.next, dtype=np.int16)
+        self._is_green = np.array(phases.is_green, dtype=bool)
+        self._rule = np.array(phases.rule, dtype=np.int8)
+        self._fixed = np.array(phases.fixed, dtype=float)
+        self._clearance = phases.clearance
+        self._priority = np.zeros(max(list(phases.emergency) + [0]) + 1, dtype=np.int16)
+        for cmd, phase in phases.emergency.items():
+            self._priority[cmd] = phase
+
+        # Tham số thời gian (có thể khác nhau giữa các giao lộ)
+        self.base_green_time = np.full(n, template.base_green_time, dtype=float)
+        self.yellow_time = np.full(n, template.yellow_time, dtype=float)
+        self.all_red_time = np.full(n, template.all_red_time, dtype=float)
+        self.emergency_green_time = np.full(n, template.emergency_green_time, dtype=float)
+        self.ml_enabled = np.full(n, template.ml_enabled, dtype=bool)
+        self.ml_adjustment_factor = np.full(n, template.ml_adjustment_factor, dtype=float)
+        self.rush_hour_multiplier = np.full(n, template.rush_hour_multiplier, dtype=float)
+        dense, thin = _thresholds(template.hysteresis)
+        self.dense_thresh = np.full(n, dense, dtype=float)
+        self.thin_thresh = np.full(n, thin, dtype=float)
+        # traffic_forecast.ForecasterArray: nếu có thì thời gian xanh theo số xe dự báo
+        self.forecaster = None
+        self.forecast_demand_range = template.forecast_demand_range
+
+        # Trạng thái động
+        self.state = np.full(n, template._phase, dtype=np.int16)
+        self.state_start = np.full(n, float(t0))
+        self.ml_state = np.full(n, template.hysteresis.current_state, dtype=np.int8)
+        self.emergency_active = np.full(n, template.emergency_active, dtype=bool)
+        self.emergency_command = np.full(n, template.emergency_command.value, dtype=np.int8)
+        self.emergency_start = np.zeros(n)
+
+    @classmethod
+    def from_controllers(cls, controllers, t0=0.0):
+        """Tạo từ danh sách TrafficController (lấy tham số và trạng thái của từng cái)"""
+        arr = cls(len(controllers), template=controllers[0] if controllers else None, t0=t0)
+        for i, c in enumerate(controllers):
+            arr.base_green_time[i] = c.base_green_time
+            arr.yellow_time[i] = c.yellow_time
+            arr.all_red_time[i] = c.all_red_time
+            arr.emergency_green_time[i] = c.emergency_green_time
+            arr.ml_enabled[i] = c.ml_enabled
+            arr.ml_adjustment_factor[i] = c.ml_adjustment_factor
+            arr.rush_hour_multiplier[i] = c.rush_hour_multiplier
+            arr.dense_thresh[i], arr.thin_thresh[i] = _thresholds(c.hysteresis)
+            if c.phases is not arr.phases:
+                raise ValueError("all controllers must share the same phase table")
+            arr.state[i] = c._phase
+            arr.ml_state[i] = c.hysteresis.current_state
+            arr.emergency_active[i] = c.emergency_active
+            arr.emergency_command[i] = c.emergency_command.value
+        return arr
+
+    def green_duration(self, multiplier):
+        """Tương đương calculate_green_duration cho cả mảng (multiplier: hệ số theo lịch)"""
+        base_time = self.base_green_time * multiplier
+        if self.forecaster is not None:
+            low, high = self.forecast_demand_range
+            fraction = np.clip((self.forecaster.predict(base_time) - low) / (high - low), 0.0, 1.0)
+            fraction = np.where(self.ml_enabled, fraction, 0.0)
+            return np.clip(np.trunc(base_time + base_time * self.ml_adjustment_factor * fraction), 15, 60)
+        dense = self.ml_enabled & (self.ml_state == 1)
+        base_time = np.where(dense, base_time + base_time * self.ml_adjustment_factor, base_time)
+        return np.clip(np.trunc(base_time), 15, 60)
+
+    def phase_durations(self):
+        """Thời gian của pha hiện tại với các pha không phải pha xanh"""
+        rule = self._rule[self.state]
+        return np.where(rule == RULE_CODES[YELLOW_RULE], self.yellow_time,
+                        np.where(rule == RULE_CODES[ALL_RED_RULE], self.all_red_time,
+                                 self._fixed[self.state]))
+
+    def step(self, now, vehicle_counts, emergency_cmds=None, rush=False, multiplier=None):
+        """Cập nhật tất cả giao lộ tại thời điểm `now` (giây), trả về mảng mã trạng thái
+
+        multiplier: hệ số theo timing plan; nếu None thì dùng rush_hour_multiplier khi rush.
+        """
+        if multiplier is None:
+            multiplier = np.where(rush, self.rush_hour_multiplier, 1.0)
+        state = self.state
+        elapsed = now - self.state_start
+
+        # Xử lý emergency: chuyển về All Red trước
+        if emergency_cmds is not None:
+            emergency_cmds = np.asarray(emergency_cmds)
+            trigger = (emergency_cmds != EmergencyCommand.NONE.value) & ~self.emergency_active
+            if trigger.any():
+                self.emergency_active |= trigger
+                self.emergency_command[trigger] = emergency_cmds[trigger]
+                self.emergency_start[trigger] = now
+                state[trigger] = self._clearance
+                self.state_start[trigger] = now
+
+        # ML classification (hysteresis)
+        counts = np.asarray(vehicle_counts)
+        self.ml_state = np.where(counts >= self.dense_thresh, 1,
+                                 np.where(counts <= self.thin_thresh, 0, self.ml_state)).astype(np.int8)
+        if self.forecaster is not None:
+            self.forecaster.update(counts, now)
+
+        em = self.emergency_active
+        is_green = self._is_green[state]
+        is_clearance = state == self._clearance
+        duration = np.where(is_green, self.green_duration(multiplier), self.phase_durations())
+
+        # Mọi điều kiện tính trên trạng thái trước khi chuyển (mỗi tick tối đa một bước)
+        em_clear = em & is_clearance & (elapsed >= duration)
+        em_green = em & ~is_clearance & is_green & (elapsed >= self.emergency_green_time)
+        advance = (~em & (elapsed >= duration)) | em_green
+
+        new_state = state.copy()
+        new_state[em_clear] = self._priority[self.emergency_command[em_clear]]
+        new_state[advance] = self._next[state[advance]]
+        self.emergency_active = em & ~em_green
+
+        changed = em_clear | advance
+        self.state_start[changed] = now
+        self.state = new_state
+        return new_state
+
+    def durations(self, now):
+        """Thời gian đã ở pha hiện tại của từng giao lộ"""
+        return now - self.state_start
+
+    def state_names(self):
+        return np.array(self.phases.names, dtype=object)[self.state]
+
+    def light_names(self):
+        """(ns_light, ew_light) dạng chuỗi cho từng giao lộ"""
+        _, ns_names, ew_names = phase_name_arrays(self.phases)
+        return ns_names[self.state], ew_names[self.state]
+
+    def run(self, counts, emergency_cmds=None, dt=0.1, start=None, t0=0.0, record=True):
+        """Chạy T tick cho mảng số xe dạng (T, N); trả về lịch sử trạng thái (T, N) nếu record"""
+        counts = np.asarray(counts)
+        n_ticks = counts.shape[0]
+        start = start if start is not None else datetime.now()
+        steps = np.full(n_ticks, float(dt))
+        if n_ticks:
+            steps[0] = t0
+        t = np.cumsum(steps)
+        if self.timing_plan is not None:
+            plan_multipliers = self.timing_plan.multipliers(start, t, t0)
+        else:
+            rush = rush_hour_flags(start, t, self.rush_hours, t0)
+
+        history = np.empty((n_ticks, self.n), dtype=np.int16) if record else None
+        for k in range(n_ticks):
+            cmds = emergency_cmds[k] if emergency_cmds is not None else None
+            if self.timing_plan is not None:
+                state = self.step(t[k], counts[k], cmds, multiplier=plan_multipliers[k])
+            else:
+                state = self.step(t[k], counts[k], cmds, rush=rush[k])
+            if record:
+                history[k] = state
+        return history
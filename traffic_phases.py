@@ -0,0 +1,170 @@
+"""Bảng pha (phase table) cho máy trạng thái đèn giao thông
+
+Mỗi pha: pha kế tiếp, luật thời gian ('green' -> calculate_green_duration, 'yellow' ->
+yellow_time, 'all_red' -> all_red_time, hoặc số giây cố định) và trạng thái đèn của
+từng hướng. PhaseTable biên dịch danh sách pha thành các list/tuple tra theo chỉ số,
+với đèn dạng tuple / mapping chỉ đọc được tạo sẵn, nên số pha không làm tăng chi phí
+mỗi tick.
+"""
+from collections import namedtuple
+from types import MappingProxyType
+
+from traffic_log import LIGHT_CODES
+
+GREEN_RULE = 'green'
+YELLOW_RULE = 'yellow'
+ALL_RED_RULE = 'all_red'
+FIXED_RULE = 'fixed'
+RULE_CODES = {GREEN_RULE: 0, YELLOW_RULE: 1, ALL_RED_RULE: 2, FIXED_RULE: 3}
+
+LIGHT_VALUES = tuple(LIGHT_CODES)
+
+Phase = namedtuple('Phase', ['key', 'next', 'duration', 'lights'])
+Phase.__doc__ = """Một pha: key (Enum hoặc chuỗi), key pha kế tiếp, luật thời gian, đèn theo hướng"""
+
+
+def _light_map(light):
+    """Mapping chỉ đọc dạng {'red': bool, 'yellow': bool, 'green': bool} như get_light_states"""
+    return MappingProxyType({'red': light == 'Red', 'yellow': light == 'Yellow', 'green': light == 'Green'})
+
+
+class PhaseTable:
+    """Bảng chuyển pha đã biên dịch
+
+    emergency: {mã EmergencyCommand: key pha xanh ưu tiên}; clearance: pha dọn giao lộ
+    (All Red) được dùng ngay khi có emergency.
+    """
+    def __init__(self, phases, approaches=('NS', 'EW'), clearance=None, emergency=None):
+        phases = list(phases)
+        if not phases:
+            raise ValueError("PhaseTable needs at least one phase")
+        self.phases = phases
+        self.approaches = tuple(approaches)
+        self.keys = [p.key for p in phases]
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        if len(self.index) != len(phases):
+            raise ValueError("duplicate phase key")
+        self.names = [getattr(key, 'value', key) for key in self.keys]
+        self.names = [name if isinstance(name, str) else str(name) for name in self.names]
+
+        self.next = []
+        self.rule = []
+        self.fixed = []
+        self.lights = []
+        self.light_maps = []
+        for p in phases:
+            if p.next not in self.index:
+                raise ValueError(f"phase {p.key!r}: unknown next phase {p.next!r}")
+            if len(p.lights) != len(self.approaches):
+                raise ValueError(f"phase {p.key!r}: expected {len(self.approaches)} lights")
+            for light in p.lights:
+                if light not in LIGHT_VALUES:
+                    raise ValueError(f"phase {p.key!r}: invalid light {light!r}")
+            if isinstance(p.duration, str):
+                if p.duration not in RULE_CODES or p.duration == FIXED_RULE:
+                    raise ValueError(f"phase {p.key!r}: invalid duration rule {p.duration!r}")
+                self.rule.append(RULE_CODES[p.duration])
+                self.fixed.append(0.0)
+            else:
+                self.rule.append(RULE_CODES[FIXED_RULE])
+                self.fixed.append(float(p.duration))
+            self.next.append(self.index[p.next])
+            self.lights.append(tuple(p.lights))
+            self.light_maps.append(tuple(_light_map(light) for light in p.lights))
+        self.is_green = [r == RULE_CODES[GREEN_RULE] for r in self.rule]
+        self.next = tuple(self.next)
+        self.rule = tuple(self.rule)
+        self.fixed = tuple(self.fixed)
+        self.lights = tuple(self.lights)
+        self.light_maps = tuple(self.light_maps)
+        self.is_green = tuple(self.is_green)
+        # Các hướng có đèn xanh trong từng pha (để tính thời gian xanh theo nhu cầu của hướng đó)
+        self.green_approaches = tuple(tuple(i for i, light in enumerate(lights) if light == 'Green')
+                                      for lights in self.lights)
+        # Mã đèn cho 2 cột ns_light / ew_light của log (2 hướng đầu tiên)
+        self.log_light_codes = tuple(
+            tuple(LIGHT_CODES[light] for light in (lights + ('Off', 'Off'))[:2]) for lights in self.lights)
+
+        self.clearance = self.index[clearance] if clearance is not None else None
+        self.emergency = {}
+        for cmd, key in (emergency or {}).items():
+            if key not in self.index:
+                raise ValueError(f"emergency priority: unknown phase {key!r}")
+            self.emergency[getattr(cmd, 'value', cmd)] = self.index[key]
+
+    def __len__(self):
+        return len(self.phases)
+
+    def durations(self, yellow_time, all_red_time):
+        """Thời gian của các pha không phải pha xanh (pha xanh trả về None)"""
+        by_rule = {RULE_CODES[YELLOW_RULE]: yellow_time, RULE_CODES[ALL_RED_RULE]: all_red_time}
+        return tuple(None if g else by_rule.get(r, f) for r, f, g in zip(self.rule, self.fixed, self.is_green))
+
+
+def default_phase_table(state_enum):
+    """Bảng pha mặc định trên Enum TrafficState: NS và EW xanh luân phiên
+
+    Mỗi lần đổi hướng đều qua một pha All Red (ALL_RED sau NS, ALL_RED_2 sau EW);
+    ALL_RED cũng là pha dọn giao lộ khi có emergency.
+    """
+    s = state_enum
+    return PhaseTable(
+        [
+            Phase(s.NS_GREEN, s.NS_YELLOW, GREEN_RULE, ('Green', 'Red')),
+            Phase(s.NS_YELLOW, s.ALL_RED, YELLOW_RULE, ('Yellow', 'Red')),
+            Phase(s.EW_GREEN, s.EW_YELLOW, GREEN_RULE, ('Red', 'Green')),
+            Phase(s.EW_YELLOW, s.ALL_RED_2, YELLOW_RULE, ('Red', 'Yellow')),
+            Phase(s.ALL_RED, s.EW_GREEN, ALL_RED_RULE, ('Red', 'Red')),
+            Phase(s.ALL_RED_2, s.NS_GREEN, ALL_RED_RULE, ('Red', 'Red')),
+        ],
+        approaches=('NS', 'EW'),
+        clearance=s.ALL_RED,
+        emergency={1: s.NS_GREEN, 2: s.EW_GREEN},
+    )
+
+
+def legacy_phase_table(state_enum):
+    """Bảng 5 pha cũ (NS/EW Green, Yellow, All Red) trên Enum TrafficState
+
+    Giữ đúng hành vi cũ của _handle_normal_states: sau All Red luôn chuyển sang EW_GREEN,
+    nên NS chỉ được xanh ở pha đầu hoặc khi có emergency. Chỉ dùng để tái tạo log cũ.
+    """
+    s = state_enum
+    return PhaseTable(
+        [
+            Phase(s.NS_GREEN, s.NS_YELLOW, GREEN_RULE, ('Green', 'Red')),
+            Phase(s.NS_YELLOW, s.ALL_RED, YELLOW_RULE, ('Yellow', 'Red')),
+            Phase(s.EW_GREEN, s.EW_YELLOW, GREEN_RULE, ('Red', 'Green')),
+            Phase(s.EW_YELLOW, s.ALL_RED, YELLOW_RULE, ('Red', 'Yellow')),
+            Phase(s.ALL_RED, s.EW_GREEN, ALL_RED_RULE, ('Red', 'Red')),
+        ],
+        approaches=('NS', 'EW'),
+        clearance=s.ALL_RED,
+        emergency={1: s.NS_GREEN, 2: s.EW_GREEN},
+    )
+
+
+def protected_left_pedestrian_table(left_green_time=10, walk_time=12, ped_clear_time=8):
+    """Ví dụ vòng pha đầy đủ: rẽ trái bảo vệ, đi thẳng NS/EW và pha đi bộ riêng"""
+    r, y, g = 'Red', 'Yellow', 'Green'
+    # Hướng: NS, EW, NS rẽ trái, EW rẽ trái, người đi bộ
+    return PhaseTable(
+        [
+            Phase('NS_Left', 'NS_Left_Yellow', left_green_time, (r, r, g, r, r)),
+            Phase('NS_Left_Yellow', 'NS_Green', YELLOW_RULE, (r, r, y, r, r)),
+            Phase('NS_Green', 'NS_Yellow', GREEN_RULE, (g, r, r, r, r)),
+            Phase('NS_Yellow', 'All_Red_1', YELLOW_RULE, (y, r, r, r, r)),
+            Phase('All_Red_1', 'EW_Left', ALL_RED_RULE, (r, r, r, r, r)),
+            Phase('EW_Left', 'EW_Left_Yellow', left_green_time, (r, r, r, g, r)),
+            Phase('EW_Left_Yellow', 'EW_Green', YELLOW_RULE, (r, r, r, y, r)),
+            Phase('EW_Green', 'EW_Yellow', GREEN_RULE, (r, g, r, r, r)),
+            Phase('EW_Yellow', 'All_Red_2', YELLOW_RULE, (r, y, r, r, r)),
+            Phase('All_Red_2', 'Ped_Walk', ALL_RED_RULE, (r, r, r, r, r)),
+            Phase('Ped_Walk', 'Ped_Clear', walk_time, (r, r, r, r, g)),
+            Phase('Ped_Clear', 'All_Red_3', ped_clear_time, (r, r, r, r, y)),
+            Phase('All_Red_3', 'NS_Left', ALL_RED_RULE, (r, r, r, r, r)),
+        ],
+        approaches=('NS', 'EW', 'NS_Left', 'EW_Left', 'Ped'),
+        clearance='All_Red_1',
+        emergency={1: 'NS_Green', 2: 'EW_Green'},
+    )
@@ -0,0 +1,268 @@
+"""Mô phỏng hàng đợi xe theo từng hướng để chấm điểm cấu hình controller
+
+Chuỗi pha do BatchRunner tạo ra (controller nhận số xe đo được), sau đó mỗi hướng
+(phases.approaches) là một hàng đợi đứng (vertical queue):
+  - xe đến: Poisson với cường độ cố định (xe/giờ) hoặc tỉ lệ theo trace vehicle_counts*.csv
+  - xe đi: khi đèn của hướng là Green (và Yellow nếu yellow_discharge) với lưu lượng bão hòa
+    saturation_flow * lanes, trừ thời gian mất lúc khởi động (lost_time) đầu mỗi pha xanh
+Độ dài hàng đợi theo đệ quy Lindley Q[k] = max(0, Q[k-1] + A[k] - S[k]) được tính vector
+hóa bằng cumsum / minimum.accumulate; độ trễ từng xe (FIFO) lấy bằng searchsorted trên
+đường cong xe đến / xe đi cộng dồn. Mô hình là vòng hở: hàng đợi không ảnh hưởng tới số
+xe mà controller nhìn thấy. Xe còn trong hàng đợi khi hết thời gian mô phỏng được tính
+độ trễ tới cuối mô phỏng (và vehicle_hours = tổng hàng đợi * dt), nên cấu hình bỏ đói một
+hướng không được điểm tốt hơn.
+
+Usage:
+  python traffic_queue.py --hours 24 --flow NS=600 --flow EW=400
+  python traffic_queue.py --csv vehicle_counts_calibrated.csv --policy short:base_green_time=20 \
+      --policy long:base_green_time=40,ml_adjustment_factor=0.3
+"""
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from traffic_control import TrafficController
+from traffic_batch import BatchRunner, load_vehicle_series
+from traffic_sweep import apply_params, full_params
+
+SATURATION_FLOW = 1800.0  # xe/giờ/làn
+LOST_TIME = 2.0           # giây mất lúc khởi động mỗi pha xanh
+DETECTOR_WINDOW = 30.0    # giây: số xe controller nhìn thấy = số xe đến trong cửa sổ này
+
+
+def discharge_masks(phases, state, t, yellow_discharge=True, lost_time=LOST_TIME):
+    """Mảng bool (số hướng, T): hướng được xả xe tại tick đó"""
+    lights = np.array(phases.lights, dtype=object)[np.asarray(state, dtype=np.int64)]  # (T, số hướng)
+    t = np.asarray(t, dtype=float)
+    idx = np.arange(len(t))
+    masks = []
+    for a in range(len(phases.approaches)):
+        m = lights[:, a] == 'Green'
+        if yellow_discharge:
+            m |= lights[:, a] == 'Yellow'
+        if lost_time > 0 and len(m):
+            starts = m.copy()
+            starts[1:] &= ~m[:-1]
+            run_start = np.maximum.accumulate(np.where(starts, idx, 0))
+            m &= (t - t[run_start]) >= lost_time
+        masks.append(m)
+    return np.array(masks, dtype=bool).reshape(len(phases.approaches), len(t))
+
+
+def demand_rates(flows, n_ticks, counts=None):
+    """Cường độ xe đến (xe/giây) dạng (số hướng, T)
+
+    flows: xe/giờ trung bình của từng hướng. Nếu có counts thì cường độ tỉ lệ theo
+    counts / mean(counts) (giữ nguyên trung bình).
+    """
+    rates = np.asarray(flows, dtype=float)[:, None] / 3600.0 * np.ones(n_ticks)
+    if counts is not None:
+        counts = np.asarray(counts, dtype=float)
+        mean = counts.mean() if len(counts) else 0.0
+        if mean > 0:
+            rates = rates * (counts / mean)
+    return rates
+
+
+def poisson_arrivals(rates, dt, rng):
+    """Số xe đến mỗi tick (số hướng, T)"""
+    return rng.poisson(np.asarray(rates) * dt).astype(np.int64)
+
+
+def detector_counts(arrivals, dt, window=DETECTOR_WINDOW):
+    """Số xe đến (mọi hướng) trong `window` giây gần nhất, dùng làm đầu vào của controller"""
+    total = np.asarray(arrivals).sum(axis=0)
+    csum = np.concatenate([[0], np.cumsum(total)])
+    w = max(int(round(window / dt)), 1)
+    end = np.arange(1, len(total) + 1)
+    return csum[end] - csum[np.maximum(end - w, 0)]
+
+
+def simulate_queues(arrivals, capacity, q0=None):
+    """Hàng đợi (số hướng, T) sau mỗi tick và số xe đi, theo đệ quy Lindley vector hóa
+
+    capacity: số xe tối đa xả được mỗi tick (0 khi đèn đỏ).
+    Q[k] = C[k] - min(-q0, min_{j<=k} C[j]) với C = cumsum(arrivals - capacity).
+    """
+    arrivals = np.asarray(arrivals, dtype=float)
+    capacity = np.asarray(capacity, dtype=float)
+    q0 = np.zeros(arrivals.shape[0]) if q0 is None else np.asarray(q0, dtype=float)
+    c = np.cumsum(arrivals - capacity, axis=1)
+    floor = np.minimum(np.minimum.accumulate(c, axis=1), -q0[:, None])
+    queue = c - floor
+    prev = np.concatenate([q0[:, None], queue[:, :-1]], axis=1)
+    departures = prev + arrivals - queue
+    return queue, departures
+
+
+def fifo_delays(arrivals, departures, dt, q0=0.0, residual=False):
+    """Độ trễ (giây) của từng xe đã đi qua, theo thứ tự đến (FIFO)
+
+    Xe thứ i đến ở tick đầu tiên cumA >= i và đi ở tick đầu tiên cumD >= i.
+    residual: thêm cả các xe chưa đi qua khi hết mô phỏng, độ trễ tính tới cuối mô phỏng.
+    """
+    cum_a = np.cumsum(arrivals)
+    cum_d = np.cumsum(departures) - q0  # q0 xe có sẵn đi trước, không tính
+    served = int(np.floor(cum_d[-1] + 1e-6)) if len(cum_d) else 0
+    if residual and len(cum_a):
+        served = max(served, int(np.floor(cum_a[-1] + 1e-6)))
+    if served <= 0:
+        return np.zeros(0)
+    vehicles = np.arange(1, served + 1)
+    arrive = np.searchsorted(cum_a, vehicles, side='left')
+    depart = np.searchsorted(cum_d, vehicles - 1e-6, side='left')
+    return (depart - arrive) * dt  # xe chưa đi: depart = len (cuối mô phỏng)
+
+
+class QueueResult:
+    """Hàng đợi và KPI của một lần mô phỏng"""
+    def __init__(self, approaches, dt, arrivals, departures, queue, batch=None):
+        self.approaches = approaches
+        self.dt = dt
+        self.arrivals = arrivals
+        self.departures = departures
+        self.queue = queue
+        self.batch = batch
+
+    def kpis(self):
+        """DataFrame KPI theo hướng, thêm dòng 'all' (độ trễ trung bình theo số xe)
+
+        Độ trễ tính cho mọi xe đã đến; xe còn trong hàng đợi lúc hết mô phỏng tính tới cuối
+        (chặn dưới của độ trễ thật). vehicle_hours: tổng thời gian chờ của mọi xe.
+        """
+        hours = self.queue.shape[1] * self.dt / 3600.0
+        rows = []
+        all_delays = []
+        for a, name in enumerate(self.approaches):
+            delays = fifo_delays(self.arrivals[a], self.departures[a], self.dt, residual=True)
+            all_delays.append(delays)
+            served = int(np.floor(self.departures[a].sum() + 1e-6))
+            rows.append(self._row(name, self.arrivals[a].sum(), served, delays, self.queue[a], hours, self.dt))
+        delays = np.concatenate(all_delays) if all_delays else np.zeros(0)
+        served = sum(row['served'] for row in rows)
+        rows.append(self._row('all', self.arrivals.sum(), served, delays, self.queue.sum(axis=0), hours, self.dt))
+        return pd.DataFrame(rows).set_index('approach')
+
+    @staticmethod
+    def _row(name, arrived, served, delays, queue, hours, dt):
+        return {
+            'approach': name,
+            'arrived': int(arrived),
+            'served': served,
+            'residual_queue': float(queue[-1]) if len(queue) else 0.0,
+            'throughput_vph': served / hours if hours else np.nan,
+            'vehicle_hours': float(queue.sum()) * dt / 3600.0,
+            'mean_delay_s': float(delays.mean()) if len(delays) else np.nan,
+            'p95_delay_s': float(np.percentile(delays, 95)) if len(delays) else np.nan,
+            'max_delay_s': float(delays.max()) if len(delays) else np.nan,
+            'mean_queue': float(queue.mean()) if len(queue) else 0.0,
+            'max_queue': float(queue.max()) if len(queue) else 0.0,
+        }
+
+
+def simulate_policy(controller, arrivals, counts, dt=1.0, start=None, saturation_flow=SATURATION_FLOW,
+                    lanes=1, yellow_discharge=True, lost_time=LOST_TIME):
+    """Chạy controller trên counts bằng BatchRunner rồi mô phỏng hàng đợi với arrivals (số hướng, T)"""
+    batch = BatchRunner(controller=controller, dt=dt, start=start).run(counts)
+    phases = controller.phases
+    masks = discharge_masks(phases, batch.state, batch.t, yellow_discharge, lost_time)
+    lanes = np.broadcast_to(np.asarray(lanes, dtype=float), (len(phases.approaches),))
+    capacity = masks * (saturation_flow * lanes / 3600.0 * dt)[:, None]
+    queue, departures = simulate_queues(arrivals, capacity)
+    return QueueResult(list(phases.approaches), dt, np.asarray(arrivals), departures, queue, batch)
+
+
+def scenario(flows, hours=24.0, dt=1.0, counts=None, seed=0, window=DETECTOR_WINDOW):
+    """(arrivals, counts cho controller) cho một ngày mô phỏng
+
+    Nếu có counts (trace ghi lại) thì lặp lại trace cho đủ độ dài và dùng làm đầu vào
+    controller; nếu không, controller nhận số xe đến trong cửa sổ `window` giây.
+    """
+    n = int(round(hours * 3600 / dt))
+    rng = np.random.default_rng(seed)
+    if counts is not None:
+        counts = np.resize(np.asarray(counts, dtype=np.int64), n)
+    arrivals = poisson_arrivals(demand_rates(flows, n, counts), dt, rng)
+    if counts is None:
+        counts = detector_counts(arrivals, dt, window)
+    return arrivals, counts
+
+
+def compare_policies(policies, flows, hours=24.0, dt=1.0, counts=None, seed=0, start=None, **queue_args):
+    """KPI tổng ('all') của các cấu hình controller trên cùng một kịch bản xe đến
+
+    policies: {tên: dict tham số (như traffic_sweep)}
+    """
+    arrivals, counts = scenario(flows, hours, dt, counts, seed)
+    start = start if start is not None else datetime(2025, 9, 15)
+    rows = {}
+    for name, params in policies.items():
+        controller = TrafficController()
+        apply_params(controller, full_params(params))
+        result = simulate_policy(controller, arrivals, counts, dt=dt, start=start, **queue_args)
+        rows[name] = result.kpis().loc['all']
+    return pd.DataFrame(rows).T
+
+
+def _parse_flows(items, approaches):
+    flows = dict.fromkeys(approaches, 0.0)
+    for item in items:
+        name, value = item.split('=', 1)
+        if name not in flows:
+            raise SystemExit(f"unknown approach {name!r} (expected one of {', '.join(approaches)})")
+        flows[name] = float(value)
+    return [flows[a] for a in approaches]
+
+
+def _parse_policy(item):
+    name, _, spec = item.partition(':')
+    params = {}
+    for pair in filter(None, spec.split(',')):
+        key, value = pair.split('=', 1)
+        params[key] = float(value)
+    return name, params
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue microsimulation to score controller policies')
+    parser.add_argument('--csv', default=None, help='vehicle count trace driving demand (repeated to fill)')
+    parser.add_argument('--hours', type=float, default=24.0)
+    parser.add_argument('--dt', type=float, default=1.0, help='seconds per tick')
+    parser.add_argument('--flow', action='append', default=[], help='mean arrivals per approach, e.g. NS=600')
+    parser.add_argument('--policy', action='append', default=[],
+                        help='name:param=value,... (see traffic_sweep.PARAM_NAMES); "default" is always run')
+    parser.add_argument('--saturation-flow', type=float, default=SATURATION_FLOW, help='veh/h/lane')
+    parser.add_argument('--lanes', type=float, default=1)
+    parser.add_argument('--lost-time', type=float, default=LOST_TIME)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='write the comparison table to this CSV')
+    args = parser.parse_args()
+
+    approaches = TrafficController().phases.approaches
+    flows = _parse_flows(args.flow or ['NS=600', 'EW=400'], approaches)
+    counts = load_vehicle_series(args.csv)[0] if args.csv else None
+    policies = {'default': {}}
+    try:
+        policies.update(_parse_policy(item) for item in args.policy)
+        for params in policies.values():
+            full_params(params)
+    except ValueError as e:
+        parser.error(str(e))
+
+    t_begin = time.perf_counter()
+    table = compare_policies(policies, flows, args.hours, args.dt, counts, args.seed,
+                             saturation_flow=args.saturation_flow, lanes=args.lanes, lost_time=args.lost_time)
+    elapsed = time.perf_counter() - t_begin
+    with pd.option_context('display.width', 160, 'display.max_columns', None):
+        print(table.round(2))
+    print(f"{len(policies)} policies x {args.hours:g}h simulated in {elapsed:.2f}s")
+    if args.out:
+        table.to_csv(args.out)
+        print(f"Results saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
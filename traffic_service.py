@@ -0,0 +1,332 @@
+"""Dịch vụ asyncio chạy TrafficController như một daemon
+
+Controller được tick theo lịch cố định (deadline tuyệt đối, không trôi). Detector gửi
+số xe / lệnh emergency dạng JSON, mỗi dòng một message, qua TCP, UDP hoặc Unix socket:
+
+  {"source": "cam1", "count": 12, "emergency": 0, "sent": 1726200000.123}
+
+Số xe của từng nguồn được giữ bản mới nhất và cộng lại mỗi tick (nguồn quá `stale_after`
+giây không gửi thì bị bỏ; không còn nguồn nào thì số xe là 0). Message có trường sai bị
+bỏ cả, không áp dụng một phần. "sent" (time.time() phía detector, tùy chọn) dùng để đo độ trễ
+end-to-end. Client gửi {"subscribe": true} để nhận trạng thái đèn mỗi khi đổi pha,
+{"stats": true} để nhận thống kê jitter / độ trễ.
+
+Usage:
+  python traffic_service.py --tcp 127.0.0.1:8765 --udp 127.0.0.1:8766 --unix /tmp/traffic.sock
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from traffic_control import EmergencyCommand, TrafficController
+
+
+class LatencyStats:
+    """Thống kê trên `capacity` mẫu gần nhất (giây), báo cáo theo ms"""
+    def __init__(self, capacity=10000):
+        self._values = np.zeros(capacity)
+        self._count = 0
+
+    def add(self, value):
+        self._values[self._count % len(self._values)] = value
+        self._count += 1
+
+    def summary(self):
+        n = min(self._count, len(self._values))
+        if n == 0:
+            return {'count': 0}
+        ms = self._values[:n] * 1e3
+        return {'count': self._count, 'mean_ms': float(ms.mean()), 'p50_ms': float(np.percentile(ms, 50)),
+                'p99_ms': float(np.percentile(ms, 99)), 'max_ms': float(ms.max())}
+
+
+def parse_emergency(value):
+    """EmergencyCommand từ số (0/1/2) hoặc tên ('NS_PRIORITY')"""
+    if isinstance(value, str) and not value.strip().lstrip('-').isdigit():
+        return EmergencyCommand[value.strip().upper()]
+    return EmergencyCommand(int(value))
+
+
+def finite_number(value, name):
+    """float hữu hạn từ trường của message; ValueError nếu không phải số hoặc là NaN/inf"""
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"'{name}' must be a finite number, got {value!r}")
+    return number
+
+
+def detector_message(count, emergency=0, source=None):
+    """Một message (bytes, kết thúc bằng newline) để detector gửi tới service"""
+    msg = {'count': int(count), 'emergency': int(getattr(emergency, 'value', emergency)), 'sent': time.time()}
+    if source is not None:
+        msg['source'] = source
+    return (json.dumps(msg) + '\n').encode()
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, service):
+        self.service = service
+
+    def datagram_received(self, data, addr):
+        for line in data.splitlines():
+            self.service.handle_line(line, default_source=f"udp:{addr[0]}:{addr[1]}")
+
+
+class ControllerService:
+    """Tick controller theo lịch cố định, nhận input từ socket, phát trạng thái đèn"""
+    def __init__(self, controller=None, dt=0.1, stale_after=5.0, report_interval=10.0, max_buffer=1 << 16):
+        self.controller = controller if controller is not None else TrafficController()
+        self.dt = dt
+        self.stale_after = stale_after
+        self.report_interval = report_interval
+        self.max_buffer = max_buffer  # subscriber chậm hơn mức này bị ngắt
+
+        self.sources = {}  # source -> (count, thời điểm nhận theo loop.time())
+        self.vehicle_count = 0
+        self.pending_emergency = EmergencyCommand.NONE
+        self._pending = []  # (thời điểm nhận, sent) của các input chưa được tick xử lý
+        self.subscribers = set()
+        self.ticks = 0
+        self.messages = 0
+        self.bad_messages = 0
+
+        self.jitter = LatencyStats()
+        self.queue_latency = LatencyStats()  # nhận -> tick xử lý
+        self.end_to_end = LatencyStats()     # detector gửi -> tick xử lý
+
+        self._servers = []
+        self._transports = []
+        self._handlers = set()
+        self._stopping = None
+
+    # --- Input -----------------------------------------------------------------
+
+    def handle_message(self, msg, default_source='default', writer=None):
+        """Xử lý một message đã decode; trả về dict trả lời (hoặc None)"""
+        if msg.get('subscribe'):
+            if writer is not None:
+                self.subscribers.add(writer)
+            return self._light_message()
+        if msg.get('stats'):
+            return self.stats()
+        now = asyncio.get_running_loop().time()
+        # Kiểm tra mọi trường trước khi áp dụng: message lỗi không được đổi trạng thái
+        count = msg.get('count', msg.get('vehicle_count'))
+        if count is not None:
+            count = max(0, int(finite_number(count, 'count')))
+        emergency = parse_emergency(msg.get('emergency', 0))
+        sent = msg.get('sent')
+        if sent is not None:
+            sent = finite_number(sent, 'sent')
+        source = msg.get('source', default_source)
+        if not isinstance(source, str):
+            raise TypeError(f"'source' must be a string, got {source!r}")
+        if count is not None:
+            self.sources[source] = (count, now)
+        if emergency != EmergencyCommand.NONE:
+            self.pending_emergency = emergency
+        self._pending.append((now, sent))
+        self.messages += 1
+        return None
+
+    def handle_line(self, line, default_source='default', writer=None):
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            return self.handle_message(json.loads(line), default_source, writer)
+        except (ValueError, KeyError, TypeError, AttributeError, OverflowError) as e:
+            self.bad_messages += 1
+            return {'error': str(e)}
+
+    async def _handle_stream(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        source = f"stream:{peer}" if peer else f"stream:{id(writer)}"
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = self.handle_line(line, source, writer)
+                if reply is not None:
+                    writer.write((json.dumps(reply) + '\n').encode())
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass  # kết thúc kết nối bình thường khi service đóng
+        finally:
+            self._handlers.discard(task)
+            self.subscribers.discard(writer)
+            writer.close()
+
+    # --- Tick -------------------------------------------------------------------
+
+    def _aggregate_count(self, now):
+        fresh = {s: v for s, v in self.sources.items() if now - v[1] <= self.stale_after}
+        self.sources = fresh
+        self.vehicle_count = sum(count for count, _ in fresh.values())
+        return self.vehicle_count
+
+    def tick(self, now):
+        """Một bước điều khiển: cộng số xe, áp dụng emergency, cập nhật controller"""
+        controller = self.controller
+        previous = controller.current_state
+        emergency, self.pending_emergency = self.pending_emergency, EmergencyCommand.NONE
+        controller.update_state(self._aggregate_count(now), emergency)
+        wall = time.time()
+        for received, sent in self._pending:
+            self.queue_latency.add(now - received)
+            if sent is not None:
+                self.end_to_end.add(wall - sent)
+        self._pending.clear()
+        self.ticks += 1
+        if controller.current_state != previous:
+            self.publish(self._light_message())
+
+    def _light_message(self):
+        c = self.controller
+        return {'t': time.time(), 'state': c.phases.names[c._phase],
+                'lights': dict(zip(c.phases.approaches, c.get_light_outputs())),
+                'vehicle_count': self.vehicle_count, 'emergency': c.emergency_active}
+
+    def publish(self, msg):
+        data = (json.dumps(msg) + '\n').encode()
+        for writer in list(self.subscribers):
+            if writer.is_closing() or writer.transport.get_write_buffer_size() > self.max_buffer:
+                self.subscribers.discard(writer)
+                writer.close()
+                continue
+            writer.write(data)
+
+    async def _tick_loop(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        next_report = deadline + self.report_interval if self.report_interval else None
+        while not self._stopping.is_set():
+            now = loop.time()
+            self.jitter.add(now - deadline)
+            self.tick(now)
+            deadline += self.dt
+            if deadline < now:  # bị trễ quá một chu kỳ: bỏ các tick đã lỡ, giữ nhịp
+                deadline += ((now - deadline) // self.dt + 1) * self.dt
+            if next_report is not None and now >= next_report:
+                self.report()
+                next_report += self.report_interval
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+
+    # --- Vòng đời ---------------------------------------------------------------
+
+    async def start_tcp(self, host='127.0.0.1', port=8765):
+        self._servers.append(await asyncio.start_server(self._handle_stream, host, port))
+
+    async def start_unix(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        self._servers.append(await asyncio.start_unix_server(self._handle_stream, path))
+
+    async def start_udp(self, host='127.0.0.1', port=8766):
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _UdpProtocol(self), local_addr=(host, port))
+        self._transports.append(transport)
+
+    async def serve(self, duration=None):
+        """Chạy vòng tick tới khi stop() hoặc hết `duration` giây
+
+        Lỗi trong vòng tick dừng service và được ném lại cho caller.
+        """
+        self._stopping = asyncio.Event()
+        task = asyncio.create_task(self._tick_loop())
+        stopped = asyncio.create_task(self._stopping.wait())
+        try:
+            await asyncio.wait({task, stopped}, timeout=duration, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._stopping.set()
+            stopped.cancel()
+            try:
+                await task
+            finally:
+                await self.close()
+
+    def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def close(self):
+        for writer in list(self.subscribers):
+            writer.close()
+        self.subscribers.clear()
+        for transport in self._transports:
+            transport.close()
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        handlers = list(self._handlers)
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        self._servers.clear()
+        self._transports.clear()
+
+    def stats(self):
+        return {'ticks': self.ticks, 'messages': self.messages, 'bad_messages': self.bad_messages,
+                'sources': len(self.sources), 'subscribers': len(self.subscribers),
+                'tick_jitter': self.jitter.summary(), 'queue_latency': self.queue_latency.summary(),
+                'end_to_end_latency': self.end_to_end.summary()}
+
+    def report(self):
+        s = self.stats()
+        jitter, e2e = s['tick_jitter'], s['end_to_end_latency']
+        line = f"ticks={s['ticks']} msgs={s['messages']} sources={s['sources']} subs={s['subscribers']}"
+        if jitter['count']:
+            line += f" | jitter p50={jitter['p50_ms']:.2f}ms p99={jitter['p99_ms']:.2f}ms max={jitter['max_ms']:.2f}ms"
+        if e2e['count']:
+            line += f" | e2e p50={e2e['p50_ms']:.2f}ms p99={e2e['p99_ms']:.2f}ms"
+        print(line)
+
+
+def _host_port(value):
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+async def _main(args):
+    service = ControllerService(dt=args.dt, stale_after=args.stale_after, report_interval=args.report)
+    if args.tcp:
+        await service.start_tcp(*_host_port(args.tcp))
+    if args.udp:
+        await service.start_udp(*_host_port(args.udp))
+    if args.unix:
+        await service.start_unix(args.unix)
+    try:
+        await service.serve(args.duration)
+    finally:
+        service.report()
+        service.controller.save_log(args.log)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the traffic controller as an asyncio socket service')
+    parser.add_argument('--tcp', default=None, help='host:port for newline-delimited JSON over TCP')
+    parser.add_argument('--udp', default=None, help='host:port for JSON datagrams')
+    parser.add_argument('--unix', default=None, help='Unix socket path')
+    parser.add_argument('--dt', type=float, default=0.1, help='tick period in seconds')
+    parser.add_argument('--stale-after', type=float, default=5.0, help='drop sources silent for this long')
+    parser.add_argument('--report', type=float, default=10.0, help='stats report interval in seconds (0 = off)')
+    parser.add_argument('--duration', type=float, default=None)
+    parser.add_argument('--log', default='smart_traffic_log.csv')
+    args = parser.parse_args()
+    if not (args.tcp or args.udp or args.unix):
+        args.tcp = '127.0.0.1:8765'
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        print("\nService stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""Trạng thái controller qua shared memory cho viewer chạy ở process riêng
+
+StatePublisher ghi mỗi tick một bản ghi (thời gian, pha, đèn, số xe, ML, emergency) vào
+ring buffer trong multiprocessing.shared_memory. Chỉ có một writer, không có lock:
+bản ghi được ghi trước, rồi mới tăng write_count. Viewer (StateReader) chỉ đọc, đối chiếu
+số thứ tự (seq) của từng bản ghi để bỏ các bản ghi đã bị ghi đè; có thể attach / detach
+bất kỳ lúc nào mà không làm chậm vòng điều khiển.
+Header lưu pid của writer: segment cùng tên chỉ được thay thế khi writer cũ đã chết.
+
+Usage:
+  python traffic_shm.py run --name traffic_state      # controller headless, publish state
+  python traffic_shm.py view --name traffic_state     # viewer (mở bao nhiêu cũng được)
+"""
+import argparse
+import json
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from traffic_log import LIGHT_CODES, LIGHT_NAMES
+
+MAGIC = 0x54524146464943  # 'TRAFFIC'
+VERSION = 1
+HEADER_WORDS = 8
+META_BYTES = 4096
+DEFAULT_SHM_NAME = 'traffic_state'
+DEFAULT_SHM_CAPACITY = 4096
+
+# Vị trí trong header (int64)
+_MAGIC, _VERSION, _CAPACITY, _APPROACHES, _WRITE_COUNT, _META_LEN, _WRITER_PID = range(7)
+
+
+def record_dtype(n_approaches):
+    return np.dtype([('seq', '<i8'), ('t', '<f8'), ('vehicle_count', '<i4'), ('phase', '<i2'),
+                     ('ml_state', 'i1'), ('emergency', 'i1'), ('lights', 'i1', (n_approaches,))])
+
+
+def _attach(name):
+    """Attach vào segment có sẵn mà không để resource_tracker xóa nó khi process thoát"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13: tạm tắt việc đăng ký với resource_tracker
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def _pid_alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # process của user khác vẫn đang chạy
+    return True
+
+
+def _remove_stale(name):
+    """Xóa segment cũ nếu writer của nó đã chết; segment đang được dùng thì báo lỗi"""
+    old = _attach(name)
+    try:
+        if old.size >= HEADER_WORDS * 8:
+            header = np.ndarray(HEADER_WORDS, dtype='<i8', buffer=old.buf)
+            magic, pid = int(header[_MAGIC]), int(header[_WRITER_PID])
+            del header
+        else:
+            magic, pid = 0, 0
+        if magic not in (0, MAGIC):
+            raise FileExistsError(f"shared memory '{name}' exists and is not a traffic state buffer")
+        if _pid_alive(pid):
+            raise FileExistsError(f"shared memory '{name}' is in use by a running publisher (pid {pid})")
+    finally:
+        old.close()
+    # magic 0: writer chết khi chưa ghi xong header
+    old.unlink()
+
+
+class StatePublisher:
+    """Writer duy nhất của ring buffer trạng thái (gắn vào TrafficController.publisher)"""
+    def __init__(self, phases, name=DEFAULT_SHM_NAME, capacity=DEFAULT_SHM_CAPACITY):
+        self.phases = phases
+        self.capacity = capacity
+        n = len(phases.approaches)
+        self.dtype = record_dtype(n)
+        meta = json.dumps({'names': phases.names, 'approaches': list(phases.approaches),
+                           'light_names': LIGHT_NAMES}).encode()
+        if len(meta) > META_BYTES:
+            raise ValueError("phase table metadata does not fit in the shared memory header")
+        size = HEADER_WORDS * 8 + META_BYTES + capacity * self.dtype.itemsize
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Segment cũ còn sót (process trước bị kill): thay bằng segment mới
+            _remove_stale(name)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self.shm.name
+        buf = self.shm.buf
+        self._header = np.ndarray(HEADER_WORDS, dtype='<i8', buffer=buf)
+        np.ndarray(META_BYTES, dtype=np.uint8, buffer=buf, offset=HEADER_WORDS * 8)[:len(meta)] = \
+            np.frombuffer(meta, dtype=np.uint8)
+        self._records = np.ndarray(capacity, dtype=self.dtype, buffer=buf, offset=HEADER_WORDS * 8 + META_BYTES)
+        self._header[:] = 0
+        self._header[_CAPACITY] = capacity
+        self._header[_APPROACHES] = n
+        self._header[_META_LEN] = len(meta)
+        self._header[_WRITER_PID] = os.getpid()
+        self._header[_VERSION] = VERSION
+        self._header[_MAGIC] = MAGIC  # ghi cuối: reader chỉ chấp nhận header đã hoàn chỉnh
+        # Mã đèn của mọi hướng cho từng pha, tạo sẵn
+        self._light_codes = np.array([[LIGHT_CODES[light] for light in lights] for lights in phases.lights],
+                                     dtype=np.int8)
+        self._count = 0
+
+    def publish(self, controller, vehicle_count, ml_state):
+        """Ghi một bản ghi; O(1), không chờ reader"""
+        seq = self._count
+        rec = self._records[seq % self.capacity]
+        rec['seq'] = -1  # đánh dấu đang ghi
+        rec['t'] = controller.clock.time()
+        rec['vehicle_count'] = vehicle_count
+        rec['phase'] = controller._phase
+        rec['ml_state'] = ml_state
+        rec['emergency'] = controller.emergency_active
+        rec['lights'] = self._light_codes[controller._phase]
+        rec['seq'] = seq
+        self._count = seq + 1
+        self._header[_WRITE_COUNT] = self._count
+
+    def close(self, unlink=True):
+        self._header = None
+        self._records = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class StateReader:
+    """Reader chỉ đọc; read_new() trả về các bản ghi mới kể từ lần đọc trước"""
+    def __init__(self, name=DEFAULT_SHM_NAME):
+        self.shm = _attach(name)
+        buf = self.shm.buf
+        self._header = np.ndarray(HEADER_WORDS, dtype='<i8', buffer=buf)
+        if self._header[_MAGIC] != MAGIC or self._header[_VERSION] != VERSION:
+            self.shm.close()
+            raise ValueError(f"shared memory '{name}' is not a traffic state buffer")
+        self.capacity = int(self._header[_CAPACITY])
+        self.dtype = record_dtype(int(self._header[_APPROACHES]))
+        meta = bytes(buf[HEADER_WORDS * 8:HEADER_WORDS * 8 + int(self._header[_META_LEN])])
+        self.meta = json.loads(meta)
+        self.names = self.meta['names']
+        self.approaches = self.meta['approaches']
+        self._records = np.ndarray(self.capacity, dtype=self.dtype, buffer=buf,
+                                   offset=HEADER_WORDS * 8 + META_BYTES)
+        self.next_seq = 0
+        self.missed = 0  # số bản ghi bị ghi đè trước khi kịp đọc
+
+    @property
+    def write_count(self):
+        return int(self._header[_WRITE_COUNT])
+
+    def read_new(self, max_records=None):
+        """Copy các bản ghi mới (mảng structured) ra khỏi shared memory"""
+        end = self.write_count
+        start = max(self.next_seq, end - self.capacity)
+        if max_records is not None:
+            start = max(start, end - max_records)
+        self.missed += start - self.next_seq
+        if end <= start:
+            self.next_seq = max(self.next_seq, end)
+            return np.empty(0, dtype=self.dtype)
+        idx = np.arange(start, end) % self.capacity
+        out = self._records[idx]  # fancy indexing: bản copy
+        # Writer có thể đã ghi đè trong lúc copy: chỉ giữ bản ghi có seq đúng và có ô chưa
+        # bị ghi lại tính tới write_count đọc sau khi copy (bản ghi ghi dở vẫn còn seq cũ)
+        seqs = np.arange(start, end)
+        valid = (out['seq'] == seqs) & (seqs > self.write_count - self.capacity)
+        self.next_seq = end
+        if not valid.all():
+            self.missed += int((~valid).sum())
+            out = out[valid]
+        return out
+
+    def close(self):
+        self._header = None
+        self._records = None
+        self.shm.close()
+
+
+def run_viewer(name=DEFAULT_SHM_NAME, window=20.0, interval_ms=100, history=2000):
+    """Viewer matplotlib (blit) đọc trạng thái từ shared memory ở nhịp riêng"""
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FuncAnimation
+    from traffic_control import RingSeries
+
+    reader = StateReader(name)
+    series = RingSeries(history, ('t', 'count', 'ml'))
+    latest = {}
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 8))
+    ax1.set_xlim(0, len(reader.approaches))
+    ax1.set_ylim(-1, 3)
+    ax1.set_title(f"Traffic state ('{name}')")
+    colors = {'Red': 'red', 'Yellow': 'yellow', 'Green': 'green', 'Off': 'gray'}
+    lamps = []
+    for i, approach in enumerate(reader.approaches):
+        lamps.append(plt.Circle((i + 0.5, 1.5), 0.3, color='gray', animated=True))
+        ax1.add_patch(lamps[-1])
+        ax1.text(i + 0.5, 0.8, approach, ha='center')
+    status = ax1.text(len(reader.approaches) / 2, -0.6, '', ha='center', fontsize=10, animated=True)
+    ax2.set_xlim(-window, 1)
+    ax2.set_ylim(0, 35)
+    ax2.set_xlabel('Time (s, relative to now)')
+    ax2.set_ylabel('Count / State')
+    line1, = ax2.plot([], [], 'b-', label='Vehicle Count', animated=True)
+    line2, = ax2.plot([], [], 'r-', label='ML State (Dense/Thin)', linewidth=2, animated=True)
+    ax2.legend()
+    ax2.grid(True)
+    artists = lamps + [status, line1, line2]
+
+    def frame(_):
+        records = reader.read_new(max_records=history)
+        for rec in records:
+            series.append(t=rec['t'], count=rec['vehicle_count'], ml=rec['ml_state'])
+        if len(records):
+            last = records[-1]
+            latest.update(phase=reader.names[last['phase']], lights=last['lights'],
+                          count=int(last['vehicle_count']), ml=int(last['ml_state']),
+                          emergency=bool(last['emergency']))
+        if latest:
+            for lamp, code in zip(lamps, latest['lights']):
+                lamp.set_color(colors[LIGHT_NAMES[code]])
+            status.set_text(f"State: {latest['phase']}\nVehicles: {latest['count']} | "
+                            f"ML: {'DENSE' if latest['ml'] else 'THIN'} | "
+                            f"{'EMERGENCY!' if latest['emergency'] else 'Normal'} | missed={reader.missed}")
+        t = series.view('t')
+        if len(t):
+            counts = series.view('count')
+            line1.set_data(t - t[-1], counts)
+            line2.set_data(t - t[-1], series.view('ml') * 20)
+            top = counts.max() + 5
+            if top > ax2.get_ylim()[1]:
+                ax2.set_ylim(0, top * 1.5)
+                fig.canvas.draw_idle()
+        return artists
+
+    ani = FuncAnimation(fig, frame, interval=interval_ms, blit=True, cache_frame_data=False)  # noqa: F841
+    try:
+        plt.show()
+    finally:
+        reader.close()
+
+
+def run_publisher(name=DEFAULT_SHM_NAME, dt=0.1, duration=None, capacity=DEFAULT_SHM_CAPACITY):
+    """Controller headless nhịp dt (thời gian thực), đọc số xe từ CSV như TrafficSimulator"""
+    from traffic_control import EmergencyCommand, TrafficController, load_vehicle_arrays
+
+    controller = TrafficController()
+    controller.publisher = StatePublisher(controller.phases, name=name, capacity=capacity)
+    data = None
+    for path in ('vehicle_counts_calibrated.csv', 'vehicle_counts.csv'):
+        try:
+            data = load_vehicle_arrays(path)
+        except FileNotFoundError:
+            continue
+        if data.counts is not None and len(data.counts):
+            break
+        data = None
+    print(f"Publishing traffic state to shared memory '{controller.publisher.name}'")
+    deadline = time.monotonic()
+    stop_at = deadline + duration if duration is not None else None
+    i = 0
+    last_emergency = 0
+    try:
+        while stop_at is None or time.monotonic() < stop_at:
+            emergency = EmergencyCommand.NONE
+            if data is not None:
+                k = i % len(data.counts)
+                count = int(data.counts[k])
+                flag = int(data.emergency[k])
+                if flag == 1 and last_emergency == 0 and data.emergency_col is not None:
+                    emergency = EmergencyCommand.NS_PRIORITY
+                last_emergency = flag
+            else:
+                count = int(10 + 8 * np.sin(i * dt * 0.1) + 3 * np.random.random())
+            controller.update_state(count, emergency)
+            i += 1
+            deadline += dt
+            time.sleep(max(0.0, deadline - time.monotonic()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.publisher.close()
+    return controller
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared-memory traffic state publisher / viewer')
+    parser.add_argument('mode', choices=['run', 'view'])
+    parser.add_argument('--name', default=DEFAULT_SHM_NAME)
+    parser.add_argument('--dt', type=float, default=0.1, help='control tick period (run)')
+    parser.add_argument('--duration', type=float, default=None, help='stop after this many seconds (run)')
+    parser.add_argument('--capacity', type=int, default=DEFAULT_SHM_CAPACITY, help='ring buffer records (run)')
+    parser.add_argument('--interval', type=int, default=100, help='redraw interval in ms (view)')
+    args = parser.parse_args()
+    if args.mode == 'run':
+        run_publisher(args.name, dt=args.dt, duration=args.duration, capacity=args.capacity)
+    else:
+        run_viewer(args.name, interval_ms=args.interval)
+
+
+if __name__ == "__main__":
+    main()
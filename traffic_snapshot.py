@@ -0,0 +1,310 @@
+"""Snapshot nhị phân gọn của trạng thái TrafficController để khởi động lại / replay tiếp
+
+Một snapshot (định dạng có version, kèm CRC32) gồm: pha hiện tại và thời gian đã ở pha,
+trạng thái hysteresis, emergency (lệnh, thời gian đã chạy, pre_emergency_state), bộ đếm
+log, vị trí replay (dòng CSV) và tùy chọn trạng thái forecaster, cửa sổ số xe của bộ phân
+loại học được (traffic_density_model), các dòng log cuối cùng trạng thái theo hướng
+(hysteresis và forecaster của từng hướng khi controller nhận approach_counts).
+Thời gian được lưu cả dạng "đã trôi qua" (khôi phục với đồng hồ mới: WallClock sau khi
+restart, hoặc SimulatedClock bắt đầu lại từ 0) lẫn giá trị tuyệt đối của đồng hồ lúc chụp;
+khi tiếp tục trên cùng gốc thời gian (keep_time=True, resume_batch) các mốc thời gian được
+giữ nguyên từng bit nên replay tiếp trùng khớp với replay liền một mạch.
+
+Snapshotter ghi định kỳ theo đồng hồ của controller (ghi file tạm rồi os.replace);
+đường dẫn có thể chứa '{row}' / '{seq}' để giữ nhiều checkpoint và replay tiếp từ
+checkpoint bất kỳ (find_checkpoint + resume_batch).
+
+Usage:
+  snap = Snapshotter('state/controller.snap', interval=10)
+  snap.maybe_save(controller, replay_row=i)          # gọi mỗi tick, gần như không tốn
+  info = load_snapshot(controller, 'state/controller.snap')
+  result = resume_batch(TrafficController(), find_checkpoint('ckpt/{row}.snap', 5000), counts)
+"""
+import glob
+import os
+import re
+import struct
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from traffic_control import DenseThinHysteresis, EmergencyCommand
+from traffic_log import LOG_SCHEMA
+
+MAGIC = b'TRFSNAP\x00'
+VERSION = 3
+
+FLAG_FORECASTER = 1
+FLAG_LOG = 2
+FLAG_WINDOW = 4
+FLAG_APPROACH = 8
+
+# magic, version, flags, số pha, crc bảng pha, seq, clock_time, wall_time, pha, pre_emergency,
+# ml_state, emergency_active, emergency_command, last_emergency_value, thời gian ở pha,
+# thời gian emergency, state_start_time, emergency_start_time, log total_rows,
+# log dropped_rows, dòng replay
+_HEADER = struct.Struct('<8sHHHIqddhhbbbbddddqqq')
+# level, trend, thời gian từ lần cập nhật cuối, last_t (tuyệt đối, NaN nếu chưa có), số ô mùa
+_FORECASTER = struct.Struct('<ddddI')
+_LOG = struct.Struct('<Idq')          # số dòng, origin (epoch giây), origin_us
+_WINDOW = struct.Struct('<I')         # số giá trị trong cửa sổ (theo sau là float64)
+# số hướng, có forecaster theo hướng không (theo sau là state int8 từng hướng, rồi các forecaster)
+_APPROACH = struct.Struct('<HB')
+_CRC = struct.Struct('<I')
+
+SnapshotInfo = namedtuple('SnapshotInfo', ['version', 'seq', 'clock_time', 'wall_time', 'replay_row',
+                                           'last_emergency_value', 'log_rows', 'state_start_time',
+                                           'emergency_start_time'])
+
+
+class SnapshotError(ValueError):
+    """Snapshot hỏng, sai version hoặc không khớp bảng pha của controller"""
+
+
+def phase_table_crc(phases):
+    """CRC32 của tên pha và bảng chuyển pha (để không khôi phục nhầm bảng pha khác)"""
+    text = '|'.join(phases.names) + '#' + ','.join(map(str, phases.next))
+    return zlib.crc32(text.encode())
+
+
+def _pack_forecaster(forecaster, now):
+    seasonal = forecaster.seasonal
+    last_t = forecaster.last_t
+    parts = [_FORECASTER.pack(forecaster.level, forecaster.trend,
+                              now - last_t if last_t is not None else -1.0,
+                              last_t if last_t is not None else float('nan'),
+                              len(seasonal) if seasonal is not None else 0)]
+    if seasonal is not None:
+        parts.append(np.asarray(seasonal, dtype='<f4').tobytes())
+    return parts
+
+
+def _unpack_forecaster(body, offset, forecaster, now, keep_time):
+    """Đọc một khối forecaster tại offset (nạp vào `forecaster` nếu có); trả về offset mới"""
+    level, trend, since, last_t, n_seasonal = _FORECASTER.unpack_from(body, offset)
+    offset += _FORECASTER.size
+    seasonal = np.frombuffer(body, dtype='<f4', count=n_seasonal, offset=offset)
+    offset += seasonal.nbytes
+    if forecaster is not None:
+        forecaster.level = level
+        forecaster.trend = trend
+        if since < 0:
+            forecaster.last_t = None
+        else:
+            forecaster.last_t = last_t if keep_time else now - since
+        if forecaster.seasonal is not None and len(forecaster.seasonal) == n_seasonal:
+            forecaster.seasonal = array('f', seasonal.astype(np.float32).tobytes())
+    return offset
+
+
+def snapshot_bytes(controller, replay_row=None, last_emergency_value=0, log_rows=0, seq=0):
+    """Đóng gói trạng thái controller thành bytes (log_rows: số dòng log cuối kèm theo)"""
+    c = controller
+    phases = c.phases
+    now = c.clock.time()
+    forecaster = getattr(c, 'forecaster', None)
+    log_rows = min(int(log_rows), len(c.log))
+    window = c.hysteresis.history() if hasattr(c.hysteresis, 'history') else None
+    approaches = c.approach_hysteresis
+    approach_forecasters = c.approach_forecasters if approaches is not None else None
+    flags = (FLAG_FORECASTER if forecaster is not None and hasattr(forecaster, 'level') else 0) \
+        | (FLAG_LOG if log_rows else 0) | (FLAG_WINDOW if window is not None else 0) \
+        | (FLAG_APPROACH if approaches is not None else 0)
+    parts = [_HEADER.pack(
+        MAGIC, VERSION, flags, len(phases), phase_table_crc(phases), seq, now, c.clock.now().timestamp(),
+        c._phase, phases.index[c.pre_emergency_state], c.hysteresis.current_state, c.emergency_active,
+        c.emergency_command.value, last_emergency_value, now - c.state_start_time,
+        now - c.emergency_start_time if c.emergency_active else 0.0,
+        c.state_start_time, c.emergency_start_time if c.emergency_active else 0.0,
+        c.log.total_rows, c.log.dropped_rows, -1 if replay_row is None else replay_row)]
+    if flags & FLAG_FORECASTER:
+        parts.extend(_pack_forecaster(forecaster, now))
+    if flags & FLAG_LOG:
+        when, origin_us = c.log.origin
+        parts.append(_LOG.pack(log_rows, when.timestamp(), origin_us))
+        tail = c.log.tail(log_rows)
+        parts.extend(tail[name].astype(np.dtype(dtype).newbyteorder('<'), copy=False).tobytes()
+                     for name, dtype in LOG_SCHEMA)
+    if flags & FLAG_WINDOW:
+        parts.append(_WINDOW.pack(len(window)))
+        parts.append(np.asarray(window, dtype='<f8').tobytes())
+    if flags & FLAG_APPROACH:
+        parts.append(_APPROACH.pack(len(approaches), approach_forecasters is not None))
+        parts.append(np.array([h.current_state for h in approaches], dtype='<i1').tobytes())
+        for f in approach_forecasters or ():
+            parts.extend(_pack_forecaster(f, now))
+    body = b''.join(parts)
+    return body + _CRC.pack(zlib.crc32(body))
+
+
+def restore_bytes(controller, data, keep_time=False):
+    """Khôi phục trạng thái controller từ bytes của snapshot_bytes(); trả về SnapshotInfo
+
+    keep_time: giữ nguyên các mốc thời gian tuyệt đối (đồng hồ của controller cùng gốc với
+    lúc chụp); mặc định tính lại theo thời gian đã trôi qua so với clock.time() hiện tại.
+    """
+    data = memoryview(data)
+    if len(data) < _HEADER.size + _CRC.size:
+        raise SnapshotError("snapshot is truncated")
+    body = data[:-_CRC.size]
+    if _CRC.unpack(data[-_CRC.size:])[0] != zlib.crc32(body):
+        raise SnapshotError("snapshot checksum mismatch")
+    (magic, version, flags, n_phases, crc, seq, clock_time, wall_time, phase, pre_emergency,
+     ml_state, emergency_active, emergency_command, last_emergency_value, state_elapsed,
+     emergency_elapsed, state_start_time, emergency_start_time, total_rows, dropped_rows,
+     replay_row) = _HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise SnapshotError("not a controller snapshot")
+    if version != VERSION:
+        raise SnapshotError(f"unsupported snapshot version {version} (expected {VERSION})")
+    c = controller
+    if n_phases != len(c.phases) or crc != phase_table_crc(c.phases):
+        raise SnapshotError("snapshot was taken with a different phase table")
+
+    now = clock_time if keep_time else c.clock.time()
+    c._phase = phase
+    c.state_start_time = state_start_time if keep_time else now - state_elapsed
+    c.pre_emergency_state = c.phases.keys[pre_emergency]
+    c.hysteresis.current_state = ml_state
+    c.emergency_active = bool(emergency_active)
+    c.emergency_command = EmergencyCommand(emergency_command)
+    if not emergency_active:
+        c.emergency_start_time = 0
+    else:
+        c.emergency_start_time = emergency_start_time if keep_time else now - emergency_elapsed
+
+    offset = _HEADER.size
+    forecaster = getattr(c, 'forecaster', None)
+    if flags & FLAG_FORECASTER:
+        offset = _unpack_forecaster(body, offset, forecaster, now, keep_time)
+
+    log_rows = 0
+    if flags & FLAG_LOG:
+        log_rows, origin, origin_us = _LOG.unpack_from(body, offset)
+        offset += _LOG.size
+        columns = {}
+        for name, dtype in LOG_SCHEMA:
+            col = np.frombuffer(body, dtype=np.dtype(dtype).newbyteorder('<'), count=log_rows, offset=offset)
+            columns[name] = col
+            offset += col.nbytes
+        c.log.load(columns)
+        c.log.set_origin(datetime.fromtimestamp(origin), origin_us)
+    if flags & FLAG_WINDOW:
+        (n_window,) = _WINDOW.unpack_from(body, offset)
+        offset += _WINDOW.size
+        window = np.frombuffer(body, dtype='<f8', count=n_window, offset=offset)
+        if hasattr(c.hysteresis, 'set_history'):
+            c.hysteresis.set_history(window.tolist())
+        offset += window.nbytes
+    # Trạng thái theo hướng; số xe theo hướng của tick cuối không lưu (tick sau truyền lại)
+    c.approach_counts = c.approach_ml = None
+    c.approach_hysteresis = c.approach_forecasters = None
+    if flags & FLAG_APPROACH:
+        n_approaches, has_forecasters = _APPROACH.unpack_from(body, offset)
+        offset += _APPROACH.size
+        if n_approaches != len(c.phases.approaches):
+            raise SnapshotError("snapshot was taken with a different number of approaches")
+        states = np.frombuffer(body, dtype='<i1', count=n_approaches, offset=offset)
+        offset += states.nbytes
+        h = c.hysteresis
+        dense = getattr(h, 'dense_thresh', 15)
+        thin = getattr(h, 'thin_thresh', 8)
+        c.approach_hysteresis = [DenseThinHysteresis(dense, thin) for _ in range(n_approaches)]
+        for h, state in zip(c.approach_hysteresis, states.tolist()):
+            h.current_state = state
+        if has_forecasters:
+            if forecaster is not None:
+                c.approach_forecasters = [forecaster.clone() for _ in range(n_approaches)]
+            for f in c.approach_forecasters or [None] * n_approaches:
+                offset = _unpack_forecaster(body, offset, f, now, keep_time)
+    c.log.total_rows = total_rows
+    c.log.dropped_rows = dropped_rows
+    return SnapshotInfo(version, seq, clock_time, wall_time, None if replay_row < 0 else replay_row,
+                        last_emergency_value, log_rows, state_start_time,
+                        emergency_start_time if emergency_active else None)
+
+
+def save_snapshot(controller, path, **kwargs):
+    """Ghi snapshot ra file (file tạm rồi os.replace, không bao giờ để lại file ghi dở)"""
+    data = snapshot_bytes(controller, **kwargs)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(data)
+
+
+def load_snapshot(controller, path, keep_time=False):
+    with open(path, 'rb') as f:
+        return restore_bytes(controller, f.read(), keep_time)
+
+
+class Snapshotter:
+    """Ghi snapshot định kỳ (theo đồng hồ controller); maybe_save() gọi được ở mỗi tick
+
+    path có thể chứa '{row}' (dòng replay) hoặc '{seq}' (số thứ tự) để giữ mọi checkpoint.
+    """
+    def __init__(self, path, interval=10.0, log_rows=0):
+        self.path = path
+        self.interval = interval
+        self.log_rows = log_rows
+        self.seq = 0
+        self.last_path = None
+        self._next_time = None
+
+    def maybe_save(self, controller, replay_row=None, last_emergency_value=0):
+        now = controller.clock.time()
+        if self._next_time is not None and now < self._next_time:
+            return False
+        self._next_time = now + self.interval
+        self.save(controller, replay_row, last_emergency_value)
+        return True
+
+    def save(self, controller, replay_row=None, last_emergency_value=0):
+        path = self.path.format(row=replay_row if replay_row is not None else 0, seq=self.seq)
+        save_snapshot(controller, path, replay_row=replay_row, last_emergency_value=last_emergency_value,
+                      log_rows=self.log_rows, seq=self.seq)
+        self.seq += 1
+        self.last_path = path
+        return path
+
+
+def find_checkpoint(pattern, row=None):
+    """Checkpoint có dòng replay lớn nhất <= row (mới nhất nếu row là None) theo mẫu chứa '{row}'"""
+    prefix, _, suffix = pattern.partition('{row}')
+    regex = re.compile(re.escape(prefix) + r'(\d+)' + re.escape(suffix) + '$')
+    best = None
+    for path in glob.glob(glob.escape(prefix) + '*' + glob.escape(suffix)):
+        m = regex.match(path)
+        if m and (row is None or int(m.group(1)) <= row) and (best is None or int(m.group(1)) > best[0]):
+            best = (int(m.group(1)), path)
+    return best[1] if best else None
+
+
+def resume_batch(controller, path, counts, emergency=None, dt=0.1, start=None, t0=0.0):
+    """Replay tiếp từ checkpoint: khôi phục controller rồi chạy BatchRunner từ dòng replay_row
+
+    counts / emergency là toàn bộ trace; trả về (BatchResult của phần còn lại, SnapshotInfo).
+    Checkpoint được chụp sau tick của dòng replay_row - 1 (như TrafficSimulator): BatchRunner
+    tiếp tục trên cùng gốc thời gian với lần chạy gốc, tick kế tiếp ở clock_time + dt.
+    start / t0: ngày giờ ứng với thời điểm t0 của đồng hồ lần chạy gốc (như SimulatedClock);
+    mặc định suy từ wall_time của snapshot (chỉ chính xác tới micro giây).
+    """
+    from traffic_batch import BatchRunner
+    info = load_snapshot(controller, path, keep_time=True)
+    row = info.replay_row or 0
+    if start is None:
+        start, t0 = datetime.fromtimestamp(info.wall_time), info.clock_time
+    runner = BatchRunner(controller=controller, dt=dt, start=start)
+    runner.t0 = t0
+    runner.t = info.clock_time + dt
+    runner.state_start = info.state_start_time
+    runner.last_emergency_value = info.last_emergency_value
+    rest = emergency[row:] if emergency is not None else None
+    return runner.run(np.asarray(counts)[row:], rest), info
@@ -0,0 +1,219 @@
+"""Nhiều luồng detector theo hướng, trộn theo thời gian bằng k-way merge (heap)
+
+Mỗi hướng (phases.approaches) có camera riêng ghi luồng kiểu vehicle_counts*.csv với
+tốc độ khung hình riêng. Mỗi luồng là iterator (time_s, count, emergency) đọc dần từng
+khối (CSV theo chunk hoặc trace memmap của traffic_trace); heapq.merge trộn k luồng theo
+thời gian mà chỉ giữ một bản ghi đầu của mỗi luồng trong heap, nên bộ nhớ không phụ
+thuộc độ dài luồng, chỉ tỉ lệ với số camera.
+
+DetectorHub giữ số xe mới nhất của từng hướng; mỗi tick controller nhận tổng số xe (để
+log như trước) cùng approach_counts, và pha xanh được tính theo nhu cầu của chính các
+hướng nó phục vụ. Cờ emergency đổi 0 -> 1 trên luồng của một hướng kích hoạt lệnh ưu
+tiên có pha xanh phục vụ hướng đó; nhiều hướng cùng kích hoạt (hoặc khi đang có emergency)
+thì các lệnh sau được xếp hàng và phát ở các tick kế tiếp.
+
+Usage:
+  python traffic_streams.py --approach NS=vehicle_counts.csv --approach EW=vehicle_counts_calibrated.csv
+"""
+import argparse
+import heapq
+import itertools
+import time
+from collections import deque
+
+from traffic_control import EmergencyCommand, TrafficController
+
+DEFAULT_CHUNKSIZE = 10_000
+
+
+def csv_stream(path, chunksize=DEFAULT_CHUNKSIZE, fps=None):
+    """(time_s, count, emergency) từ CSV số xe, đọc theo khối
+
+    Cần cột time_s; nếu không có thì dùng số thứ tự dòng / fps.
+    """
+    import pandas as pd
+    from traffic_control import compile_vehicle_frame, detect_csv_columns
+    row = 0
+    columns = None
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        if columns is None:
+            columns = detect_csv_columns(chunk)
+            if columns[0] is None and not columns[2]:
+                raise ValueError(f"CSV '{path}' has no vehicle count column")
+        counts, emergency, time_s = compile_vehicle_frame(chunk, *columns)
+        if time_s is None:
+            if fps is None:
+                raise ValueError(f"CSV '{path}' has no time_s column; pass fps")
+            time_s = [(row + i) / fps for i in range(len(counts))]
+        else:
+            time_s = time_s.tolist()
+        yield from zip(time_s, counts.tolist(), emergency.tolist())
+        row += len(counts)
+
+
+def trace_stream(path, block=65_536):
+    """(time_s, count, emergency) từ trace nhị phân (traffic_trace), đọc theo khối của memmap"""
+    from traffic_trace import VehicleTrace
+    trace = VehicleTrace(path)
+    for start in range(0, len(trace), block):
+        rec = trace.records[start:start + block]
+        yield from zip(rec['time_s'].tolist(), rec['count'].tolist(), rec['emergency'].tolist())
+
+
+def open_stream(source, **kwargs):
+    """Luồng từ đường dẫn (.trace hoặc CSV) hoặc trả lại iterable có sẵn"""
+    if not isinstance(source, str):
+        return iter(source)
+    if source.endswith('.trace'):
+        return trace_stream(source)
+    return csv_stream(source, **kwargs)
+
+
+def _tagged(approach, stream):
+    last = None
+    for t, count, emergency in stream:
+        if last is not None and t < last:
+            raise ValueError(f"stream {approach}: time_s goes backwards ({t} after {last})")
+        last = t
+        yield t, approach, count, emergency
+
+
+def merge_streams(streams):
+    """Trộn lười các luồng đã sắp theo thời gian: (time_s, chỉ số hướng, count, emergency)
+
+    Cùng thời điểm thì theo thứ tự hướng. Mỗi luồng chỉ có một bản ghi trong heap.
+    time_s của mỗi luồng phải không giảm (heapq.merge cần đầu vào đã sắp), nếu không
+    ValueError khi đọc tới bản ghi sai thứ tự.
+    """
+    return heapq.merge(*(_tagged(i, s) for i, s in enumerate(streams)))
+
+
+class DetectorHub:
+    """Số xe mới nhất của từng hướng từ các luồng detector đã trộn"""
+    def __init__(self, phases, sources, stale_after=None):
+        """sources: {tên hướng: đường dẫn / iterable}; hướng không có luồng giữ số xe 0"""
+        self.phases = phases
+        self.approaches = list(phases.approaches)
+        unknown = set(sources) - set(self.approaches)
+        if unknown:
+            raise ValueError(f"unknown approach(es): {', '.join(sorted(unknown))}")
+        n = len(self.approaches)
+        streams = [open_stream(sources[name]) if name in sources else iter(()) for name in self.approaches]
+        self._merged = merge_streams(streams)
+        self._pending = None
+        self.stale_after = stale_after
+        self.counts = [0] * n
+        self.last_time = [None] * n
+        self.records = 0
+        self.exhausted = False
+        self._flags = [0] * n
+        self._queued = deque()  # lệnh emergency chờ phát ở tick sau
+        # Lệnh ưu tiên cho từng hướng: lệnh có pha xanh phục vụ hướng đó
+        self.priority = [EmergencyCommand.NONE] * n
+        for cmd, phase in sorted(phases.emergency.items(), reverse=True):
+            for a in phases.green_approaches[phase]:
+                self.priority[a] = EmergencyCommand(cmd)
+
+    def advance(self, t, ready=True):
+        """Đọc mọi bản ghi có time_s <= t; trả về lệnh emergency cần phát ở tick này (hoặc NONE)
+
+        Mỗi tick phát tối đa một lệnh (lệnh đang chờ trước, rồi tới cạnh lên mới); các cạnh
+        lên khác được xếp hàng. ready=False (controller đang xử lý emergency): chỉ xếp hàng.
+        """
+        queued = self._queued
+        cmd = queued.popleft() if ready and queued else EmergencyCommand.NONE
+        rec = self._pending
+        self._pending = None
+        while True:
+            if rec is None:
+                rec = next(self._merged, None)
+                if rec is None:
+                    self.exhausted = True
+                    break
+            if rec[0] > t:
+                self._pending = rec
+                break
+            rec_t, a, count, flag = rec
+            self.counts[a] = count
+            self.last_time[a] = rec_t
+            if flag == 1 and self._flags[a] == 0:
+                new = self.priority[a]
+                if new == EmergencyCommand.NONE:
+                    pass  # không có pha xanh ưu tiên cho hướng này
+                elif ready and cmd == EmergencyCommand.NONE:
+                    cmd = new
+                elif new != cmd and new not in queued:
+                    queued.append(new)
+            self._flags[a] = flag
+            self.records += 1
+            rec = None
+        return cmd
+
+    def next_time(self):
+        """time_s của bản ghi kế tiếp (None nếu hết luồng)"""
+        if self._pending is None and not self.exhausted:
+            self._pending = next(self._merged, None)
+            self.exhausted = self._pending is None
+        return self._pending[0] if self._pending is not None else None
+
+    def current_counts(self, t=None):
+        """Số xe mới nhất theo hướng; hướng quá stale_after giây không cập nhật tính là 0"""
+        if self.stale_after is None or t is None:
+            return list(self.counts)
+        return [c if last is not None and t - last <= self.stale_after else 0
+                for c, last in zip(self.counts, self.last_time)]
+
+    def run(self, controller, dt=0.1, max_ticks=None):
+        """Chạy controller theo lưới thời gian dt của luồng cho tới khi hết dữ liệu; trả về số tick
+
+        Dùng với SimulatedClock: đồng hồ được đặt theo time_s của luồng.
+        """
+        t = self.next_time()
+        if t is None:
+            return 0
+        clock = controller.clock
+        origin = clock.time() - t  # time_s -> thời gian của đồng hồ controller
+        ticks = 0
+        for ticks in itertools.count(1):
+            cmd = self.advance(t, ready=not controller.emergency_active)
+            counts = self.current_counts(t)
+            if hasattr(clock, 'set'):
+                clock.set(origin + t)
+            controller.update_state(sum(counts), cmd, counts)
+            if (self.exhausted and self._pending is None) or (max_ticks is not None and ticks >= max_ticks):
+                break
+            t += dt
+        return ticks
+
+
+def _parse_sources(items):
+    sources = {}
+    for item in items:
+        name, path = item.split('=', 1)
+        sources[name] = path
+    return sources
+
+
+def main():
+    from traffic_clock import SimulatedClock
+    parser = argparse.ArgumentParser(description='Merge per-approach detector streams into one controller')
+    parser.add_argument('--approach', action='append', required=True, help='NAME=path (CSV or .trace)')
+    parser.add_argument('--dt', type=float, default=0.1, help='controller tick in stream seconds')
+    parser.add_argument('--stale-after', type=float, default=None, help='treat silent cameras as 0 after N s')
+    parser.add_argument('--log', default=None, help='save the controller log to this CSV')
+    args = parser.parse_args()
+
+    controller = TrafficController(clock=SimulatedClock())
+    hub = DetectorHub(controller.phases, _parse_sources(args.approach), stale_after=args.stale_after)
+    t_begin = time.perf_counter()
+    ticks = hub.run(controller, dt=args.dt)
+    elapsed = time.perf_counter() - t_begin
+    print(f"Merged {hub.records} records from {len(args.approach)} stream(s) into {ticks} ticks "
+          f"in {elapsed:.3f}s")
+    print("Latest counts: " + ', '.join(f"{a}={c}" for a, c in zip(hub.approaches, hub.counts)))
+    if args.log:
+        controller.save_log(args.log)
+
+
+if __name__ == "__main__":
+    main()
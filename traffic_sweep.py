@@ -0,0 +1,280 @@
+"""Quét tham số controller song song trên nhiều tiến trình
+
+Mỗi cấu hình (base_green_time, yellow_time, all_red_time, ml_adjustment_factor,
+rush_hour_multiplier, dense_thresh, thin_thresh) được chạy lại trên các trace số xe
+đã ghi bằng BatchRunner; KPI của từng cấu hình được ghi dần vào một bảng CSV nên có thể
+dừng giữa chừng rồi chạy tiếp (resume).
+
+Usage:
+  python traffic_sweep.py --grid base_green_time=20,30,40 --grid dense_thresh=12,15,18
+  python traffic_sweep.py --lhs 500 --range base_green_time=15:45 --range dense_thresh=10:20
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from traffic_control import TrafficController
+from traffic_batch import BatchRunner, load_vehicle_series
+from traffic_phases import RULE_CODES, YELLOW_RULE, ALL_RED_RULE
+
+PARAM_NAMES = ['base_green_time', 'yellow_time', 'all_red_time', 'ml_adjustment_factor',
+               'rush_hour_multiplier', 'dense_thresh', 'thin_thresh']
+INT_PARAMS = {'base_green_time', 'yellow_time', 'all_red_time', 'dense_thresh', 'thin_thresh'}
+HYSTERESIS_PARAMS = {'dense_thresh', 'thin_thresh'}
+
+
+def apply_params(controller, params):
+    """Gán tham số cho controller (ngưỡng dense/thin thuộc về hysteresis)"""
+    for name, value in params.items():
+        if name in HYSTERESIS_PARAMS:
+            setattr(controller.hysteresis, name, value)
+        elif name in PARAM_NAMES:
+            setattr(controller, name, value)
+        else:
+            raise ValueError(f"Unknown parameter '{name}'")
+    return controller
+
+
+def check_param_names(names):
+    """ValueError nếu có tên không thuộc PARAM_NAMES (vd. gõ sai trong --grid / --policy)"""
+    unknown = [name for name in names if name not in PARAM_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown parameter(s) {', '.join(map(repr, unknown))} "
+                         f"(expected one of {', '.join(PARAM_NAMES)})")
+
+
+def default_params():
+    """Giá trị mặc định của các tham số quét, lấy từ TrafficController()"""
+    c = TrafficController()
+    return {name: getattr(c.hysteresis if name in HYSTERESIS_PARAMS else c, name) for name in PARAM_NAMES}
+
+
+def full_params(params):
+    """Bổ sung giá trị mặc định cho các tham số không được quét
+
+    ValueError nếu dense_thresh <= thin_thresh (hysteresis không còn vùng giữa 2 ngưỡng).
+    """
+    check_param_names(params)
+    merged = default_params()
+    merged.update(params)
+    full = {name: _cast(name, merged[name]) for name in PARAM_NAMES}
+    if full['dense_thresh'] <= full['thin_thresh']:
+        raise ValueError(f"dense_thresh ({full['dense_thresh']:g}) must be greater than "
+                         f"thin_thresh ({full['thin_thresh']:g})")
+    return full
+
+
+def config_key(params):
+    """Khóa ổn định cho một cấu hình (dùng để resume)"""
+    text = json.dumps({k: params[k] for k in sorted(params)}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def _cast(name, value):
+    return int(round(value)) if name in INT_PARAMS else float(value)
+
+
+def grid_configs(grid):
+    """Tích Descartes của {tên: [giá trị, ...]}"""
+    check_param_names(grid)
+    names = list(grid)
+    return [dict(zip(names, (_cast(n, v) for n, v in zip(names, values))))
+            for values in itertools.product(*(grid[n] for n in names))]
+
+
+def random_configs(ranges, n, seed=0):
+    """Lấy mẫu ngẫu nhiên đều trong {tên: (min, max)}"""
+    check_param_names(ranges)
+    rng = np.random.default_rng(seed)
+    samples = {name: rng.uniform(lo, hi, n) for name, (lo, hi) in ranges.items()}
+    return [{name: _cast(name, samples[name][i]) for name in ranges} for i in range(n)]
+
+
+def latin_hypercube_configs(ranges, n, seed=0):
+    """Latin hypercube: mỗi tham số chia n khoảng đều, mỗi khoảng lấy đúng một mẫu"""
+    check_param_names(ranges)
+    rng = np.random.default_rng(seed)
+    samples = {}
+    for name, (lo, hi) in ranges.items():
+        u = (rng.permutation(n) + rng.random(n)) / n
+        samples[name] = lo + u * (hi - lo)
+    return [{name: _cast(name, samples[name][i]) for name in ranges} for i in range(n)]
+
+
+def compute_kpis(result):
+    """KPI cơ bản từ một BatchResult"""
+    state = result.state.astype(np.int64)
+    n = len(state)
+    if n == 0:
+        return {'ticks': 0}
+    dt = float(np.median(np.diff(result.t))) if n > 1 else 0.0
+    phases = result.phases
+    rule = np.array(phases.rule)[state]
+    is_green = np.array(phases.is_green)
+    lights = np.array([(lights + ('Off', 'Off'))[:2] for lights in phases.lights], dtype=object)
+    # Pha xanh của hướng thứ nhất (NS) / thứ hai (EW)
+    ns_green = is_green & (lights[:, 0] == 'Green')
+    ew_green = is_green & (lights[:, 1] == 'Green')
+
+    changes = np.flatnonzero(state[1:] != state[:-1]) + 1
+    # Chu kỳ: tính từ mỗi lần bắt đầu pha xanh đầu tiên của hướng NS
+    cycle_phase = int(np.argmax(ns_green)) if ns_green.any() else 0
+    ns_starts = changes[state[changes] == cycle_phase]
+    cycle_lengths = np.diff(result.t[ns_starts]) if len(ns_starts) > 1 else np.array([])
+    # Độ trễ emergency: từ tick kích hoạt tới tick đầu tiên pha xanh ưu tiên
+    triggers = np.flatnonzero(result.emergency)
+    green = is_green[state]
+    latencies = []
+    for i in triggers:
+        j = i + np.argmax(green[i:]) if green[i:].any() else None
+        if j is not None:
+            latencies.append(result.t[j] - result.t[i])
+    return {
+        'ticks': n,
+        'sim_seconds': n * dt,
+        'phase_changes': len(changes),
+        'cycles': max(len(ns_starts) - 1, 0),
+        'mean_cycle_s': float(cycle_lengths.mean()) if len(cycle_lengths) else np.nan,
+        'ns_green_frac': float(np.mean(ns_green[state])),
+        'ew_green_frac': float(np.mean(ew_green[state])),
+        'yellow_frac': float(np.mean(rule == RULE_CODES[YELLOW_RULE])),
+        'all_red_frac': float(np.mean(rule == RULE_CODES[ALL_RED_RULE])),
+        'dense_frac': float(np.mean(result.ml_state)),
+        'mean_count_on_green': float(result.vehicle_count[green].mean()) if green.any() else np.nan,
+        'emergencies': len(triggers),
+        'mean_emergency_latency_s': float(np.mean(latencies)) if latencies else np.nan,
+    }
+
+
+# Trace được nạp một lần cho mỗi tiến trình worker
+_TRACES = []
+_START = None
+
+
+def _init_worker(trace_paths, start):
+    global _TRACES, _START
+    _TRACES = []
+    for path in trace_paths:
+        counts, emergency, time_s = load_vehicle_series(path)
+        dt = float(np.median(np.diff(time_s))) if time_s is not None and len(time_s) > 1 else 0.1
+        _TRACES.append((path, counts, emergency, dt))
+    _START = start
+
+
+def evaluate_config(params):
+    """Chạy một cấu hình trên tất cả trace, trả về KPI trung bình (trọng số theo số tick)"""
+    per_trace = []
+    for _, counts, emergency, dt in _TRACES:
+        controller = apply_params(TrafficController(), params)
+        result = BatchRunner(controller=controller, dt=dt, start=_START).run(counts, emergency)
+        per_trace.append(compute_kpis(result))
+    kpis = pd.DataFrame(per_trace)
+    weights = kpis['ticks'].to_numpy(dtype=float)
+    row = {'config_key': config_key(params), **params}
+    for col in kpis.columns:
+        if col in ('ticks', 'sim_seconds', 'phase_changes', 'cycles', 'emergencies'):
+            row[col] = kpis[col].sum()
+        else:
+            values = kpis[col].to_numpy(dtype=float)
+            mask = ~np.isnan(values)
+            row[col] = float(np.average(values[mask], weights=weights[mask])) if mask.any() and weights[mask].sum() else np.nan
+    return row
+
+
+def completed_keys(out_csv):
+    """Các cấu hình đã có trong file kết quả (để resume)"""
+    if not os.path.exists(out_csv) or os.path.getsize(out_csv) == 0:
+        return set()
+    # Đọc dạng chuỗi: khóa hex toàn chữ số (hoặc dạng '1e5...') không được thành số
+    return set(pd.read_csv(out_csv, usecols=['config_key'], dtype={'config_key': str})['config_key'])
+
+
+def run_sweep(configs, trace_paths, out_csv='sweep_results.csv', workers=None, start=None, chunk=64):
+    """Chạy tất cả cấu hình chưa có trong out_csv bằng process pool, ghi kết quả dần dần"""
+    start = start if start is not None else datetime(2025, 1, 1, 8, 0)
+    done = completed_keys(out_csv)
+    pending = {}
+    for params in configs:
+        params = full_params(params)
+        key = config_key(params)
+        if key not in done:
+            pending.setdefault(key, params)
+    pending = list(pending.values())
+    print(f"{len(configs)} configs, {len(done)} already done, {len(pending)} to run")
+    if not pending:
+        return pd.read_csv(out_csv, dtype={'config_key': str})
+
+    write_header = not os.path.exists(out_csv) or os.path.getsize(out_csv) == 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(list(trace_paths), start)) as pool, \
+            open(out_csv, 'a', newline='') as f:
+        for i in range(0, len(pending), chunk):
+            futures = [pool.submit(evaluate_config, p) for p in pending[i:i + chunk]]
+            rows = [fut.result() for fut in as_completed(futures)]
+            pd.DataFrame(rows).to_csv(f, header=write_header, index=False)
+            f.flush()
+            write_header = False
+            print(f"  {min(i + chunk, len(pending))}/{len(pending)} configs")
+    return pd.read_csv(out_csv, dtype={'config_key': str})
+
+
+def _parse_grid(items):
+    grid = {}
+    for item in items:
+        name, values = item.split('=', 1)
+        grid[name] = [float(v) for v in values.split(',')]
+    return grid
+
+
+def _parse_ranges(items):
+    ranges = {}
+    for item in items:
+        name, values = item.split('=', 1)
+        lo, hi = values.split(':')
+        ranges[name] = (float(lo), float(hi))
+    return ranges
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel controller parameter sweep')
+    parser.add_argument('--traces', nargs='+', default=['vehicle_counts_calibrated.csv', 'vehicle_counts.csv'])
+    parser.add_argument('--grid', action='append', default=[], help='name=v1,v2,...')
+    parser.add_argument('--range', action='append', default=[], help='name=min:max (for --random/--lhs)')
+    parser.add_argument('--random', type=int, default=0, help='number of uniform random samples')
+    parser.add_argument('--lhs', type=int, default=0, help='number of Latin hypercube samples')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', default=None, help='simulated start time, e.g. "2025-09-13 07:30:00"')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default='sweep_results.csv')
+    args = parser.parse_args()
+
+    configs = []
+    try:
+        if args.grid:
+            configs += grid_configs(_parse_grid(args.grid))
+        ranges = _parse_ranges(args.range)
+        if args.random:
+            configs += random_configs(ranges, args.random, args.seed)
+        if args.lhs:
+            configs += latin_hypercube_configs(ranges, args.lhs, args.seed)
+        for params in configs:
+            full_params(params)
+    except ValueError as e:
+        parser.error(str(e))
+    if not configs:
+        parser.error('nothing to run: give --grid, or --range with --random/--lhs')
+
+    start = datetime.fromisoformat(args.start) if args.start else None
+    results = run_sweep(configs, args.traces, args.out, workers=args.workers, start=start)
+    print(f"Results saved to {args.out} ({len(results)} configs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Bảng kế hoạch thời gian theo giờ trong tuần (timing plan)
+
+Thay cho rush_hours cố định: nhu cầu (vehicle_count trung bình) được thống kê theo
+từng ô 15 phút của từng ngày trong tuần từ log lịch sử (vd. smart_traffic_log.csv),
+rồi đổi thành hệ số nhân thời gian xanh = nhu cầu của ô / nhu cầu trung bình.
+Tra hệ số cho một thời điểm là một phép lấy phần tử mảng (O(1)).
+
+Usage:
+  plan = TimingPlan.from_logs(['smart_traffic_log.csv'])
+  controller.timing_plan = plan
+  plan.ingest_log('smart_traffic_log.csv')  # đọc tiếp phần mới được ghi thêm
+"""
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DAYS = 7
+
+
+class _FileSlice(io.RawIOBase):
+    """Đọc file từ vị trí hiện tại tới byte `end` (read_csv không vượt qua dòng ghi dở)"""
+    def __init__(self, f, end):
+        self._f = f
+        self._end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._end - self._f.tell())
+        if n <= 0:
+            return 0
+        data = self._f.read(n)
+        b[:len(data)] = data
+        return len(data)
+
+
+def last_line_end(f, start, size, block=1 << 16):
+    """Vị trí ngay sau newline cuối cùng trong [start, size), đọc ngược từng khối từ cuối file"""
+    pos = size
+    while pos > start:
+        n = min(block, pos - start)
+        f.seek(pos - n)
+        i = f.read(n).rfind(b'\n')
+        if i >= 0:
+            return pos - n + i + 1
+        pos -= n
+    return start
+
+
+class TimingPlan:
+    """Hệ số nhân thời gian xanh theo (thứ trong tuần, ô 15 phút)"""
+    def __init__(self, min_multiplier=0.8, max_multiplier=1.5, min_samples=1):
+        self.min_multiplier = min_multiplier
+        self.max_multiplier = max_multiplier
+        self.min_samples = min_samples
+        # Thống kê cộng dồn để cập nhật tăng dần
+        self.sums = np.zeros((DAYS, SLOTS_PER_DAY))
+        self.samples = np.zeros((DAYS, SLOTS_PER_DAY), dtype=np.int64)
+        self.table = np.ones((DAYS, SLOTS_PER_DAY))
+        self._flat = self.table.reshape(-1)
+        # Vị trí đã đọc tới (byte) của từng file log
+        self._offsets = {}
+
+    @classmethod
+    def from_rush_hours(cls, rush_hours, multiplier):
+        """Bảng tương đương is_rush_hour(): hệ số `multiplier` trong các khung giờ cao điểm"""
+        plan = cls(min_multiplier=1.0, max_multiplier=multiplier)
+        hours = np.arange(SLOTS_PER_DAY) * SLOT_MINUTES // 60
+        rush = np.zeros(SLOTS_PER_DAY, dtype=bool)
+        for start, end in rush_hours:
+            rush |= (hours >= start) & (hours < end)
+        plan.table[:] = np.where(rush, multiplier, 1.0)
+        return plan
+
+    @classmethod
+    def from_logs(cls, paths, **kwargs):
+        plan = cls(**kwargs)
+        for path in paths:
+            plan.ingest_log(path)
+        return plan
+
+    # --- Tra cứu ---------------------------------------------------------------
+
+    @staticmethod
+    def slot(when):
+        """Chỉ số ô (0..671) của một datetime"""
+        return when.weekday() * SLOTS_PER_DAY + (when.hour * 60 + when.minute) // SLOT_MINUTES
+
+    def multiplier_at(self, when):
+        """Hệ số nhân thời gian xanh tại thời điểm `when` (datetime)"""
+        return self._flat[self.slot(when)]
+
+    def slots_for(self, timestamps):
+        """Chỉ số ô cho mảng datetime64 (vector hóa)"""
+        ts = np.asarray(timestamps, dtype='datetime64[us]')
+        days = ts.astype('datetime64[D]')
+        minutes = (ts - days).astype('timedelta64[m]').astype(np.int64)
+        # 1970-01-01 là thứ Năm (weekday() == 3)
+        weekday = (days.astype(np.int64) + 3) % DAYS
+        return weekday * SLOTS_PER_DAY + minutes // SLOT_MINUTES
+
+    def multipliers_for(self, timestamps):
+        return self._flat[self.slots_for(timestamps)]
+
+    def multipliers(self, start, t, t0=0.0):
+        """Hệ số cho các thời điểm t (giây) của đồng hồ mô phỏng bắt đầu từ `start`"""
+        offsets = np.round((np.asarray(t, dtype=float) - t0) * 1e6).astype('timedelta64[us]')
+        return self.multipliers_for(np.datetime64(start, 'us') + offsets)
+
+    # --- Cập nhật từ log -------------------------------------------------------
+
+    def update(self, timestamps, vehicle_counts):
+        """Cộng dồn một lô (timestamp, vehicle_count) rồi tính lại bảng
+
+        Dòng có timestamp rỗng/sai (NaT) hoặc số xe không đọc được (NaN) bị bỏ qua.
+        """
+        ts = np.asarray(timestamps, dtype='datetime64[us]')
+        counts = np.asarray(vehicle_counts, dtype=float)
+        valid = ~np.isnat(ts) & ~np.isnan(counts)
+        slots = self.slots_for(ts[valid])
+        np.add.at(self.sums.reshape(-1), slots, counts[valid])
+        np.add.at(self.samples.reshape(-1), slots, 1)
+        self.rebuild()
+
+    def rebuild(self):
+        """Tính lại hệ số từ thống kê cộng dồn (672 ô, rất rẻ)"""
+        total = self.samples.sum()
+        if total == 0:
+            self.table[:] = 1.0
+            return
+        overall = self.sums.sum() / total
+        enough = self.samples >= self.min_samples
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.where(enough, self.sums / np.maximum(self.samples, 1) / overall, 1.0)
+        if overall <= 0:
+            ratio = np.ones_like(ratio)
+        self.table[:] = np.clip(ratio, self.min_multiplier, self.max_multiplier)
+
+    def ingest_log(self, path, chunksize=1_000_000):
+        """Đọc phần mới của file log (timestamp, vehicle_count) kể từ lần đọc trước
+
+        Chỉ xử lý tới dòng hoàn chỉnh cuối cùng; nếu file bị thay thế (nhỏ đi) thì đọc lại từ đầu.
+        File được đọc thẳng theo từng chunk (bộ nhớ giới hạn bởi chunksize, không phụ thuộc
+        độ dài phần mới). Trả về số dòng mới đã đọc.
+        """
+        header, offset = self._offsets.get(path, (None, 0))
+        size = os.path.getsize(path)
+        if size < offset:
+            header, offset = None, 0
+        with open(path, 'rb') as f:
+            if header is None:
+                header = f.readline().decode().strip().split(',')
+                offset = f.tell()
+            end = last_line_end(f, offset, size)
+            if end <= offset:
+                self._offsets[path] = (header, offset)
+                return 0
+            f.seek(offset)
+            rows = 0
+            reader = pd.read_csv(io.BufferedReader(_FileSlice(f, end)), names=header, header=None,
+                                 usecols=['timestamp', 'vehicle_count'], chunksize=chunksize)
+            for chunk in reader:
+                self.update(pd.to_datetime(chunk['timestamp'], errors='coerce').to_numpy(),
+                            pd.to_numeric(chunk['vehicle_count'], errors='coerce').to_numpy())
+                rows += len(chunk)
+        self._offsets[path] = (header, end)
+        return rows
+
+    # --- Lưu / nạp -------------------------------------------------------------
+
+    def save(self, path):
+        np.savez(path, sums=self.sums, samples=self.samples, table=self.table,
+                 limits=np.array([self.min_multiplier, self.max_multiplier, self.min_samples]))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        lo, hi, min_samples = data['limits']
+        plan = cls(min_multiplier=float(lo), max_multiplier=float(hi), min_samples=int(min_samples))
+        plan.sums[:] = data['sums']
+        plan.samples[:] = data['samples']
+        plan.table[:] = data['table']
+        return plan
@@ -0,0 +1,214 @@
+"""Trace số xe dạng nhị phân cố định độ rộng, mở bằng numpy.memmap
+
+CSV từ detector được đọc (theo khối) và dò cột một lần, rồi ghi thành file .trace:
+  header 4096 byte: magic, version, số dòng, số cạnh lên emergency, kích thước bản ghi,
+                    JSON schema (cột đã dò, các cột theo loại xe, nguồn CSV)
+  bản ghi:          time_s (f8), count (i4, tổng đã tính sẵn), emergency (i1, 0/1/2),
+                    số xe theo từng loại (i4 mỗi cột)
+  cạnh lên:         chỉ số các dòng emergency đổi 0 -> 1 (i8), tính sẵn khi chuyển đổi
+Mở trace chỉ đọc header và map file: không parse lại, file nhiều GB mở tức thì.
+Tìm dòng theo time_s là tìm kiếm nhị phân (chỉ chạm ~log2(N) trang của file).
+
+open_trace(csv) dùng cache `<csv>.trace` nếu nó mới hơn CSV (và cùng kích thước nguồn),
+nếu không thì chuyển đổi lại.
+
+Usage:
+  python traffic_trace.py convert vehicle_counts_calibrated.csv
+  python traffic_trace.py info vehicle_counts_calibrated.csv.trace
+  python traffic_trace.py seek vehicle_counts_calibrated.csv.trace 12.5
+"""
+import argparse
+import bisect
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'TRFTRACE'
+VERSION = 1
+HEADER_BYTES = 4096
+TRACE_SUFFIX = '.trace'
+DEFAULT_CHUNKSIZE = 1_000_000
+
+# magic, version, số dòng, số cạnh lên, kích thước bản ghi, độ dài JSON
+_HEADER = struct.Struct('<8sIQQII')
+
+
+def record_dtype(class_columns):
+    fields = [('time_s', '<f8'), ('count', '<i4'), ('emergency', 'i1')]
+    fields += [(f'class:{name}', '<i4') for name in class_columns]
+    return np.dtype(fields)
+
+
+def trace_path_for(csv_path):
+    return csv_path + TRACE_SUFFIX
+
+
+def time_index(time_s, t):
+    """Dòng đầu tiên có time_s >= t (tìm kiếm nhị phân, không copy mảng memmap)"""
+    return bisect.bisect_left(time_s, t)
+
+
+def convert(csv_path, trace_path=None, chunksize=DEFAULT_CHUNKSIZE, sample_rows=1000):
+    """Chuyển CSV số xe thành file trace (ghi file tạm rồi os.replace); trả về đường dẫn trace"""
+    import pandas as pd
+    from traffic_control import (compile_vehicle_frame, detect_csv_columns, emergency_rising_edges,
+                                 parse_emergency_flags)
+    trace_path = trace_path or trace_path_for(csv_path)
+    stat = os.stat(csv_path)
+    sample = pd.read_csv(csv_path, nrows=sample_rows)
+    vehicle_col, emergency_col, components = detect_csv_columns(sample)
+    if vehicle_col is None and not components:
+        raise ValueError(f"CSV '{csv_path}' has no vehicle count column")
+    class_columns = list(components) if vehicle_col is None else [vehicle_col]
+    has_time = 'time_s' in sample.columns
+    usecols = list(dict.fromkeys(class_columns + [c for c in (emergency_col, 'time_s' if has_time else None)
+                                                  if c is not None]))
+    dtype = record_dtype(class_columns)
+
+    n_rows = 0
+    edges = []
+    last_flag = 0
+    last_time = -np.inf
+    time_sorted = True
+    tmp = f"{trace_path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(b'\0' * HEADER_BYTES)
+        for chunk in pd.read_csv(csv_path, usecols=usecols, chunksize=chunksize):
+            counts, emergency, time_s = compile_vehicle_frame(chunk, vehicle_col, emergency_col, components)
+            rec = np.zeros(len(chunk), dtype=dtype)
+            rec['time_s'] = time_s if time_s is not None else np.arange(n_rows, n_rows + len(chunk))
+            rec['count'] = counts
+            rec['emergency'] = emergency
+            for name in class_columns:
+                rec[f'class:{name}'] = pd.to_numeric(chunk[name], errors='coerce').fillna(0).to_numpy()
+            if len(rec):
+                t = rec['time_s']
+                time_sorted &= bool(t[0] >= last_time) and bool((np.diff(t) >= 0).all())
+                last_time = t[-1]
+                edges.append(emergency_rising_edges(emergency, last_flag) + n_rows)
+                last_flag = int(emergency[-1])
+            f.write(rec.tobytes())
+            n_rows += len(rec)
+        edges = np.concatenate(edges).astype('<i8') if edges else np.zeros(0, dtype='<i8')
+        f.write(edges.tobytes())
+        schema = {'vehicle_col': vehicle_col, 'emergency_col': emergency_col, 'components': list(components),
+                  'class_columns': class_columns, 'has_time': has_time, 'time_sorted': time_sorted,
+                  'source': os.path.abspath(csv_path), 'source_size': stat.st_size,
+                  'source_mtime': stat.st_mtime}
+        meta = json.dumps(schema).encode()
+        if _HEADER.size + len(meta) > HEADER_BYTES:
+            raise ValueError("trace schema does not fit in the header")
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, VERSION, n_rows, len(edges), dtype.itemsize, len(meta)) + meta)
+    os.replace(tmp, trace_path)
+    return trace_path
+
+
+class VehicleTrace:
+    """Trace đã mở bằng memmap: các cột là view (không đọc đĩa cho tới khi truy cập)"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            head = f.read(HEADER_BYTES)
+        if len(head) < _HEADER.size:
+            raise ValueError(f"'{path}' is not a vehicle trace")
+        magic, version, n_rows, n_edges, itemsize, meta_len = _HEADER.unpack_from(head)
+        if magic != MAGIC:
+            raise ValueError(f"'{path}' is not a vehicle trace")
+        if version != VERSION:
+            raise ValueError(f"unsupported trace version {version} (expected {VERSION})")
+        self.schema = json.loads(head[_HEADER.size:_HEADER.size + meta_len])
+        self.dtype = record_dtype(self.schema['class_columns'])
+        if self.dtype.itemsize != itemsize:
+            raise ValueError(f"'{path}': record size mismatch")
+        # memmap không nhận kích thước 0
+        self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=HEADER_BYTES, shape=(n_rows,)) \
+            if n_rows else np.zeros(0, dtype=self.dtype)
+        self.emergency_edges = np.memmap(path, dtype='<i8', mode='r', offset=HEADER_BYTES + n_rows * itemsize,
+                                         shape=(n_edges,)) if n_edges else np.zeros(0, dtype='<i8')
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def time_s(self):
+        return self.records['time_s']
+
+    @property
+    def counts(self):
+        return self.records['count']
+
+    @property
+    def emergency(self):
+        return self.records['emergency']
+
+    def class_counts(self, name):
+        return self.records[f'class:{name}']
+
+    def seek(self, t):
+        """Dòng đầu tiên có time_s >= t"""
+        if not self.schema['time_sorted']:
+            raise ValueError("trace time_s is not sorted; cannot seek by time")
+        return time_index(self.time_s, t)
+
+    def vehicle_arrays(self):
+        """VehicleArrays (như load_vehicle_arrays) với các cột là view của memmap"""
+        from traffic_control import VehicleArrays
+        s = self.schema
+        return VehicleArrays(self.counts, self.emergency, self.emergency_edges,
+                             self.time_s if s['has_time'] else None,
+                             s['vehicle_col'], s['emergency_col'], s['components'])
+
+
+def is_fresh(csv_path, trace_path):
+    """Cache còn dùng được: mới hơn CSV và ghi từ CSV cùng kích thước"""
+    try:
+        trace_mtime = os.path.getmtime(trace_path)
+        stat = os.stat(csv_path)
+        if trace_mtime < stat.st_mtime:
+            return False
+        return VehicleTrace(trace_path).schema.get('source_size') == stat.st_size
+    except (OSError, ValueError):
+        return False
+
+
+def open_trace(csv_path, trace_path=None, chunksize=DEFAULT_CHUNKSIZE):
+    """Mở trace của CSV, chuyển đổi lại nếu cache chưa có hoặc cũ hơn CSV"""
+    trace_path = trace_path or trace_path_for(csv_path)
+    if not is_fresh(csv_path, trace_path):
+        convert(csv_path, trace_path, chunksize=chunksize)
+    return VehicleTrace(trace_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Binary vehicle count traces')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_conv = sub.add_parser('convert', help='convert a CSV to a .trace file')
+    p_conv.add_argument('csv')
+    p_conv.add_argument('--out', default=None, help='trace path (default: <csv>.trace)')
+    p_conv.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    p_info = sub.add_parser('info', help='show the header of a trace')
+    p_info.add_argument('trace')
+    p_seek = sub.add_parser('seek', help='row index of the first record at or after time_s')
+    p_seek.add_argument('trace')
+    p_seek.add_argument('time_s', type=float)
+    args = parser.parse_args()
+
+    if args.cmd == 'convert':
+        path = convert(args.csv, args.out, chunksize=args.chunksize)
+        trace = VehicleTrace(path)
+        print(f"Trace saved to {path} ({len(trace)} rows, {os.path.getsize(path)} bytes)")
+    elif args.cmd == 'info':
+        trace = VehicleTrace(args.trace)
+        print(json.dumps({'rows': len(trace), 'record_bytes': trace.dtype.itemsize,
+                          'emergency_edges': len(trace.emergency_edges), **trace.schema}, indent=2))
+    else:
+        trace = VehicleTrace(args.trace)
+        row = trace.seek(args.time_s)
+        print(f"row {row}" + (f" (time_s={trace.time_s[row]:g})" if row < len(trace) else " (end of trace)"))
+
+
+if __name__ == "__main__":
+    main()